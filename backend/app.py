@@ -1,38 +1,98 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_file, send_from_directory, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from flask_mail import Mail, Message
+from flask_mail import Mail
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_migrate import Migrate
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
 import os
+import click
 import jwt
-import uuid
 import mimetypes
 from functools import wraps
 
 from config import Config
-from models import db, User, Category, Ticket, Comment, Attachment, Vote
+from models import db, User, Principal, Category, Ticket, Comment, Attachment, Vote, category_cache
+from cache import TTLCache
+from compression import Compressor
+from events import EventHub, format_event
+from mailer import OutboxSender
+from metrics import Metrics
+from passwords import PasswordHasher, PasswordHasherBusy
+from thumbnails import ThumbnailGenerator
+import storage
+import transfer
+import search as search_index
+from pagination import encode_cursor, decode_cursor, after
 
 app = Flask(__name__)
 app.config.from_object(Config)
+# Uploaded files are hashed and size-checked while the request body is parsed
+app.request_class = storage.UploadRequest
+# Temp files of uploads no view stored, on any endpoint and error path
+app.teardown_request(storage.discard_uploads)
 
 # Enable CORS for frontend communication (allow all origins for development)
-CORS(app, origins=['*'])
+CORS(app, origins=['*'], expose_headers=['ETag'])
 
 # Initialize extensions
 db.init_app(app)
+migrate = Migrate(app, db)
 mail = Mail(app)
 
+# gzip/brotli for JSON and other text responses above a size threshold
+compressor = Compressor(app)
+
+# Password hashing runs on a bounded process pool, off the request threads
+password_hasher = PasswordHasher(app)
+
+# Notification emails are queued in the database and sent by background threads
+outbox = OutboxSender(app, mail)
+
+# WebP thumbnails and previews of image attachments, rendered on a thread pool
+thumbnail_generator = ThumbnailGenerator(app)
+
+# Live updates for /api/events streams, optionally fanned out across workers
+event_hub = EventHub(app)
+
+# Per-route latency, status and SQL accounting, scraped from /metrics
+metrics = Metrics(app)
+
+# Authenticated users by id, so token checks don't read the users table on every call
+principal_cache = TTLCache(maxsize=app.config.get('PRINCIPAL_CACHE_SIZE', 10000),
+                           ttl=app.config.get('PRINCIPAL_CACHE_TTL', 30))
+
+# Dashboard statistics cache, keyed by the viewer's ticket scope
+ticket_stats_cache = TTLCache(maxsize=4096, ttl=app.config.get('TICKET_STATS_CACHE_TTL', 30))
+
 # Create upload directory if it doesn't exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+def load_principal(user_id):
+    """Principal for a user id through principal_cache, or None if the user no longer exists"""
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        user = db.session.get(User, user_id)
+        if not user:
+            return None
+        principal = Principal(user)
+        principal_cache.set(user_id, principal)
+    return principal
+
 # JWT token decorator
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         token = request.headers.get('Authorization')
+        in_query = False
+        if not token and request.endpoint == 'stream_events':
+            # EventSource can't send headers, so the event stream takes a stream token as a parameter
+            token = request.args.get('token')
+            in_query = True
         if not token:
             return jsonify({'message': 'Token is missing!'}), 401
         
@@ -40,10 +100,16 @@ def token_required(f):
             if token.startswith('Bearer '):
                 token = token[7:]
             data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user_id = data['user_id']
-            current_user = User.query.get(current_user_id)
-            if not current_user:
+            # Stream tokens end up in URLs and access logs, so they are short-lived, only
+            # open event streams, and are the only tokens accepted in the query string
+            is_stream_token = data.get('scope') == 'events'
+            if is_stream_token != in_query:
+                return jsonify({'message': 'Token is invalid!'}), 401
+            current_user = load_principal(data['user_id'])
+            if current_user is None:
                 return jsonify({'message': 'User not found!'}), 401
+            if current_user.is_active is False:
+                return jsonify({'message': 'Account is deactivated!'}), 401
         except jwt.ExpiredSignatureError:
             return jsonify({'message': 'Token has expired!'}), 401
         except jwt.InvalidTokenError:
@@ -52,6 +118,15 @@ def token_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
+def conditional_json(payload):
+    """JSON response with an ETag of its body; a matching If-None-Match gets an empty 304"""
+    response = jsonify(payload)
+    response.add_etag()
+    # Clients may keep the body but must revalidate before reusing it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 # Authentication routes
 @app.route('/api/auth/register', methods=['POST'])
 def register():
@@ -73,7 +148,7 @@ def register():
         user = User(
             username=data['username'],
             email=data['email'],
-            password_hash=generate_password_hash(data['password']),
+            password_hash=password_hasher.hash(data['password']),
             role=data.get('role', 'user')
         )
         
@@ -82,6 +157,8 @@ def register():
         
         return jsonify({'message': 'User created successfully'}), 201
         
+    except PasswordHasherBusy as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
@@ -95,7 +172,12 @@ def login():
         
         user = User.query.filter_by(email=data['email']).first()
         
-        if user and check_password_hash(user.password_hash, data['password']):
+        if user and password_hasher.verify(user.password_hash, data['password']):
+            # Transparently upgrade hashes made with an older method or cost
+            if password_hasher.needs_rehash(user.password_hash):
+                user.password_hash = password_hasher.hash(data['password'])
+                db.session.commit()
+
             # Generate JWT token
             token = jwt.encode({
                 'user_id': user.id,
@@ -114,6 +196,8 @@ def login():
         
         return jsonify({'message': 'Invalid credentials'}), 401
         
+    except PasswordHasherBusy as e:
+        return jsonify({'message': str(e)}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
@@ -133,14 +217,14 @@ def get_current_user(current_user):
 @app.route('/api/categories', methods=['GET'])
 @token_required
 def get_categories(current_user):
-    categories = Category.query.filter_by(is_active=True).all()
-    return jsonify({
+    categories = category_cache.get().values()
+    return conditional_json({
         'categories': [{
-            'id': cat.id,
-            'name': cat.name,
-            'description': cat.description
-        } for cat in categories]
-    }), 200
+            'id': cat['id'],
+            'name': cat['name'],
+            'description': cat['description']
+        } for cat in categories if cat['is_active']]
+    })
 
 @app.route('/api/categories', methods=['POST'])
 @token_required
@@ -161,6 +245,7 @@ def create_category(current_user):
         
         db.session.add(category)
         db.session.commit()
+        category_cache.invalidate()
         
         return jsonify({
             'message': 'Category created successfully',
@@ -175,6 +260,14 @@ def create_category(current_user):
         return jsonify({'message': str(e)}), 500
 
 # Ticket routes
+# sort_by option -> (sort key column, descending); Ticket.id breaks ties
+TICKET_SORTS = {
+    'created_at_desc': (Ticket.created_at, True),
+    'created_at_asc': (Ticket.created_at, False),
+    'updated_at_desc': (Ticket.updated_at, True),
+    'priority_desc': (Ticket.priority, True)
+}
+
 @app.route('/api/tickets', methods=['GET'])
 @token_required
 def get_tickets(current_user):
@@ -184,12 +277,26 @@ def get_tickets(current_user):
         category_id = request.args.get('category_id', type=int)
         user_id = request.args.get('user_id', type=int)
         search = request.args.get('search')
-        sort_by = request.args.get('sort_by', 'created_at_desc')
+        sort_by = request.args.get('sort_by', 'relevance' if search else 'created_at_desc')
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
-
-        # Build query
-        query = Ticket.query
+        # Passing cursor (empty for the first page) switches to keyset pagination
+        cursor = request.args.get('cursor')
+        include_total = request.args.get('include_total', 'false').lower() == 'true'
+        # view=summary or fields=a,b,... returns compact rows that reference users and
+        # categories by id, with lookup tables for them alongside
+        fields = request.args.get('fields')
+        if fields is not None or request.args.get('view') == 'summary':
+            try:
+                fields = summary_fields(fields)
+            except ValueError as e:
+                return jsonify({'message': str(e)}), 400
+
+        # Build query (relations are joined in so serialization doesn't hit the DB per row)
+        if fields:
+            query = Ticket.summary_query(fields, app.config.get('SUMMARY_DESCRIPTION_LENGTH', 150))
+        else:
+            query = Ticket.eager_query()
 
         # Apply filters
         if status:
@@ -198,34 +305,146 @@ def get_tickets(current_user):
             query = query.filter(Ticket.category_id == category_id)
         if user_id:
             query = query.filter(Ticket.user_id == user_id)
+        rank = snippet = None
         if search:
-            query = query.filter(Ticket.subject.contains(search) | Ticket.description.contains(search))
+            if search_index.is_enabled():
+                query, rank, snippet = search_index.filter_tickets(query, search)
+            else:
+                query = query.filter(Ticket.subject.contains(search) | Ticket.description.contains(search))
 
         # For regular users, only show their own tickets
         if current_user.role == 'user':
             query = query.filter(Ticket.user_id == current_user.id)
 
-        # Apply sorting
-        if sort_by == 'created_at_desc':
-            query = query.order_by(Ticket.created_at.desc())
-        elif sort_by == 'created_at_asc':
-            query = query.order_by(Ticket.created_at.asc())
-        elif sort_by == 'updated_at_desc':
-            query = query.order_by(Ticket.updated_at.desc())
-        elif sort_by == 'priority_desc':
-            priority_order = ['urgent', 'high', 'medium', 'low']
-            query = query.order_by(Ticket.priority.desc())
+        # Apply sorting (relevance only applies to full-text searches)
+        if sort_by == 'relevance' and rank is None:
+            sort_by = 'created_at_desc'
+        if sort_by == 'relevance':
+            if cursor is not None:
+                return jsonify({'message': 'Cursor pagination is not available for relevance sorting'}), 400
+            query = query.order_by(rank, Ticket.id)
+        else:
+            sort_column, descending = TICKET_SORTS.get(sort_by, TICKET_SORTS['created_at_desc'])
+            if descending:
+                query = query.order_by(sort_column.desc(), Ticket.id.desc())
+            else:
+                query = query.order_by(sort_column.asc(), Ticket.id.asc())
+
+        if snippet is not None:
+            query = query.add_columns(snippet)
+
+        if cursor is not None:
+            # Page sizes are bounded for cursor clients only; page= requests keep their old behavior
+            per_page = max(1, min(per_page, app.config.get('TICKETS_MAX_PAGE_SIZE', 100)))
+            return get_tickets_page_after(query, cursor, sort_column, descending, per_page,
+                                          include_total, snippet is not None, fields)
 
         # Paginate
         tickets = query.paginate(page=page, per_page=per_page, error_out=False)
 
-        return jsonify({
-            'tickets': [ticket.to_dict() for ticket in tickets.items],
+        return conditional_json({
+            **serialize_ticket_rows(tickets.items, snippet is not None, fields),
             'total': tickets.total,
             'pages': tickets.pages,
             'current_page': page,
             'per_page': per_page
-        }), 200
+        })
+
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+def summary_fields(value):
+    """Validate a comma separated fields= list; empty means every summary field"""
+    if not value:
+        return list(Ticket.SUMMARY_FIELDS)
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in Ticket.SUMMARY_FIELDS]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}; '
+                         f'available fields: {", ".join(Ticket.SUMMARY_FIELDS)}')
+    return ['id'] + [field for field in dict.fromkeys(fields) if field != 'id']
+
+def serialize_ticket_rows(rows, with_snippet, fields=None):
+    """Serialize ticket list rows, which are (ticket, snippet) pairs for full-text searches.
+
+    Returns the 'tickets' part of the response, plus 'users' and 'categories'
+    lookup tables for summaries.
+    """
+    tickets = [row[0] for row in rows] if with_snippet else rows
+    if fields:
+        results, users, categories = Ticket.serialize_summaries(tickets, fields)
+        payload = {'tickets': results, 'users': users, 'categories': categories}
+    else:
+        results = Ticket.serialize_many(tickets)
+        payload = {'tickets': results}
+    if with_snippet:
+        for result, row in zip(results, rows):
+            result['search_snippet'] = row[1]
+    return payload
+
+def get_tickets_page_after(query, cursor, sort_column, descending, per_page, include_total, with_snippet,
+                           fields=None):
+    """Keyset-paginated ticket list: seeks past the cursor instead of OFFSET scanning"""
+    total = query.order_by(None).count() if include_total else None
+
+    if cursor:
+        try:
+            values = decode_cursor(cursor, 2)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
+        query = query.filter(after((sort_column, Ticket.id), values, descending))
+
+    # One extra row tells us whether there is a next page without counting
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1][0] if with_snippet else rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), last.id)
+
+    result = {
+        **serialize_ticket_rows(rows, with_snippet, fields),
+        'next_cursor': next_cursor,
+        'per_page': per_page
+    }
+    if total is not None:
+        result['total'] = total
+    return conditional_json(result)
+
+@app.route('/api/tickets/stats', methods=['GET'])
+@token_required
+def get_ticket_stats(current_user):
+    try:
+        # Regular users only count their own tickets, everyone else sees all
+        scope = current_user.id if current_user.role == 'user' else 'all'
+        stats = ticket_stats_cache.get(scope)
+
+        if stats is None:
+            query = db.session.query(
+                Ticket.status, Ticket.priority, Ticket.category_id, Ticket.assigned_to,
+                func.count(Ticket.id)
+            )
+            if current_user.role == 'user':
+                query = query.filter(Ticket.user_id == current_user.id)
+            rows = query.group_by(
+                Ticket.status, Ticket.priority, Ticket.category_id, Ticket.assigned_to
+            ).all()
+
+            # Roll the single grouped result up into one breakdown per dimension
+            stats = {'total': 0, 'by_status': {}, 'by_priority': {}, 'by_category': {}, 'by_assignee': {}}
+            for status, priority, category_id, assigned_to, count in rows:
+                stats['total'] += count
+                for breakdown, key in (('by_status', status),
+                                       ('by_priority', priority),
+                                       ('by_category', str(category_id)),
+                                       ('by_assignee', str(assigned_to) if assigned_to else 'unassigned')):
+                    stats[breakdown][key] = stats[breakdown].get(key, 0) + count
+
+            ticket_stats_cache.set(scope, stats)
+
+        return jsonify({'stats': stats}), 200
 
     except Exception as e:
         return jsonify({'message': str(e)}), 500
@@ -250,14 +469,19 @@ def create_ticket(current_user):
         )
 
         db.session.add(ticket)
-        db.session.commit()
+        db.session.flush()
 
-        # Send email notification
+        # Queue the email notification in the same transaction as the ticket
         send_ticket_created_notification(ticket)
+        db.session.commit()
+        ticket_stats_cache.clear()
+
+        ticket_data = ticket.to_dict()
+        event_hub.publish('ticket.created', ticket_data, ticket.user_id)
 
         return jsonify({
             'message': 'Ticket created successfully',
-            'ticket': ticket.to_dict()
+            'ticket': ticket_data
         }), 201
 
     except Exception as e:
@@ -267,15 +491,20 @@ def create_ticket(current_user):
 @token_required
 def get_ticket(current_user, ticket_id):
     try:
-        ticket = Ticket.query.get_or_404(ticket_id)
+        ticket = Ticket.eager_query().filter(Ticket.id == ticket_id).first_or_404()
 
         # Check permissions
         if current_user.role == 'user' and ticket.user_id != current_user.id:
             return jsonify({'message': 'Access denied'}), 403
 
-        return jsonify({
-            'ticket': ticket.to_dict(include_comments=True)
-        }), 200
+        # The first page of the thread; the rest comes from /comments?cursor=
+        result = ticket.to_dict()
+        result['comments'], result['comments_next_cursor'] = get_comments_page(
+            ticket_id, current_user, None, app.config.get('COMMENTS_PAGE_SIZE', 50))
+
+        return conditional_json({
+            'ticket': result
+        })
 
     except Exception as e:
         return jsonify({'message': str(e)}), 500
@@ -306,15 +535,19 @@ def update_ticket(current_user, ticket_id):
             ticket.assigned_to = data['assigned_to']
 
         ticket.updated_at = datetime.utcnow()
-        db.session.commit()
 
-        # Send email notification if status changed
+        # Queue an email notification in the same transaction if status changed
         if old_status != ticket.status:
             send_ticket_status_notification(ticket, old_status)
+        db.session.commit()
+        ticket_stats_cache.clear()
+
+        ticket_data = ticket.to_dict()
+        event_hub.publish('ticket.updated', ticket_data, ticket.user_id)
 
         return jsonify({
             'message': 'Ticket updated successfully',
-            'ticket': ticket.to_dict()
+            'ticket': ticket_data
         }), 200
 
     except Exception as e:
@@ -340,29 +573,139 @@ def delete_ticket(current_user, ticket_id):
         # Delete associated votes
         Vote.query.filter_by(ticket_id=ticket_id).delete()
 
-        # Delete associated attachments and files
+        # Delete associated attachments, dropping their references to stored files
         attachments = Attachment.query.filter_by(ticket_id=ticket_id).all()
+        unreferenced_files = storage.release(attachments)
         for attachment in attachments:
-            # Delete physical file
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], attachment.filename)
-            if os.path.exists(file_path):
-                try:
-                    os.remove(file_path)
-                except OSError as e:
-                    print(f"Error deleting file {file_path}: {e}")
-
-            # Delete attachment record
             db.session.delete(attachment)
 
         # Delete the ticket
+        owner_id = ticket.user_id
         db.session.delete(ticket)
         db.session.commit()
 
+        # Physical files go only once no attachment refers to them anymore
+        storage.remove_files(unreferenced_files)
+        ticket_stats_cache.clear()
+        event_hub.publish('ticket.deleted', {'id': ticket_id}, owner_id)
+
         return jsonify({'message': 'Ticket deleted successfully'}), 200
 
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
+BULK_UPDATE_FIELDS = ('status', 'priority', 'assigned_to')
+
+def bulk_ticket_ids(data):
+    """Validate the ticket_ids of a bulk request; returns (ids, error response)"""
+    ticket_ids = (data or {}).get('ticket_ids')
+    if not isinstance(ticket_ids, list) or not ticket_ids:
+        return None, (jsonify({'message': 'ticket_ids must be a non-empty list'}), 400)
+    if not all(isinstance(ticket_id, int) for ticket_id in ticket_ids):
+        return None, (jsonify({'message': 'ticket_ids must be integers'}), 400)
+
+    ticket_ids = list(dict.fromkeys(ticket_ids))
+    limit = app.config.get('BULK_MAX_TICKETS', 1000)
+    if len(ticket_ids) > limit:
+        return None, (jsonify({'message': f'At most {limit} tickets per bulk request'}), 400)
+    return ticket_ids, None
+
+@app.route('/api/tickets/bulk', methods=['PUT'])
+@token_required
+def bulk_update_tickets(current_user):
+    try:
+        # Bulk changes only cover the fields update_ticket reserves for agents and admins
+        if current_user.role not in ['agent', 'admin']:
+            return jsonify({'message': 'Access denied'}), 403
+
+        data = request.get_json()
+        ticket_ids, error = bulk_ticket_ids(data)
+        if error:
+            return error
+
+        changes = {field: data['changes'][field] for field in BULK_UPDATE_FIELDS
+                   if field in (data.get('changes') or {})}
+        if not changes:
+            return jsonify({'message': f'changes must set at least one of: {", ".join(BULK_UPDATE_FIELDS)}'}), 400
+
+        # Current status and creator of every ticket, for notifications and not_found
+        rows = db.session.query(
+            Ticket.id, Ticket.subject, Ticket.status, Ticket.user_id, User.username, User.email
+        ).join(User, Ticket.user_id == User.id).filter(Ticket.id.in_(ticket_ids)).all()
+        found = {row.id for row in rows}
+
+        updated_at = datetime.utcnow()
+        values = {getattr(Ticket, field): value for field, value in changes.items()}
+        values[Ticket.updated_at] = updated_at
+        updated = Ticket.query.filter(Ticket.id.in_(list(found))).update(values, synchronize_session=False)
+
+        if 'status' in changes:
+            # One email per ticket creator, listing all of their tickets that changed
+            status_changes = {}
+            for row in rows:
+                if row.status != changes['status']:
+                    status_changes.setdefault((row.username, row.email), []).append((row.subject, row.status))
+            assignee = db.session.get(User, changes['assigned_to']) if changes.get('assigned_to') else None
+            for (username, email), tickets in status_changes.items():
+                send_bulk_status_notification(username, email, tickets, changes['status'], assignee)
+        db.session.commit()
+        ticket_stats_cache.clear()
+
+        for row in rows:
+            event_hub.publish('ticket.updated', {'id': row.id, **changes, 'updated_at': updated_at.isoformat()},
+                              row.user_id)
+
+        return jsonify({
+            'message': f'{updated} tickets updated successfully',
+            'updated': updated,
+            'not_found': [ticket_id for ticket_id in ticket_ids if ticket_id not in found]
+        }), 200
+
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+@app.route('/api/tickets/bulk', methods=['DELETE'])
+@token_required
+def bulk_delete_tickets(current_user):
+    try:
+        ticket_ids, error = bulk_ticket_ids(request.get_json())
+        if error:
+            return error
+
+        rows = db.session.query(Ticket.id, Ticket.user_id, Ticket.status).filter(Ticket.id.in_(ticket_ids)).all()
+        found = {row.id for row in rows}
+
+        # Same rules as delete_ticket; the request is refused as a whole if any ticket fails them
+        if current_user.role == 'user':
+            if any(row.user_id != current_user.id for row in rows):
+                return jsonify({'message': 'You can only delete your own tickets'}), 403
+            if any(row.status in ['resolved', 'closed'] for row in rows):
+                return jsonify({'message': 'Cannot delete resolved or closed tickets'}), 400
+
+        Comment.query.filter(Comment.ticket_id.in_(list(found))).delete(synchronize_session=False)
+        Vote.query.filter(Vote.ticket_id.in_(list(found))).delete(synchronize_session=False)
+
+        attachments = Attachment.query.filter(Attachment.ticket_id.in_(list(found))).all()
+        unreferenced_files = storage.release(attachments)
+        Attachment.query.filter(Attachment.ticket_id.in_(list(found))).delete(synchronize_session=False)
+
+        deleted = Ticket.query.filter(Ticket.id.in_(list(found))).delete(synchronize_session=False)
+        db.session.commit()
+
+        storage.remove_files(unreferenced_files)
+        ticket_stats_cache.clear()
+        for row in rows:
+            event_hub.publish('ticket.deleted', {'id': row.id}, row.user_id)
+
+        return jsonify({
+            'message': f'{deleted} tickets deleted successfully',
+            'deleted': deleted,
+            'not_found': [ticket_id for ticket_id in ticket_ids if ticket_id not in found]
+        }), 200
+
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
 @app.route('/api/tickets/<int:ticket_id>/comments', methods=['GET'])
 @token_required
 def get_ticket_comments(current_user, ticket_id):
@@ -373,19 +716,40 @@ def get_ticket_comments(current_user, ticket_id):
         if current_user.role == 'user' and ticket.user_id != current_user.id:
             return jsonify({'message': 'Access denied'}), 403
 
-        comments = Comment.query.filter_by(ticket_id=ticket_id).order_by(Comment.created_at.asc()).all()
-
-        # Filter internal comments for regular users
-        if current_user.role == 'user':
-            comments = [c for c in comments if not c.is_internal]
+        per_page = request.args.get('per_page', app.config.get('COMMENTS_PAGE_SIZE', 50), type=int)
+        per_page = max(1, min(per_page, app.config.get('COMMENTS_MAX_PAGE_SIZE', 200)))
+        try:
+            comments, next_cursor = get_comments_page(ticket_id, current_user, request.args.get('cursor'), per_page)
+        except ValueError as e:
+            return jsonify({'message': str(e)}), 400
 
-        return jsonify({
-            'comments': [comment.to_dict() for comment in comments]
-        }), 200
+        return conditional_json({
+            'comments': comments,
+            'next_cursor': next_cursor,
+            'per_page': per_page
+        })
 
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
+def get_comments_page(ticket_id, current_user, cursor, per_page):
+    """One page of a ticket's comments, oldest first, as (comment dicts, next cursor).
+
+    Regular users never get internal notes; raises ValueError for a malformed cursor.
+    """
+    query = Comment.thread_query(ticket_id, include_internal=current_user.role in ['agent', 'admin'])
+    if cursor:
+        values = decode_cursor(cursor, 2)
+        query = query.filter(after((Comment.created_at, Comment.id), values))
+
+    # One extra row tells us whether there is a next page without counting
+    comments = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(comments) > per_page:
+        comments = comments[:per_page]
+        next_cursor = encode_cursor(comments[-1].created_at, comments[-1].id)
+    return Comment.serialize_many(comments), next_cursor
+
 @app.route('/api/tickets/<int:ticket_id>/comments', methods=['POST'])
 @token_required
 def create_comment(current_user, ticket_id):
@@ -412,14 +776,18 @@ def create_comment(current_user, ticket_id):
 
         # Update ticket's updated_at timestamp
         ticket.updated_at = datetime.utcnow()
-        db.session.commit()
+        db.session.flush()
 
-        # Send email notification
+        # Queue the email notification in the same transaction as the comment
         send_comment_notification(comment)
+        db.session.commit()
+
+        comment_data = comment.to_dict()
+        event_hub.publish('comment.created', comment_data, ticket.user_id, staff_only=comment.is_internal)
 
         return jsonify({
             'message': 'Comment added successfully',
-            'comment': comment.to_dict()
+            'comment': comment_data
         }), 201
 
     except Exception as e:
@@ -441,6 +809,136 @@ def get_users(current_user):
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
+@app.route('/api/events/token', methods=['POST'])
+@token_required
+def create_stream_token(current_user):
+    """Short-lived token for opening /api/events, which has to take it in the URL"""
+    token = jwt.encode({
+        'user_id': current_user.id,
+        'scope': 'events',
+        'exp': datetime.utcnow() + timedelta(seconds=app.config.get('EVENTS_TOKEN_TTL', 60))
+    }, app.config['SECRET_KEY'], algorithm='HS256')
+    return jsonify({'token': token}), 200
+
+@app.route('/api/events', methods=['GET'])
+@token_required
+def stream_events(current_user):
+    """Server-sent event stream of the ticket, comment and vote changes this user may see"""
+    subscription = event_hub.subscribe(current_user)
+    keepalive = app.config.get('EVENTS_KEEPALIVE', 15)
+
+    def still_allowed():
+        # The stream outlives its request, so each check gets its own app context;
+        # admin user updates evict principal_cache, so changes apply at the next event
+        with app.app_context():
+            principal = load_principal(current_user.id)
+        if principal is None or principal.is_active is False or principal.role != subscription.principal.role:
+            return False
+        subscription.principal = principal
+        return True
+
+    def generate():
+        yield 'retry: 3000\n\n'
+        while True:
+            event = subscription.get(timeout=keepalive)
+            # Deactivated or re-roled users lose the stream before anything queued
+            # under their old role is sent; the client reconnects with a new token
+            if not still_allowed():
+                return
+            # Comment lines keep proxies from closing an idle stream
+            yield format_event(event) if event is not None else ': keep-alive\n\n'
+
+    response = app.response_class(generate(), mimetype='text/event-stream')
+    response.call_on_close(lambda: event_hub.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/admin/cache-stats', methods=['GET'])
+@token_required
+def get_cache_stats(current_user):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+
+    return jsonify({
+        'caches': {
+            'principal': principal_cache.stats(),
+            'ticket_stats': ticket_stats_cache.stats(),
+            'categories': category_cache.stats()
+        }
+    }), 200
+
+@metrics.add_collector
+def cache_metrics():
+    caches = {
+        'principal': principal_cache.stats(),
+        'ticket_stats': ticket_stats_cache.stats(),
+        'categories': category_cache.stats()
+    }
+    return [
+        ('cache_hits_total', 'Cache lookups answered from memory.', 'counter',
+         [({'cache': name}, stats['hits']) for name, stats in caches.items()]),
+        ('cache_misses_total', 'Cache lookups that had to load the value.', 'counter',
+         [({'cache': name}, stats['misses']) for name, stats in caches.items()]),
+        ('event_stream_subscribers', 'Open /api/events streams in this process.', 'gauge',
+         [({}, event_hub.subscriber_count)]),
+    ]
+
+@app.route('/api/export/<entity>', methods=['GET'])
+@token_required
+def export_data(current_user, entity):
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+
+    if entity not in transfer.ENTITIES:
+        return jsonify({'message': f'Unknown entity, expected one of: {", ".join(transfer.ENTITIES)}'}), 404
+
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in transfer.FORMATS:
+        return jsonify({'message': f'Invalid format, expected one of: {", ".join(transfer.FORMATS)}'}), 400
+
+    # Incremental exports: tickets updated, or comments/categories created, since a point in time
+    since = request.args.get('since')
+    if since:
+        try:
+            since = datetime.fromisoformat(since)
+        except ValueError:
+            return jsonify({'message': 'since must be an ISO 8601 timestamp'}), 400
+
+    # Rows are fetched and written in chunks while the response is being sent
+    lines = transfer.export_lines(entity, fmt, since or None, app.config.get('EXPORT_BATCH_SIZE', 5000))
+    response = app.response_class(stream_with_context(lines), mimetype=transfer.FORMATS[fmt])
+    response.headers.set('Content-Disposition', 'attachment', filename=f'{entity}.{fmt}')
+    return response
+
+@app.route('/api/import/<entity>', methods=['POST'])
+@token_required
+def import_data(current_user, entity):
+    """Import an NDJSON request body; files larger than MAX_CONTENT_LENGTH go through `flask import-data`"""
+    if current_user.role != 'admin':
+        return jsonify({'message': 'Admin access required'}), 403
+
+    if entity not in transfer.ENTITIES:
+        return jsonify({'message': f'Unknown entity, expected one of: {", ".join(transfer.ENTITIES)}'}), 404
+
+    try:
+        count = transfer.import_lines(entity, request.stream, app.config.get('IMPORT_BATCH_SIZE', 1000))
+        ticket_stats_cache.clear()
+        if entity == 'categories':
+            category_cache.invalidate()
+
+        return jsonify({
+            'message': f'{count} {entity} imported successfully',
+            'imported': count
+        }), 201
+
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+    except IntegrityError as e:
+        return jsonify({'message': f'Import rejected, nothing was imported: {e.orig}'}), 400
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
 @app.route('/api/users/<int:user_id>', methods=['PUT'])
 @token_required
 def update_user(current_user, user_id):
@@ -462,6 +960,8 @@ def update_user(current_user, user_id):
             user.is_active = data['is_active']
 
         db.session.commit()
+        # Role and deactivation changes apply from the user's next request
+        principal_cache.pop(user.id)
 
         return jsonify({
             'message': 'User updated successfully',
@@ -489,6 +989,7 @@ def update_category(current_user, category_id):
             category.is_active = data['is_active']
 
         db.session.commit()
+        category_cache.invalidate()
 
         return jsonify({
             'message': 'Category updated successfully',
@@ -514,6 +1015,7 @@ def delete_category(current_user, category_id):
 
         db.session.delete(category)
         db.session.commit()
+        category_cache.invalidate()
 
         return jsonify({'message': 'Category deleted successfully'}), 200
 
@@ -529,6 +1031,7 @@ def allowed_file(filename):
 @app.route('/api/tickets/<int:ticket_id>/attachments', methods=['POST'])
 @token_required
 def upload_attachment(current_user, ticket_id):
+    stored_path = None
     try:
         ticket = Ticket.query.get_or_404(ticket_id)
 
@@ -546,38 +1049,44 @@ def upload_attachment(current_user, ticket_id):
         if not allowed_file(file.filename):
             return jsonify({'message': 'File type not allowed'}), 400
 
-        # Generate unique filename
         original_filename = secure_filename(file.filename)
-        file_extension = original_filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-
-        # Save file
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(file_path)
+        mime_type = mimetypes.guess_type(original_filename)[0] or 'application/octet-stream'
 
-        # Get file info
-        file_size = os.path.getsize(file_path)
-        mime_type = mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+        # The body was already streamed to disk and hashed while it was parsed;
+        # identical content is kept once and shared
+        upload = file.stream
+        stored_file = storage.store(upload)
+        stored_path = storage.blob_path(stored_file.sha256)
 
         # Create attachment record
         attachment = Attachment(
-            filename=unique_filename,
+            filename=storage.blob_name(stored_file.sha256),
             original_filename=original_filename,
-            file_size=file_size,
+            file_size=upload.size,
             mime_type=mime_type,
             ticket_id=ticket_id,
-            user_id=current_user.id
+            user_id=current_user.id,
+            content_hash=stored_file.sha256
         )
 
         db.session.add(attachment)
         db.session.commit()
 
+        if thumbnail_generator.supports(mime_type):
+            thumbnail_generator.submit(storage.blob_path(stored_file.sha256), stored_file.sha256)
+
         return jsonify({
             'message': 'File uploaded successfully',
             'attachment': attachment.to_dict()
         }), 201
 
+    except RequestEntityTooLarge as e:
+        return jsonify({'message': e.description}), 413
     except Exception as e:
+        if stored_path is not None:
+            # Nothing references the stored file unless another upload's commit already did
+            db.session.rollback()
+            storage.remove_files([stored_path])
         return jsonify({'message': str(e)}), 500
 
 @app.route('/api/attachments/<int:attachment_id>/download', methods=['GET'])
@@ -593,19 +1102,66 @@ def download_attachment(current_user, attachment_id):
 
         file_path = os.path.join(app.config['UPLOAD_FOLDER'], attachment.filename)
 
-        if not os.path.exists(file_path):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
             return jsonify({'message': 'File not found'}), 404
 
+        etag = storage.download_etag(attachment, stat)
+        if app.config.get('ATTACHMENT_OFFLOAD'):
+            return storage.offload_response(attachment, etag)
+
+        # conditional=True answers If-None-Match with 304 and Range with 206
         return send_from_directory(
             app.config['UPLOAD_FOLDER'],
             attachment.filename,
+            mimetype=attachment.mime_type,
             as_attachment=True,
-            download_name=attachment.original_filename
+            download_name=attachment.original_filename,
+            conditional=True,
+            etag=etag
         )
 
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
+@app.route('/api/attachments/<int:attachment_id>/thumbnail', methods=['GET'])
+@token_required
+def get_attachment_thumbnail(current_user, attachment_id):
+    try:
+        attachment = Attachment.query.get_or_404(attachment_id)
+        ticket = attachment.ticket
+
+        # Check permissions
+        if current_user.role == 'user' and ticket.user_id != current_user.id:
+            return jsonify({'message': 'Access denied'}), 403
+
+        size = request.args.get('size', 'thumb')
+        if size not in thumbnail_generator.sizes:
+            return jsonify({'message': f'Invalid size, expected one of: {", ".join(thumbnail_generator.sizes)}'}), 400
+
+        if not thumbnail_generator.supports(attachment.mime_type):
+            return jsonify({'message': 'No preview available for this attachment'}), 404
+
+        source_path = os.path.join(app.config['UPLOAD_FOLDER'], attachment.filename)
+        if not os.path.exists(source_path):
+            return jsonify({'message': 'File not found'}), 404
+
+        # Usually rendered right after upload; otherwise this waits for or runs the job
+        key = os.path.basename(attachment.filename)
+        path = thumbnail_generator.ensure(source_path, key, size)
+
+        response = send_file(path, mimetype='image/webp', conditional=True,
+                             etag=f'{key}-{size}', max_age=31536000)
+        # Derivatives of a stored file never change, but they are not public
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.immutable = True
+        return response
+
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
 @app.route('/api/tickets/<int:ticket_id>/attachments', methods=['GET'])
 @token_required
 def get_attachments(current_user, ticket_id):
@@ -641,14 +1197,20 @@ def vote_ticket(current_user, ticket_id):
         # Check if user already voted
         existing_vote = Vote.query.filter_by(ticket_id=ticket_id, user_id=current_user.id).first()
 
+        # Counter changes are applied in the same transaction as the Vote row change
         if existing_vote:
             if existing_vote.vote_type == vote_type:
                 # Remove vote if same type
                 db.session.delete(existing_vote)
+                Ticket.apply_vote_delta(ticket_id, **{vote_type: -1})
+                user_vote_type = None
                 message = f'{vote_type.capitalize()}vote removed'
             else:
                 # Change vote type
+                previous_type = existing_vote.vote_type
                 existing_vote.vote_type = vote_type
+                Ticket.apply_vote_delta(ticket_id, **{vote_type: 1, previous_type: -1})
+                user_vote_type = vote_type
                 message = f'Vote changed to {vote_type}vote'
         else:
             # Create new vote
@@ -658,25 +1220,24 @@ def vote_ticket(current_user, ticket_id):
                 vote_type=vote_type
             )
             db.session.add(new_vote)
+            Ticket.apply_vote_delta(ticket_id, **{vote_type: 1})
+            user_vote_type = vote_type
             message = f'{vote_type.capitalize()}voted successfully'
 
         db.session.commit()
 
-        # Get updated vote score
-        upvotes = Vote.query.filter_by(ticket_id=ticket_id, vote_type='up').count()
-        downvotes = Vote.query.filter_by(ticket_id=ticket_id, vote_type='down').count()
-        vote_score = upvotes - downvotes
-
-        # Get user's current vote
-        user_vote = Vote.query.filter_by(ticket_id=ticket_id, user_id=current_user.id).first()
-        user_vote_type = user_vote.vote_type if user_vote else None
+        # Counters were expired by the commit and reload with a single row read
+        tally = {
+            'vote_score': ticket.vote_score,
+            'upvotes': ticket.upvotes,
+            'downvotes': ticket.downvotes
+        }
+        event_hub.publish('ticket.voted', {'ticket_id': ticket.id, **tally}, ticket.user_id)
 
         return jsonify({
             'message': message,
-            'vote_score': vote_score,
             'user_vote': user_vote_type,
-            'upvotes': upvotes,
-            'downvotes': downvotes
+            **tally
         }), 200
 
     except Exception as e:
@@ -688,19 +1249,15 @@ def get_ticket_votes(current_user, ticket_id):
     try:
         ticket = Ticket.query.get_or_404(ticket_id)
 
-        upvotes = Vote.query.filter_by(ticket_id=ticket_id, vote_type='up').count()
-        downvotes = Vote.query.filter_by(ticket_id=ticket_id, vote_type='down').count()
-        vote_score = upvotes - downvotes
-
         # Get user's current vote
         user_vote = Vote.query.filter_by(ticket_id=ticket_id, user_id=current_user.id).first()
         user_vote_type = user_vote.vote_type if user_vote else None
 
         return jsonify({
-            'vote_score': vote_score,
+            'vote_score': ticket.vote_score,
             'user_vote': user_vote_type,
-            'upvotes': upvotes,
-            'downvotes': downvotes
+            'upvotes': ticket.upvotes,
+            'downvotes': ticket.downvotes
         }), 200
 
     except Exception as e:
@@ -708,22 +1265,15 @@ def get_ticket_votes(current_user, ticket_id):
 
 # Email notification functions
 def send_email(to_email, subject, body):
-    """Send email notification"""
+    """Queue email notification for delivery once the current transaction commits"""
     try:
         if not app.config['MAIL_USERNAME']:
             print(f"Email notification (not configured): {subject} to {to_email}")
             return
 
-        msg = Message(
-            subject=subject,
-            sender=app.config['MAIL_USERNAME'],
-            recipients=[to_email],
-            body=body
-        )
-        mail.send(msg)
-        print(f"Email sent: {subject} to {to_email}")
+        outbox.enqueue(to_email, subject, body)
     except Exception as e:
-        print(f"Failed to send email: {e}")
+        print(f"Failed to queue email: {e}")
 
 def send_ticket_created_notification(ticket):
     """Send notification when ticket is created"""
@@ -769,6 +1319,28 @@ QuickDesk Support Team
     """
     send_email(ticket.creator.email, subject, body)
 
+def send_bulk_status_notification(username, email, tickets, new_status, assignee=None):
+    """Send one notification covering several tickets of the same creator"""
+    subject = (f"Ticket Status Updated: {tickets[0][0]}" if len(tickets) == 1
+               else f"{len(tickets)} Tickets Updated to {new_status.title()}")
+    lines = '\n'.join(f"- {ticket_subject}: {old_status.title()} → {new_status.title()}"
+                      for ticket_subject, old_status in tickets)
+    body = f"""
+Hello {username},
+
+The status of {len(tickets)} of your support tickets has been updated.
+
+{lines}
+
+{f"Assigned to: {assignee.username}" if assignee else ""}
+
+You can view your ticket details by logging into QuickDesk.
+
+Best regards,
+QuickDesk Support Team
+    """
+    send_email(email, subject, body)
+
 def send_comment_notification(comment):
     """Send notification when comment is added"""
     ticket = comment.ticket
@@ -794,6 +1366,86 @@ QuickDesk Support Team
         """
         send_email(ticket.creator.email, subject, body)
 
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Create the full-text ticket index if needed and repopulate it."""
+    with db.engine.begin() as connection:
+        count = search_index.rebuild(connection)
+    print(f"Search index rebuilt for {count} tickets")
+
+@app.cli.command('send-outbox')
+def send_outbox_command():
+    """Deliver every queued email that is due, then exit."""
+    count = outbox.drain()
+    print(f"Delivered {count} queued emails")
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """EXPLAIN the hot API queries and fail if any of them misses its index."""
+    from query_plans import check_query_plans
+
+    failed = False
+    for name, index, steps, ok in check_query_plans():
+        print(f"{'OK  ' if ok else 'FAIL'} {name} (expects {index}): {' | '.join(steps)}")
+        failed = failed or not ok
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command('reconcile-votes')
+def reconcile_votes_command():
+    """Rebuild the denormalized ticket vote counters from the Vote table."""
+    count = Ticket.rebuild_vote_counters()
+    print(f"Vote counters rebuilt for {count} tickets")
+
+@app.cli.command('export-data')
+@click.argument('entity', type=click.Choice(list(transfer.ENTITIES)))
+@click.argument('output', type=click.File('w'), default='-')
+@click.option('--format', 'fmt', type=click.Choice(list(transfer.FORMATS)), default='ndjson')
+@click.option('--since', type=click.DateTime(), default=None, help='Only rows changed since this time.')
+def export_data_command(entity, output, fmt, since):
+    """Stream categories, tickets or comments to a file as NDJSON or CSV."""
+    for chunk in transfer.export_lines(entity, fmt, since, app.config.get('EXPORT_BATCH_SIZE', 5000)):
+        output.write(chunk)
+
+@app.cli.command('import-data')
+@click.argument('entity', type=click.Choice(list(transfer.ENTITIES)))
+@click.argument('input', type=click.File('r'), default='-')
+def import_data_command(entity, input):
+    """Insert categories, tickets or comments from an NDJSON file in batches."""
+    count = transfer.import_lines(entity, input, app.config.get('IMPORT_BATCH_SIZE', 1000))
+    if entity == 'categories':
+        category_cache.invalidate()
+    print(f"Imported {count} {entity}")
+
+@app.cli.command('generate-data')
+@click.option('--tickets', type=click.IntRange(0), default=10000, show_default=True)
+@click.option('--users', type=click.IntRange(0), default=1000, show_default=True)
+@click.option('--agents', type=click.IntRange(1), default=50, show_default=True)
+@click.option('--categories', type=click.IntRange(1), default=8, show_default=True,
+              help='Categories to use; missing ones are created.')
+@click.option('--comments-per-ticket', type=click.FloatRange(0), default=6.0, show_default=True)
+@click.option('--votes-per-ticket', type=click.FloatRange(0), default=4.0, show_default=True)
+@click.option('--days', type=click.IntRange(1), default=365, show_default=True,
+              help='Spread ticket creation over this many past days.')
+@click.option('--seed', type=int, default=1, show_default=True)
+@click.option('--batch-size', type=click.IntRange(1), default=5000, show_default=True)
+@click.option('--password', default=None, help='Password for every generated account (default: none can log in).')
+def generate_data_command(tickets, users, agents, categories, comments_per_ticket, votes_per_ticket,
+                          days, seed, batch_size, password):
+    """Append a reproducible synthetic dataset for load testing and capacity planning."""
+    import datagen
+
+    db.create_all()
+    counts = datagen.generate(
+        tickets, users=users, agents=agents, categories=categories,
+        comments_per_ticket=comments_per_ticket, votes_per_ticket=votes_per_ticket, days=days,
+        seed=seed, batch_size=batch_size,
+        password_hash=password_hasher.hash(password) if password else '!',
+        progress=lambda done: print(f"  {done}/{tickets} tickets", end='\r'))
+    category_cache.invalidate()
+    print(f"\nGenerated {counts['users']} users, {counts['categories']} categories, {counts['tickets']} tickets, "
+          f"{counts['comments']} comments and {counts['votes']} votes in {counts['seconds']}s")
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
@@ -813,6 +1465,7 @@ if __name__ == '__main__':
                 db.session.add(category)
             
             db.session.commit()
+            category_cache.invalidate()
             print("Default categories created")
         
         # Create default admin user if it doesn't exist
@@ -821,11 +1474,14 @@ if __name__ == '__main__':
             admin = User(
                 username='admin',
                 email='admin@quickdesk.com',
-                password_hash=generate_password_hash('admin123'),
+                password_hash=password_hasher.hash('admin123'),
                 role='admin'
             )
             db.session.add(admin)
             db.session.commit()
             print("Default admin user created: admin@quickdesk.com / admin123")
+        
+        # Load categories before the first request needs them
+        category_cache.get()
     
     app.run(debug=False, port=5000)
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Thread-safe, size-bounded LRU cache whose entries expire after `ttl` seconds"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl
+            }
+
+
+class SharedVersionCache:
+    """Process-local copy of a small, rarely written dataset.
+
+    `loader` builds the value on first use. Writers call invalidate() after
+    committing: it drops this process's copy and replaces a signal file, so
+    every other process sees the file's stat change on its next get() and
+    reloads too. `signal_file` is a path or a callable returning one.
+    """
+
+    def __init__(self, loader, signal_file):
+        self.loader = loader
+        self.signal_file = signal_file
+        self.hits = 0
+        self.misses = 0
+        self._value = None
+        self._loaded_signal = None
+        self._lock = threading.Lock()
+
+    def _path(self):
+        return self.signal_file() if callable(self.signal_file) else self.signal_file
+
+    def _signal(self):
+        try:
+            stat = os.stat(self._path())
+        except FileNotFoundError:
+            return None
+        # The file is replaced on every write, so the inode changes even on coarse clocks
+        return stat.st_ino, stat.st_mtime_ns
+
+    def get(self):
+        signal = self._signal()
+        with self._lock:
+            if self._value is not None and self._loaded_signal == signal:
+                self.hits += 1
+                return self._value
+            self.misses += 1
+            # The signal is read before loading, so a write racing with the load forces another one
+            self._value = self.loader()
+            self._loaded_signal = signal
+            return self._value
+
+    def invalidate(self):
+        path = self._path()
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            f.write(f'{time.time_ns()} {os.getpid()}\n')
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._value = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'loaded': self._value is not None
+            }
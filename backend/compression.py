@@ -0,0 +1,93 @@
+"""gzip/brotli compression of API responses.
+
+Responses of an allowed content type and at least COMPRESS_MIN_SIZE bytes
+are compressed with brotli when the client accepts it and the `brotli`
+package is installed, otherwise with gzip. Streamed responses (exports) are
+gzip-compressed chunk by chunk so they keep streaming. File downloads,
+partial content and responses that are already encoded are left alone.
+"""
+import gzip
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+DEFAULT_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'text/csv',
+    'text/html',
+    'text/plain',
+    'text/css',
+    'application/javascript',
+}
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        # Sync-flush so every chunk reaches the client as soon as it is produced
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class Compressor:
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            app.after_request(self.compress)
+
+    def config(self, key, default):
+        return self.app.config.get(key, default)
+
+    def _encoding(self, streamed):
+        offered = ['gzip'] if streamed or brotli is None else ['br', 'gzip']
+        return request.accept_encodings.best_match(offered)
+
+    def compress(self, response):
+        if not self.config('COMPRESS_ENABLED', True):
+            return response
+        if response.mimetype not in self.config('COMPRESS_MIMETYPES', DEFAULT_MIMETYPES):
+            return response
+        # Files are served (and range-requested) as they are on disk
+        if response.direct_passthrough:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers or request.method == 'HEAD'):
+            return response
+
+        streamed = response.is_streamed
+        encoding = self._encoding(streamed)
+        if encoding is None:
+            return response
+
+        level = self.config('COMPRESS_LEVEL', 6)
+        if streamed:
+            response.response = _gzip_stream(response.response, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.config('COMPRESS_MIN_SIZE', 500):
+                return response
+            if encoding == 'br':
+                data = brotli.compress(data, quality=self.config('COMPRESS_BROTLI_QUALITY', 4))
+            else:
+                data = gzip.compress(data, compresslevel=level)
+            response.set_data(data)
+
+        response.headers['Content-Encoding'] = encoding
+        # The compressed bytes differ from what the strong validator described
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,217 @@
+"""Synthetic helpdesk data for capacity planning and benchmarks.
+
+``generate`` appends users, tickets, comments and votes to the database
+with Core executemany batches, one transaction per BATCH of tickets and
+their comments and votes, so memory stays flat and an interrupted run
+leaves whole tickets behind. Ids are assigned up front from the current
+maximum, so related rows never have to be read back; on PostgreSQL the id
+sequences are moved past them at the end.
+
+The data is skewed the way a real helpdesk is: a few categories, agents
+and customers account for most tickets (Zipf), ticket volume grows over
+time, older tickets are mostly resolved or closed, and comment and vote
+counts are heavy-tailed (Pareto), with ticket vote counters matching the
+Vote rows. The same seed and arguments always produce the same rows.
+
+On SQLite the full-text search triggers are dropped for the load and the
+index is rebuilt once at the end, which is far cheaper than updating it
+row by row.
+"""
+import math
+import random
+import time
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from sqlalchemy import func, select
+
+import search as search_index
+from models import db, User, Category, Ticket, Comment, Vote
+from transfer import reset_id_sequence
+
+STATUSES_BY_AGE = [
+    # (minimum age in days, status weights for open, in_progress, resolved, closed)
+    (60, (2, 3, 25, 70)),
+    (14, (10, 15, 45, 30)),
+    (2, (30, 35, 25, 10)),
+    (0, (70, 25, 5, 0)),
+]
+STATUSES = ['open', 'in_progress', 'resolved', 'closed']
+PRIORITIES = ['low', 'medium', 'high', 'urgent']
+PRIORITY_WEIGHTS = [30, 45, 20, 5]
+
+WORDS = ['printer', 'login', 'password', 'network', 'email', 'invoice', 'laptop', 'vpn', 'outage', 'billing',
+         'refund', 'crash', 'slow', 'error', 'update', 'license', 'access', 'backup', 'monitor', 'account',
+         'payment', 'server', 'timeout', 'sync', 'install', 'permission', 'report', 'export', 'mobile', 'wifi']
+
+
+class Zipf:
+    """Draws indexes 0..n-1 with probability proportional to 1 / (i + 1) ** s"""
+
+    def __init__(self, n, s=1.1):
+        self.cumulative = list(accumulate(1 / (i + 1) ** s for i in range(n)))
+
+    def draw(self, rng):
+        return bisect(self.cumulative, rng.random() * self.cumulative[-1])
+
+
+def heavy_tailed(rng, mean, alpha=1.5, limit=None):
+    """Non-negative integer with the given mean and a Pareto tail"""
+    value = int(mean * (alpha - 1) * (rng.paretovariate(alpha) - 1) + 0.5)
+    return min(value, limit) if limit is not None else value
+
+
+def _sentence(rng, low, high):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+def _next_id(connection, model):
+    return (connection.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def generate(tickets, users=1000, agents=50, categories=8, comments_per_ticket=6.0, votes_per_ticket=4.0,
+             days=365, seed=1, batch_size=5000, password_hash='!', progress=None):
+    """Append a synthetic dataset; returns the number of rows inserted per table.
+
+    password_hash is stored for every generated account (the default '!' can't
+    match any password). progress, if given, is called with the number of
+    tickets written so far after every batch.
+    """
+    if min(tickets, users, comments_per_ticket, votes_per_ticket) < 0:
+        raise ValueError('tickets, users, comments_per_ticket and votes_per_ticket must not be negative')
+    if min(agents, categories, days, batch_size) < 1:
+        raise ValueError('agents, categories, days and batch_size must be at least 1')
+
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    start = now - timedelta(days=days)
+    counts = {'users': 0, 'categories': 0, 'tickets': 0, 'comments': 0, 'votes': 0}
+    started = time.perf_counter()
+
+    with db.engine.connect() as connection:
+        sqlite = connection.dialect.name == 'sqlite'
+        if sqlite:
+            # Durability of a scratch load isn't worth an fsync per transaction
+            synchronous = connection.exec_driver_sql('PRAGMA synchronous').scalar()
+            connection.exec_driver_sql('PRAGMA synchronous = OFF')
+            search_index.drop_triggers(connection)
+            connection.commit()
+
+        try:
+            with connection.begin():
+                category_ids = list(connection.execute(select(Category.id).order_by(Category.id)).scalars())
+                next_category = _next_id(connection, Category)
+                extra = [{'id': next_category + i, 'name': f'Generated category {next_category + i}',
+                          'description': _sentence(rng, 3, 8), 'created_at': start, 'is_active': True}
+                         for i in range(max(0, categories - len(category_ids)))]
+                if extra:
+                    connection.execute(Category.__table__.insert(), extra)
+                category_ids += [row['id'] for row in extra]
+                counts['categories'] = len(extra)
+
+                first_user = _next_id(connection, User)
+                user_rows = [{
+                    'id': first_user + i,
+                    'username': f'gen{first_user + i}',
+                    'email': f'gen{first_user + i}@example.com',
+                    'password_hash': password_hash,
+                    'role': 'agent' if i < agents else 'user',
+                    'created_at': start,
+                    'is_active': True,
+                } for i in range(agents + users)]
+                for offset in range(0, len(user_rows), batch_size):
+                    connection.execute(User.__table__.insert(), user_rows[offset:offset + batch_size])
+                counts['users'] = len(user_rows)
+
+                next_ticket = _next_id(connection, Ticket)
+                next_comment = _next_id(connection, Comment)
+                next_vote = _next_id(connection, Vote)
+
+            agent_ids = [first_user + i for i in range(agents)]
+            customer_ids = [first_user + agents + i for i in range(users)] or agent_ids
+            everyone = len(agent_ids) + len(customer_ids)
+            pick_category = Zipf(len(category_ids))
+            pick_agent = Zipf(len(agent_ids), s=0.8)
+            pick_customer = Zipf(len(customer_ids), s=0.7)
+            span = (now - start).total_seconds()
+
+            for batch_start in range(0, tickets, batch_size):
+                ticket_rows, comment_rows, vote_rows = [], [], []
+                for n in range(batch_start, min(tickets, batch_start + batch_size)):
+                    ticket_id = next_ticket + n
+                    # Density grows over time, and ids follow creation order
+                    created = start + timedelta(seconds=span * math.sqrt((n + rng.random()) / tickets))
+                    age_days = (now - created).total_seconds() / 86400
+                    weights = next(w for min_age, w in STATUSES_BY_AGE if age_days >= min_age)
+                    status = rng.choices(STATUSES, weights)[0]
+                    creator = customer_ids[pick_customer.draw(rng)]
+                    assignee = agent_ids[pick_agent.draw(rng)] if status != 'open' or rng.random() < 0.3 else None
+
+                    updated = created
+                    for c in range(heavy_tailed(rng, comments_per_ticket, limit=2000)):
+                        updated = min(now, updated + timedelta(minutes=rng.expovariate(1 / 240)))
+                        by_agent = c % 2 == 0
+                        comment_rows.append({
+                            'id': next_comment,
+                            'content': _sentence(rng, 5, 40),
+                            'created_at': updated,
+                            'is_internal': by_agent and rng.random() < 0.15,
+                            'ticket_id': ticket_id,
+                            'user_id': (assignee or agent_ids[pick_agent.draw(rng)]) if by_agent else creator,
+                        })
+                        next_comment += 1
+
+                    votes = {'up': 0, 'down': 0}
+                    voter_count = heavy_tailed(rng, votes_per_ticket, limit=everyone)
+                    for voter in rng.sample(range(everyone), voter_count):
+                        vote_type = 'up' if rng.random() < 0.8 else 'down'
+                        votes[vote_type] += 1
+                        vote_rows.append({
+                            'id': next_vote,
+                            'vote_type': vote_type,
+                            'created_at': created,
+                            'ticket_id': ticket_id,
+                            'user_id': agent_ids[voter] if voter < len(agent_ids)
+                            else customer_ids[voter - len(agent_ids)],
+                        })
+                        next_vote += 1
+
+                    ticket_rows.append({
+                        'id': ticket_id,
+                        'subject': f'{rng.choice(WORDS).capitalize()} {rng.choice(WORDS)} {rng.choice(WORDS)}',
+                        'description': _sentence(rng, 20, 120),
+                        'status': status,
+                        'priority': rng.choices(PRIORITIES, PRIORITY_WEIGHTS)[0],
+                        'created_at': created,
+                        'updated_at': updated,
+                        'upvotes': votes['up'],
+                        'downvotes': votes['down'],
+                        'user_id': creator,
+                        'category_id': category_ids[pick_category.draw(rng)],
+                        'assigned_to': assignee,
+                    })
+
+                with connection.begin():
+                    connection.execute(Ticket.__table__.insert(), ticket_rows)
+                    if comment_rows:
+                        connection.execute(Comment.__table__.insert(), comment_rows)
+                    if vote_rows:
+                        connection.execute(Vote.__table__.insert(), vote_rows)
+                counts['tickets'] += len(ticket_rows)
+                counts['comments'] += len(comment_rows)
+                counts['votes'] += len(vote_rows)
+                if progress is not None:
+                    progress(counts['tickets'])
+        finally:
+            with connection.begin():
+                for model in (Category, User, Ticket, Comment, Vote):
+                    reset_id_sequence(connection, model.__table__)
+                if sqlite:
+                    search_index.rebuild(connection)
+            if sqlite:
+                connection.exec_driver_sql(f'PRAGMA synchronous = {synchronous}')
+                connection.commit()
+
+    counts['seconds'] = round(time.perf_counter() - started, 1)
+    return counts
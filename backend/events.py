@@ -0,0 +1,211 @@
+"""Server-sent events for live ticket, comment and vote updates.
+
+Handlers publish events to the EventHub after committing. Every open
+/api/events stream has a Subscription, a bounded queue that only receives
+the events its user may see: agents and admins see everything, users see
+events about their own tickets, and internal comments go to staff only.
+
+With several worker processes, set EVENTS_BROKER to the host:port of an
+EventBroker (`python events.py 7070`). Each hub then forwards what it
+publishes to the broker, which relays it to every other connected hub.
+"""
+import json
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+
+class Subscription:
+    def __init__(self, principal, maxsize):
+        self.principal = principal
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+    def can_see(self, event):
+        if self.principal.role in ('agent', 'admin'):
+            return True
+        return not event['staff_only'] and event['owner_id'] == self.principal.id
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A client that can't keep up is told to reload instead of stalling publishers
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Next event, a 'resync' marker after an overflow, or None on timeout"""
+        if self.overflowed:
+            self.overflowed = False
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            return {'type': 'resync', 'data': {}}
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+def format_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+class EventHub:
+    def __init__(self, app=None):
+        self.app = app
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._broker = None
+        self._broker_lock = threading.Lock()
+        self._reader = None
+
+    def config(self, key, default):
+        return self.app.config.get(key, default)
+
+    def subscribe(self, principal):
+        subscription = Subscription(principal, self.config('EVENTS_QUEUE_SIZE', 100))
+        with self._lock:
+            self._subscriptions.add(subscription)
+        self._ensure_broker()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def publish(self, event_type, data, owner_id, staff_only=False):
+        """Send an event to every stream allowed to see it, here and in other workers.
+
+        owner_id is the id of the ticket's creator; staff_only hides the event
+        from regular users entirely (internal comments).
+        """
+        event = {'type': event_type, 'data': data, 'owner_id': owner_id, 'staff_only': staff_only}
+        self._deliver(event)
+        if self._ensure_broker():
+            self._forward(event)
+
+    def _deliver(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.can_see(event):
+                subscription.put(event)
+
+    def _ensure_broker(self):
+        """Connect to EVENTS_BROKER on first use; returns whether a broker is configured"""
+        address = self.config('EVENTS_BROKER', None)
+        if not address:
+            return False
+        with self._broker_lock:
+            if self._reader is None:
+                host, port = address.rsplit(':', 1)
+                try:
+                    self._broker = socket.create_connection((host, int(port)), timeout=5)
+                    self._broker.settimeout(None)
+                except OSError as e:
+                    print(f"Event broker unavailable: {e}")
+                self._reader = threading.Thread(target=self._read_broker, args=(host, int(port)),
+                                                name='events-broker', daemon=True)
+                self._reader.start()
+        return True
+
+    def _forward(self, event):
+        line = (json.dumps(event, default=str) + '\n').encode()
+        with self._broker_lock:
+            if self._broker is None:
+                return
+            try:
+                self._broker.sendall(line)
+            except OSError as e:
+                print(f"Event broker send failed: {e}")
+
+    def _read_broker(self, host, port):
+        while True:
+            with self._broker_lock:
+                connection = self._broker
+            try:
+                if connection is None:
+                    connection = socket.create_connection((host, port))
+                    with self._broker_lock:
+                        self._broker = connection
+                for line in connection.makefile('rb'):
+                    self._deliver(json.loads(line))
+            except (OSError, ValueError) as e:
+                print(f"Event broker connection lost: {e}")
+            with self._broker_lock:
+                self._broker = None
+            if connection is not None:
+                connection.close()
+            time.sleep(1)
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+
+    def handle(self):
+        broker = self.server.broker
+        with broker.lock:
+            broker.clients.add(self)
+        try:
+            for line in self.rfile:
+                broker.relay(self, line)
+        finally:
+            with broker.lock:
+                broker.clients.discard(self)
+
+
+class _BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class EventBroker:
+    """Relays each line a connected hub sends to all the other hubs"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.clients = set()
+        self.lock = threading.Lock()
+        self._server = _BrokerServer((host, port), _BrokerHandler)
+        self._server.broker = self
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def relay(self, sender, line):
+        with self.lock:
+            clients = [client for client in self.clients if client is not sender]
+        for client in clients:
+            try:
+                with client.write_lock:
+                    client.wfile.write(line)
+            except OSError:
+                pass
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 7070
+    broker = EventBroker(port=port)
+    print(f"Event broker listening on {broker.address[0]}:{broker.address[1]}")
+    try:
+        broker._server.serve_forever()
+    except KeyboardInterrupt:
+        broker.stop()
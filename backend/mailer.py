@@ -0,0 +1,162 @@
+"""Transactional email outbox drained by a background sender pool.
+
+Request handlers only add an OutgoingEmail row to their session, so the
+message is committed together with the change it reports and a handler that
+rolls back sends nothing; the senders are woken once that commit has
+happened. Sender threads claim due
+rows, deliver them over a reused SMTP connection and retry failures with
+exponential backoff. A claim pushes next_attempt_at forward by a lease, so
+several threads or processes can drain the same table without sending a
+message twice. If a sender dies mid-delivery, its messages become due again
+when the lease runs out.
+"""
+import threading
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, OutgoingEmail
+
+
+class OutboxSender:
+    def __init__(self, app=None, mail=None):
+        self.app = app
+        self.mail = mail
+        self._threads = []
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        event.listen(Session, 'after_commit', self._after_commit)
+
+    def config(self, key, default):
+        return self.app.config.get(key, default)
+
+    def enqueue(self, recipient, subject, body):
+        """Add a message to the current transaction; it is sent once that commits"""
+        db.session.add(OutgoingEmail(recipient=recipient, subject=subject, body=body))
+        db.session.info['outbox_pending'] = True
+
+    def _after_commit(self, session):
+        # Releasing a savepoint doesn't make the messages visible to the senders yet
+        if session.in_nested_transaction() or not session.info.pop('outbox_pending', False):
+            return
+        if not self.app.testing and self.config('MAIL_OUTBOX_WORKERS', 2) > 0:
+            self.start()
+        self._wakeup.set()
+
+    def start(self):
+        """Start the sender threads once per process"""
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stopping.clear()
+            for i in range(self.config('MAIL_OUTBOX_WORKERS', 2)):
+                thread = threading.Thread(target=self._run, name=f'outbox-sender-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        poll_interval = self.config('MAIL_OUTBOX_POLL_INTERVAL', 10)
+        while not self._stopping.is_set():
+            try:
+                with self.app.app_context():
+                    self.drain()
+            except Exception as e:
+                print(f"Outbox sender error: {e}")
+            # Sleep until new mail is queued or retries may have become due
+            self._wakeup.wait(poll_interval)
+            self._wakeup.clear()
+
+    def _claim(self):
+        """Lease up to a batch of due messages to this sender"""
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=self.config('MAIL_OUTBOX_LEASE', 300))
+        candidates = db.session.query(OutgoingEmail.id).filter(
+            OutgoingEmail.status == 'pending',
+            OutgoingEmail.next_attempt_at <= now
+        ).order_by(OutgoingEmail.next_attempt_at).limit(self.config('MAIL_OUTBOX_BATCH_SIZE', 20)).all()
+
+        claimed = []
+        for (message_id,) in candidates:
+            # Only one sender can move a given due row forward
+            updated = OutgoingEmail.query.filter(
+                OutgoingEmail.id == message_id,
+                OutgoingEmail.status == 'pending',
+                OutgoingEmail.next_attempt_at <= now
+            ).update({
+                OutgoingEmail.next_attempt_at: lease_until,
+                OutgoingEmail.attempts: OutgoingEmail.attempts + 1
+            }, synchronize_session=False)
+            if updated:
+                claimed.append(message_id)
+        db.session.commit()
+
+        if not claimed:
+            return []
+        return OutgoingEmail.query.filter(OutgoingEmail.id.in_(claimed)).all()
+
+    def _mark_failed_attempt(self, message, error):
+        message.last_error = str(error)
+        if message.attempts >= self.config('MAIL_OUTBOX_MAX_ATTEMPTS', 5):
+            message.status = 'failed'
+        else:
+            base = self.config('MAIL_OUTBOX_RETRY_BASE', 30)
+            backoff = min(base * 2 ** (message.attempts - 1), self.config('MAIL_OUTBOX_RETRY_MAX', 3600))
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.__exit__(None, None, None)
+        except Exception:
+            pass
+
+    def drain(self):
+        """Send every due message, reusing one SMTP connection while there is work.
+
+        Returns the number of messages delivered.
+        """
+        sender = self.config('MAIL_USERNAME', None) or self.config('MAIL_DEFAULT_SENDER', None)
+        connection = None
+        delivered = 0
+        try:
+            while not self._stopping.is_set():
+                batch = self._claim()
+                if not batch:
+                    break
+
+                for message in batch:
+                    try:
+                        if connection is None:
+                            connection = self.mail.connect().__enter__()
+                        connection.send(Message(
+                            subject=message.subject,
+                            sender=sender,
+                            recipients=[message.recipient],
+                            body=message.body
+                        ))
+                        message.status = 'sent'
+                        message.sent_at = datetime.utcnow()
+                        message.last_error = None
+                        delivered += 1
+                    except Exception as e:
+                        print(f"Failed to send email {message.id}: {e}")
+                        self._mark_failed_attempt(message, e)
+                        # The connection may be unusable; open a fresh one for the next message
+                        if connection is not None:
+                            self._close(connection)
+                            connection = None
+                    db.session.commit()
+        finally:
+            if connection is not None:
+                self._close(connection)
+        return delivered
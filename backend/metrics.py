@@ -0,0 +1,211 @@
+"""Request and SQL metrics in the Prometheus text format.
+
+For every request the hooks record, per route pattern (``/api/tickets/<int:ticket_id>``
+rather than the concrete URL, so label sets stay bounded):
+
+- a latency histogram and a request counter by status code
+- the number of SQL statements it ran and the time spent in them, taken from
+  SQLAlchemy cursor events
+- how many requests are in flight
+
+``GET /metrics`` renders everything, plus any gauges contributed by
+collectors (cache statistics, event stream subscribers). Recording is a
+couple of perf_counter() calls and one short lock per request.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DEFAULT_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # bisect_left puts a value equal to a bound into that bound's bucket (le semantics)
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self, app=None, prefix='quickdesk'):
+        self.app = app
+        self.prefix = prefix
+        self.collectors = []
+        self._lock = threading.Lock()
+        self._requests = {}       # (method, route, status) -> count
+        self._latency = {}        # (method, route) -> Histogram
+        self._queries = {}        # route -> Histogram of statements per request
+        self._db_seconds = {}     # route -> cumulative seconds spent in SQL
+        self._in_flight = 0
+        if app is not None:
+            self.init_app(app)
+
+    def config(self, key, default):
+        return self.app.config.get(key, default)
+
+    def init_app(self, app):
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', self._handle_error)
+
+    def add_collector(self, collector):
+        """Register a callable returning (name, help, type, [(labels dict, value), ...]) tuples"""
+        self.collectors.append(collector)
+        return collector
+
+    # Request hooks
+
+    def _start(self):
+        g._metrics = {'start': time.perf_counter(), 'queries': 0, 'db_seconds': 0.0, 'status': 500}
+        with self._lock:
+            self._in_flight += 1
+
+    def _finish(self, response):
+        # Recorded at teardown, so later after_request work (compression) is included;
+        # a view that raises never gets here and counts as a 500
+        state = g.get('_metrics')
+        if state is not None:
+            state['status'] = response.status_code
+        return response
+
+    def _teardown(self, exc):
+        state = g.pop('_metrics', None)
+        if state is None:
+            return
+        elapsed = time.perf_counter() - state['start']
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        method = request.method
+
+        with self._lock:
+            self._in_flight -= 1
+            key = (method, route, state['status'])
+            self._requests[key] = self._requests.get(key, 0) + 1
+            latency = self._latency.get((method, route))
+            if latency is None:
+                latency = self._latency[(method, route)] = Histogram(
+                    self.config('METRICS_LATENCY_BUCKETS', DEFAULT_LATENCY_BUCKETS))
+            latency.observe(elapsed)
+            queries = self._queries.get(route)
+            if queries is None:
+                queries = self._queries[route] = Histogram(
+                    self.config('METRICS_QUERY_BUCKETS', DEFAULT_QUERY_BUCKETS))
+            queries.observe(state['queries'])
+            self._db_seconds[route] = self._db_seconds.get(route, 0.0) + state['db_seconds']
+
+    # SQL accounting; statements outside a request (CLI, background threads) are ignored
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._record_query(conn)
+
+    def _handle_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute; count it here so its
+        # start time isn't left behind on the pooled connection
+        if exception_context.connection is not None and exception_context.execution_context is not None:
+            self._record_query(exception_context.connection)
+
+    def _record_query(self, conn):
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        state = g.get('_metrics') if has_request_context() else None
+        if state is not None:
+            state['queries'] += 1
+            state['db_seconds'] += elapsed
+
+    # Exposition
+
+    def snapshot(self):
+        """Copy of the request metrics, for tests and ad-hoc inspection"""
+        with self._lock:
+            return {
+                'requests': dict(self._requests),
+                'latency': {key: (h.count, h.sum) for key, h in self._latency.items()},
+                'queries': {route: (h.count, h.sum) for route, h in self._queries.items()},
+                'db_seconds': dict(self._db_seconds),
+                'in_flight': self._in_flight
+            }
+
+    def _histogram_lines(self, name, histograms, label_names):
+        for key, histogram in sorted(histograms.items()):
+            labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                yield f'{name}_bucket{{{_labels(**labels, le=le)}}} {cumulative}'
+            yield f'{name}_sum{{{_labels(**labels)}}} {_number(histogram.sum)}'
+            yield f'{name}_count{{{_labels(**labels)}}} {histogram.count}'
+
+    def render_text(self):
+        p = self.prefix
+        with self._lock:
+            lines = [
+                f'# HELP {p}_http_requests_total Requests handled, by route and status code.',
+                f'# TYPE {p}_http_requests_total counter',
+            ]
+            for (method, route, status), count in sorted(self._requests.items()):
+                lines.append(f'{p}_http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}')
+
+            lines += [f'# HELP {p}_http_request_duration_seconds Time to produce the response.',
+                      f'# TYPE {p}_http_request_duration_seconds histogram']
+            lines += self._histogram_lines(f'{p}_http_request_duration_seconds', self._latency, ('method', 'route'))
+
+            lines += [f'# HELP {p}_http_requests_in_flight Requests currently being handled.',
+                      f'# TYPE {p}_http_requests_in_flight gauge',
+                      f'{p}_http_requests_in_flight {self._in_flight}']
+
+            lines += [f'# HELP {p}_db_queries_per_request SQL statements executed per request.',
+                      f'# TYPE {p}_db_queries_per_request histogram']
+            lines += self._histogram_lines(f'{p}_db_queries_per_request', self._queries, ('route',))
+
+            lines += [f'# HELP {p}_db_query_seconds_total Time spent executing SQL, by route.',
+                      f'# TYPE {p}_db_query_seconds_total counter']
+            for route, seconds in sorted(self._db_seconds.items()):
+                lines.append(f'{p}_db_query_seconds_total{{{_labels(route=route)}}} {_number(seconds)}')
+
+        for collector in self.collectors:
+            for name, help_text, metric_type, samples in collector():
+                lines += [f'# HELP {p}_{name} {help_text}', f'# TYPE {p}_{name} {metric_type}']
+                for labels, value in samples:
+                    label_text = f'{{{_labels(**labels)}}}' if labels else ''
+                    lines.append(f'{p}_{name}{label_text} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def render(self):
+        token = self.config('METRICS_TOKEN', None)
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(self.render_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,37 @@
+"""content addressed attachments
+
+Revision ID: 4fff2816628b
+Revises: 8e82b5d7810a
+Create Date: 2026-10-17 06:08:39.975512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4fff2816628b'
+down_revision = '8e82b5d7810a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stored_file',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.Column('ref_count', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.create_foreign_key('fk_attachment_content_hash', 'stored_file', ['content_hash'], ['sha256'])
+
+
+def downgrade():
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_attachment_content_hash', type_='foreignkey')
+        batch_op.drop_column('content_hash')
+
+    op.drop_table('stored_file')
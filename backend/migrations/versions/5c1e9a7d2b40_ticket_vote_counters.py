@@ -0,0 +1,37 @@
+"""ticket vote counters
+
+Revision ID: 5c1e9a7d2b40
+Revises: 347763315e53
+Create Date: 2026-10-17 06:04:12.418820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e9a7d2b40'
+down_revision = '347763315e53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('upvotes', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('downvotes', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill from existing votes (same statement as `flask reconcile-votes`)
+    op.execute("""
+        UPDATE ticket SET
+            upvotes = (SELECT count(vote.id) FROM vote
+                       WHERE vote.ticket_id = ticket.id AND vote.vote_type = 'up'),
+            downvotes = (SELECT count(vote.id) FROM vote
+                         WHERE vote.ticket_id = ticket.id AND vote.vote_type = 'down')
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.drop_column('downvotes')
+        batch_op.drop_column('upvotes')
@@ -0,0 +1,41 @@
+"""email outbox
+
+Revision ID: 8e82b5d7810a
+Revises: a83f6d4c91e2
+Create Date: 2026-10-17 06:04:07.051359
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e82b5d7810a'
+down_revision = 'a83f6d4c91e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('outgoing_email',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('recipient', sa.String(length=120), nullable=False),
+    sa.Column('subject', sa.String(length=255), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('outgoing_email', schema=None) as batch_op:
+        batch_op.create_index('ix_outgoing_email_status_next_attempt', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('outgoing_email', schema=None) as batch_op:
+        batch_op.drop_index('ix_outgoing_email_status_next_attempt')
+
+    op.drop_table('outgoing_email')
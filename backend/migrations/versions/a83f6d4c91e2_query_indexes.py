@@ -0,0 +1,60 @@
+"""query indexes
+
+Revision ID: a83f6d4c91e2
+Revises: 5c1e9a7d2b40
+Create Date: 2026-10-17 06:09:47.502236
+
+Composite indexes for the filters and orderings used by the API: ticket lists
+(status / category / creator filters sorted by created_at, plus the other sort
+orders), comment threads per ticket, vote tallies and attachment lookups.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83f6d4c91e2'
+down_revision = '5c1e9a7d2b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.create_index('ix_ticket_assigned_to', ['assigned_to'], unique=False)
+        batch_op.create_index('ix_ticket_category_created_at', ['category_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_ticket_created_at', ['created_at', 'id'], unique=False)
+        batch_op.create_index('ix_ticket_priority', ['priority', 'id'], unique=False)
+        batch_op.create_index('ix_ticket_status_created_at', ['status', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_ticket_updated_at', ['updated_at', 'id'], unique=False)
+        batch_op.create_index('ix_ticket_user_created_at', ['user_id', 'created_at', 'id'], unique=False)
+
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.create_index('ix_attachment_ticket_id', ['ticket_id'], unique=False)
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_ticket_created_at', ['ticket_id', 'created_at', 'id'], unique=False)
+
+    with op.batch_alter_table('vote', schema=None) as batch_op:
+        batch_op.create_index('ix_vote_ticket_type', ['ticket_id', 'vote_type'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('vote', schema=None) as batch_op:
+        batch_op.drop_index('ix_vote_ticket_type')
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_ticket_created_at')
+
+    with op.batch_alter_table('attachment', schema=None) as batch_op:
+        batch_op.drop_index('ix_attachment_ticket_id')
+
+    with op.batch_alter_table('ticket', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_user_created_at')
+        batch_op.drop_index('ix_ticket_updated_at')
+        batch_op.drop_index('ix_ticket_status_created_at')
+        batch_op.drop_index('ix_ticket_priority')
+        batch_op.drop_index('ix_ticket_created_at')
+        batch_op.drop_index('ix_ticket_category_created_at')
+        batch_op.drop_index('ix_ticket_assigned_to')
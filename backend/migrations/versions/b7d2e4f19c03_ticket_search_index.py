@@ -0,0 +1,27 @@
+"""ticket full-text search index
+
+Revision ID: b7d2e4f19c03
+Revises: 4fff2816628b
+Create Date: 2026-10-17 07:05:12.731402
+
+"""
+from alembic import op
+
+import search
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e4f19c03'
+down_revision = '4fff2816628b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite only: the FTS5 table, its sync triggers, and rows for existing tickets
+    # (same as `flask rebuild-search-index`). Other databases use the LIKE fallback.
+    search.rebuild(op.get_bind())
+
+
+def downgrade():
+    search.uninstall(op.get_bind())
@@ -0,0 +1,34 @@
+"""wider password hash
+
+Revision ID: d41c8a6e5f27
+Revises: b7d2e4f19c03
+Create Date: 2026-10-17 07:40:18.264917
+
+scrypt hashes (about 162 characters) don't fit in 120.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41c8a6e5f27'
+down_revision = 'b7d2e4f19c03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=120),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password_hash',
+               existing_type=sa.String(length=255),
+               type_=sa.String(length=120),
+               existing_nullable=False)
@@ -1,14 +1,24 @@
+import os
+
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload, load_only, with_expression
 from datetime import datetime
 
+from cache import SharedVersionCache
+
 db = SQLAlchemy()
 
+# Image attachments that get thumbnails and previews (rendered by thumbnails.py)
+PREVIEW_TYPES = {'image/png', 'image/jpeg', 'image/gif'}
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(120), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='user')  # user, agent, admin
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
@@ -32,6 +42,24 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+class Principal:
+    """Detached, read-only snapshot of an authenticated user.
+
+    token_required caches these between requests, so unlike a User instance
+    it never needs a session to read its attributes.
+    """
+    __slots__ = ('id', 'username', 'email', 'role', 'created_at', 'is_active')
+
+    def __init__(self, user):
+        for field in self.__slots__:
+            setattr(self, field, getattr(user, field))
+
+    def to_dict(self):
+        return User.to_dict(self)
+
+    def __repr__(self):
+        return f'<Principal {self.username}>'
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
@@ -54,6 +82,18 @@ class Category(db.Model):
     def __repr__(self):
         return f'<Category {self.name}>'
 
+def load_categories():
+    """Every category as a dict, keyed by id (inactive ones included for old tickets)"""
+    return {category.id: category.to_dict() for category in Category.query.order_by(Category.id)}
+
+def category_signal_file():
+    # Shared by all workers like the uploads themselves, unless configured otherwise
+    return (current_app.config.get('CATEGORY_CACHE_SIGNAL_FILE')
+            or os.path.join(current_app.config['UPLOAD_FOLDER'], '.categories-version'))
+
+# Categories change rarely; writers must call category_cache.invalidate() after committing
+category_cache = SharedVersionCache(load_categories, category_signal_file)
+
 class Ticket(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     subject = db.Column(db.String(200), nullable=False)
@@ -63,23 +103,152 @@ class Ticket(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Denormalized vote tallies, kept in step with the Vote table by vote_ticket
+    upvotes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    downvotes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Foreign Keys
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
     assigned_to = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     
+    # Indexes matching the list filters and sort orders in get_tickets (id breaks ties)
+    __table_args__ = (
+        db.Index('ix_ticket_created_at', 'created_at', 'id'),
+        db.Index('ix_ticket_updated_at', 'updated_at', 'id'),
+        db.Index('ix_ticket_priority', 'priority', 'id'),
+        db.Index('ix_ticket_status_created_at', 'status', 'created_at', 'id'),
+        db.Index('ix_ticket_category_created_at', 'category_id', 'created_at', 'id'),
+        db.Index('ix_ticket_user_created_at', 'user_id', 'created_at', 'id'),
+        db.Index('ix_ticket_assigned_to', 'assigned_to'),
+    )
+    
     # Relationships
     comments = db.relationship('Comment', backref='ticket', lazy=True, cascade='all, delete-orphan')
     attachments = db.relationship('Attachment', backref='ticket', lazy=True, cascade='all, delete-orphan')
     votes = db.relationship('Vote', backref='ticket', lazy=True, cascade='all, delete-orphan')
 
+    # Start of the description, computed in SQL for summary listings (see summary_query)
+    description_preview = db.query_expression()
+
+    # Fields of the compact list representation; users and categories are referenced by id
+    SUMMARY_FIELDS = ('id', 'subject', 'description', 'status', 'priority', 'created_at', 'updated_at',
+                      'user_id', 'category_id', 'assigned_to', 'vote_score')
+
     @property
     def vote_score(self):
-        upvotes = Vote.query.filter_by(ticket_id=self.id, vote_type='up').count()
-        downvotes = Vote.query.filter_by(ticket_id=self.id, vote_type='down').count()
-        return upvotes - downvotes
+        return (self.upvotes or 0) - (self.downvotes or 0)
+
+    @staticmethod
+    def apply_vote_delta(ticket_id, up=0, down=0):
+        """Adjust a ticket's vote counters in SQL as part of the current transaction"""
+        Ticket.query.filter_by(id=ticket_id).update({
+            Ticket.upvotes: Ticket.upvotes + up,
+            Ticket.downvotes: Ticket.downvotes + down,
+            # Votes are not edits; keep onupdate from bumping the timestamp
+            Ticket.updated_at: Ticket.updated_at
+        }, synchronize_session=False)
+
+    @staticmethod
+    def rebuild_vote_counters():
+        """Recompute every ticket's vote counters from the Vote table"""
+        def tally(vote_type):
+            return db.select(func.count(Vote.id)).where(
+                Vote.ticket_id == Ticket.id, Vote.vote_type == vote_type
+            ).scalar_subquery()
+
+        result = db.session.execute(
+            db.update(Ticket).values(
+                upvotes=tally('up'),
+                downvotes=tally('down'),
+                updated_at=Ticket.updated_at
+            )
+        )
+        db.session.commit()
+        return result.rowcount
+
+    @classmethod
+    def eager_query(cls):
+        """Ticket query that loads creator and assignee in the same SELECT (categories come from category_cache)"""
+        return cls.query.options(
+            joinedload(cls.creator),
+            joinedload(cls.assignee)
+        )
+
+    @classmethod
+    def summary_query(cls, fields, description_length=150):
+        """Ticket query that only reads the columns needed for the given summary fields"""
+        # id and the sort keys are always loaded for ordering and cursors
+        columns = {column.key: column for column in (cls.id, cls.created_at, cls.updated_at, cls.priority)}
+        for field in fields:
+            if field == 'vote_score':
+                columns.update(upvotes=cls.upvotes, downvotes=cls.downvotes)
+            elif field != 'description':
+                columns[field] = getattr(cls, field)
+
+        options = [load_only(*columns.values())]
+        if 'description' in fields:
+            options.append(with_expression(cls.description_preview,
+                                           func.substr(cls.description, 1, description_length)))
+        return cls.query.options(*options)
+
+    def to_summary(self, fields):
+        result = {}
+        for field in fields:
+            if field == 'description':
+                result[field] = self.description_preview
+            elif field in ('created_at', 'updated_at'):
+                result[field] = getattr(self, field).isoformat()
+            else:
+                result[field] = getattr(self, field)
+        return result
+
+    @classmethod
+    def serialize_summaries(cls, tickets, fields):
+        """Summaries of a page of tickets plus the users and categories they reference, by id"""
+        results = [ticket.to_summary(fields) for ticket in tickets]
+
+        user_ids = {result[field] for result in results for field in ('user_id', 'assigned_to')
+                    if result.get(field) is not None}
+        users = {}
+        if user_ids:
+            users = {user_id: {'id': user_id, 'username': username} for user_id, username in
+                     db.session.query(User.id, User.username).filter(User.id.in_(user_ids))}
+
+        all_categories = category_cache.get()
+        categories = {}
+        for result in results:
+            category = all_categories.get(result.get('category_id'))
+            if category is not None:
+                categories[category['id']] = {'id': category['id'], 'name': category['name']}
+        return results, users, categories
+
+    @classmethod
+    def serialize_many(cls, tickets):
+        """Serialize a page of tickets without per-row queries.
+
+        Relations should already be eager loaded (see eager_query); user dicts
+        are built once per distinct object and shared between rows, and category
+        dicts come from category_cache.
+        """
+        related = {}
+        categories = category_cache.get()
+        return [ticket.to_dict(related=related, categories=categories) for ticket in tickets]
+
+    def to_dict(self, related=None, categories=None):
+        if related is None:
+            related = {}
+        if categories is None:
+            categories = category_cache.get()
+
+        def related_dict(obj):
+            if obj is None:
+                return None
+            key = (type(obj).__name__, obj.id)
+            if key not in related:
+                related[key] = obj.to_dict()
+            return related[key]
 
-    def to_dict(self, include_comments=False):
         result = {
             'id': self.id,
             'subject': self.subject,
@@ -92,14 +261,10 @@ class Ticket(db.Model):
             'category_id': self.category_id,
             'assigned_to': self.assigned_to,
             'vote_score': self.vote_score,
-            'creator': self.creator.to_dict() if self.creator else None,
-            'category': self.category.to_dict() if self.category else None,
-            'assignee': self.assignee.to_dict() if self.assignee else None
+            'creator': related_dict(self.creator),
+            'category': categories.get(self.category_id) or related_dict(self.category),
+            'assignee': related_dict(self.assignee)
         }
-        
-        if include_comments:
-            result['comments'] = [comment.to_dict() for comment in self.comments]
-            
         return result
 
     def __repr__(self):
@@ -114,8 +279,32 @@ class Comment(db.Model):
     # Foreign Keys
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    
+    # Comment threads are read per ticket in creation order
+    __table_args__ = (db.Index('ix_comment_ticket_created_at', 'ticket_id', 'created_at', 'id'),)
 
-    def to_dict(self):
+    @classmethod
+    def thread_query(cls, ticket_id, include_internal):
+        """Comments of a ticket in creation order, with authors loaded in the same SELECT.
+
+        Internal notes are filtered out in SQL unless include_internal is set.
+        """
+        query = cls.query.options(joinedload(cls.author)).filter(cls.ticket_id == ticket_id)
+        if not include_internal:
+            query = query.filter(cls.is_internal.isnot(True))
+        return query.order_by(cls.created_at.asc(), cls.id.asc())
+
+    @classmethod
+    def serialize_many(cls, comments):
+        """Serialize a page of comments, building each author's dict once"""
+        authors = {}
+        return [comment.to_dict(authors) for comment in comments]
+
+    def to_dict(self, authors=None):
+        if authors is None:
+            authors = {}
+        if self.author is not None and self.user_id not in authors:
+            authors[self.user_id] = self.author.to_dict()
         return {
             'id': self.id,
             'content': self.content,
@@ -123,15 +312,25 @@ class Comment(db.Model):
             'is_internal': self.is_internal,
             'ticket_id': self.ticket_id,
             'user_id': self.user_id,
-            'author': self.author.to_dict() if self.author else None
+            'author': authors.get(self.user_id)
         }
 
     def __repr__(self):
         return f'<Comment {self.id}>'
 
+class StoredFile(db.Model):
+    # Uploaded content, stored once per distinct SHA-256 and shared by attachments
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StoredFile {self.sha256} refs={self.ref_count}>'
+
 class Attachment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(255), nullable=False)
+    filename = db.Column(db.String(255), nullable=False)  # path relative to UPLOAD_FOLDER
     original_filename = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
     mime_type = db.Column(db.String(100), nullable=False)
@@ -140,6 +339,11 @@ class Attachment(db.Model):
     # Foreign Keys
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Null for files uploaded before content-addressed storage
+    content_hash = db.Column(db.String(64), db.ForeignKey('stored_file.sha256', name='fk_attachment_content_hash'),
+                             nullable=True)
+    
+    __table_args__ = (db.Index('ix_attachment_ticket_id', 'ticket_id'),)
 
     def to_dict(self):
         return {
@@ -148,6 +352,7 @@ class Attachment(db.Model):
             'original_filename': self.original_filename,
             'file_size': self.file_size,
             'mime_type': self.mime_type,
+            'has_preview': self.mime_type in PREVIEW_TYPES,
             'uploaded_at': self.uploaded_at.isoformat(),
             'ticket_id': self.ticket_id,
             'user_id': self.user_id
@@ -165,8 +370,11 @@ class Vote(db.Model):
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
-    # Ensure one vote per user per ticket
-    __table_args__ = (db.UniqueConstraint('ticket_id', 'user_id', name='unique_vote_per_user_ticket'),)
+    # Ensure one vote per user per ticket; tallies are counted per (ticket, type)
+    __table_args__ = (
+        db.UniqueConstraint('ticket_id', 'user_id', name='unique_vote_per_user_ticket'),
+        db.Index('ix_vote_ticket_type', 'ticket_id', 'vote_type'),
+    )
 
     def to_dict(self):
         return {
@@ -179,3 +387,21 @@ class Vote(db.Model):
 
     def __repr__(self):
         return f'<Vote {self.vote_type} by {self.user_id} on {self.ticket_id}>'
+
+class OutgoingEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    # Also used as a lease: a sender claims a message by pushing this into the future
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_outgoing_email_status_next_attempt', 'status', 'next_attempt_at'),)
+
+    def __repr__(self):
+        return f'<OutgoingEmail {self.id} to {self.recipient} ({self.status})>'
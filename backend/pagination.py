@@ -0,0 +1,56 @@
+"""Keyset (cursor) pagination helpers.
+
+A cursor is the sort key of the last row on a page plus its id, JSON encoded
+and wrapped in urlsafe base64 so clients treat it as opaque.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def _decode_value(obj):
+    if set(obj) == {'$dt'}:
+        return datetime.fromisoformat(obj['$dt'])
+    return obj
+
+
+def encode_cursor(*values):
+    """Build an opaque cursor from the last row's sort key values"""
+    payload = json.dumps(values, default=_encode_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """Inverse of encode_cursor; raises ValueError for malformed cursors"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded), object_hook=_decode_value)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def after(columns, values, descending=False):
+    """Condition selecting rows that sort strictly after `values`.
+
+    `columns` is the full sort key, most significant first (the last one must
+    be unique, normally the primary key), all ordered in the same direction.
+    Expanded to OR-of-ANDs rather than a row-value comparison so every
+    backend can drive it from a composite index.
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        past = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*[columns[j] == values[j] for j in range(i)], past))
+    return or_(*clauses)
@@ -0,0 +1,82 @@
+"""Password hashing on a bounded process pool.
+
+Hashing is deliberately CPU-heavy, and running it on the request thread
+holds the GIL, which stalls every other request the worker is serving.
+PasswordHasher hands the work to a small process pool instead. The pool is
+bounded: when too many hashes are queued, callers get PasswordHasherBusy
+instead of an ever-growing login latency.
+
+PASSWORD_HASH_METHOD is a werkzeug method spec, e.g. 'pbkdf2:sha256:600000'
+or 'scrypt'. Stored hashes made with any other method or cost are upgraded
+on the next successful login (see needs_rehash).
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.app = app
+        self._pool = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._prefixes = {}   # method spec -> prefix werkzeug writes for it
+
+    def config(self, key, default):
+        return self.app.config.get(key, default)
+
+    @property
+    def method(self):
+        return self.config('PASSWORD_HASH_METHOD', DEFAULT_METHOD)
+
+    def _run(self, func, *args):
+        workers = self.config('PASSWORD_HASH_WORKERS', 2)
+        if workers <= 0:
+            return func(*args)
+
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=workers)
+                # Running jobs plus a short queue; anything beyond that is turned away
+                self._slots = threading.BoundedSemaphore(
+                    workers + self.config('PASSWORD_HASH_QUEUE', 4 * workers))
+
+        if not self._slots.acquire(timeout=self.config('PASSWORD_HASH_QUEUE_TIMEOUT', 5)):
+            raise PasswordHasherBusy('Too many password checks in progress, please retry')
+        try:
+            return self._pool.submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if the hash was made with a different method or cost than configured"""
+        return pwhash.split('$', 1)[0] != self.hash_prefix()
+
+    def hash_prefix(self):
+        """Method prefix werkzeug writes for the configured spec, with its defaults filled in
+        ('pbkdf2:sha256' becomes 'pbkdf2:sha256:600000'); found by hashing once"""
+        method = self.method
+        prefix = self._prefixes.get(method)
+        if prefix is None:
+            prefix = self._prefixes[method] = self._run(generate_password_hash, '', method).split('$', 1)[0]
+        return prefix
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,70 @@
+"""EXPLAIN-based check that the API's hot queries are served by an index.
+
+Each entry builds the same query shape the corresponding endpoint runs and
+names the index it is expected to use. `check_query_plans` asks the database
+for its plan and reports any query that falls back to a full scan or a
+temporary sort.
+"""
+from sqlalchemy import func, text
+
+from models import db, Ticket, Comment, Vote, Attachment
+
+
+def hot_queries():
+    """(name, query, expected index) for the access paths used in app.py"""
+    return [
+        ('tickets newest first',
+         Ticket.query.order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(10),
+         'ix_ticket_created_at'),
+        ('tickets oldest first',
+         Ticket.query.order_by(Ticket.created_at.asc(), Ticket.id.asc()).limit(10),
+         'ix_ticket_created_at'),
+        ('tickets recently updated',
+         Ticket.query.order_by(Ticket.updated_at.desc(), Ticket.id.desc()).limit(10),
+         'ix_ticket_updated_at'),
+        ('tickets by priority',
+         Ticket.query.order_by(Ticket.priority.desc(), Ticket.id.desc()).limit(10),
+         'ix_ticket_priority'),
+        ('tickets filtered by status',
+         Ticket.query.filter(Ticket.status == 'open')
+         .order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(10),
+         'ix_ticket_status_created_at'),
+        ('tickets filtered by category',
+         Ticket.query.filter(Ticket.category_id == 1)
+         .order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(10),
+         'ix_ticket_category_created_at'),
+        ('tickets of one user',
+         Ticket.query.filter(Ticket.user_id == 1)
+         .order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(10),
+         'ix_ticket_user_created_at'),
+        ('tickets assigned to an agent',
+         Ticket.query.filter(Ticket.assigned_to == 1),
+         'ix_ticket_assigned_to'),
+        ('comment thread',
+         Comment.query.filter(Comment.ticket_id == 1)
+         .order_by(Comment.created_at.asc(), Comment.id.asc()),
+         'ix_comment_ticket_created_at'),
+        ('vote tally',
+         db.session.query(func.count(Vote.id)).filter(Vote.ticket_id == 1, Vote.vote_type == 'up'),
+         'ix_vote_ticket_type'),
+        ('ticket attachments',
+         Attachment.query.filter(Attachment.ticket_id == 1),
+         'ix_attachment_ticket_id'),
+    ]
+
+
+def explain(query):
+    """Return the plan steps for a query (SQLite EXPLAIN QUERY PLAN)"""
+    sql = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+
+
+def check_query_plans():
+    """Yield (name, expected index, plan steps, ok) for every hot query"""
+    for name, query, index in hot_queries():
+        steps = explain(query)
+        plan = ' | '.join(steps)
+        ok = (index in plan
+              and not any(step.startswith('SCAN') and 'INDEX' not in step for step in steps)
+              and 'TEMP B-TREE' not in plan)
+        yield name, index, steps, ok
@@ -0,0 +1,59 @@
+"""Count the SQL statements a block of code executes.
+
+    with QueryCounter() as queries:
+        client.get('/api/tickets')
+    print(queries.count, queries.statements)
+
+    with query_budget(3):            # AssertionError listing the statements if exceeded
+        client.get('/api/tickets/1')
+
+    @query_budget(2)                 # also works as a decorator
+    def load_thread(): ...
+
+Statements are captured with a before_cursor_execute listener on the engine
+(``db.engine`` of the current app unless one is given), so everything that
+reaches the database counts, including lazy loads during serialization.
+"""
+from contextlib import ContextDecorator
+
+from sqlalchemy import event
+
+from models import db
+
+
+class QueryCounter(ContextDecorator):
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self._engine = self.engine if self.engine is not None else db.engine
+        self.statements = []
+        event.listen(self._engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self._engine, 'before_cursor_execute', self._record)
+        return False
+
+
+class query_budget(QueryCounter):
+    """QueryCounter that fails with AssertionError when more than `limit` statements run"""
+
+    def __init__(self, limit, engine=None):
+        super().__init__(engine)
+        self.limit = limit
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        if exc_type is None and self.count > self.limit:
+            listing = '\n'.join(f'  {i}. {statement}' for i, statement in enumerate(self.statements, 1))
+            raise AssertionError(f'{self.count} queries executed, budget is {self.limit}:\n{listing}')
+        return False
@@ -0,0 +1,160 @@
+"""Full-text ticket search backed by an SQLite FTS5 index.
+
+The ``ticket_search`` virtual table holds one row per ticket (rowid = ticket id)
+with the subject, description and the concatenated text of its public comments.
+Triggers on ``ticket`` and ``comment`` keep it in sync with every write, including
+set-based updates and deletes that bypass the ORM. Internal notes are never
+indexed, so matches and snippets can't leak them to regular users.
+
+On databases without FTS5 (e.g. PostgreSQL in production) callers fall back to
+a LIKE filter; see ``is_enabled``.
+"""
+import re
+
+from sqlalchemy import column, event, false, func, literal_column, table, text
+
+from models import db, Ticket
+
+SEARCH_TABLE = 'ticket_search'
+
+# Marks placed around matched terms in snippets
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+
+search_index = table(SEARCH_TABLE, column('rowid'), column('subject'),
+                     column('description'), column('comments'))
+
+_PUBLIC_COMMENTS = """
+    SELECT group_concat(content, ' ') FROM comment
+    WHERE ticket_id = {ticket} AND NOT coalesce(is_internal, 0)
+"""
+
+_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}
+        USING fts5(subject, description, comments, tokenize = 'unicode61 remove_diacritics 2')""",
+    f"""CREATE TRIGGER IF NOT EXISTS ticket_search_ai AFTER INSERT ON ticket BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, subject, description, comments)
+        VALUES (new.id, new.subject, new.description,
+                coalesce(({_PUBLIC_COMMENTS.format(ticket='new.id')}), ''));
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS ticket_search_au AFTER UPDATE OF subject, description ON ticket BEGIN
+        UPDATE {SEARCH_TABLE} SET subject = new.subject, description = new.description
+        WHERE rowid = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS ticket_search_ad AFTER DELETE ON ticket BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+    # New public comments are appended; anything else re-aggregates the ticket's comments
+    f"""CREATE TRIGGER IF NOT EXISTS ticket_search_comment_ai AFTER INSERT ON comment
+        WHEN NOT coalesce(new.is_internal, 0) BEGIN
+        UPDATE {SEARCH_TABLE} SET comments = comments || ' ' || new.content
+        WHERE rowid = new.ticket_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS ticket_search_comment_au AFTER UPDATE OF content, is_internal ON comment BEGIN
+        UPDATE {SEARCH_TABLE} SET comments = coalesce(({_PUBLIC_COMMENTS.format(ticket='new.ticket_id')}), '')
+        WHERE rowid = new.ticket_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS ticket_search_comment_ad AFTER DELETE ON comment
+        WHEN NOT coalesce(old.is_internal, 0) BEGIN
+        UPDATE {SEARCH_TABLE} SET comments = coalesce(({_PUBLIC_COMMENTS.format(ticket='old.ticket_id')}), '')
+        WHERE rowid = old.ticket_id;
+    END""",
+]
+
+_TRIGGERS = ['ticket_search_ai', 'ticket_search_au', 'ticket_search_ad',
+             'ticket_search_comment_ai', 'ticket_search_comment_au', 'ticket_search_comment_ad']
+
+# Whether the index exists, per engine, so requests don't have to ask SQLite each time
+_enabled = {}
+
+
+def install(connection):
+    """Create the index and its triggers if missing (SQLite only)"""
+    if connection.dialect.name != 'sqlite':
+        return False
+    for statement in _SCHEMA:
+        connection.exec_driver_sql(statement)
+    _enabled[connection.engine.url] = True
+    return True
+
+
+def drop_triggers(connection):
+    """Stop keeping the index in sync, for bulk loads that end with rebuild()"""
+    if connection.dialect.name != 'sqlite':
+        return
+    for trigger in _TRIGGERS:
+        connection.exec_driver_sql(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+def rebuild(connection):
+    """Repopulate the index from the ticket and comment tables; returns the row count"""
+    if not install(connection):
+        return 0
+    connection.exec_driver_sql(f"DELETE FROM {SEARCH_TABLE}")
+    result = connection.exec_driver_sql(f"""
+        INSERT INTO {SEARCH_TABLE} (rowid, subject, description, comments)
+        SELECT id, subject, description, coalesce(({_PUBLIC_COMMENTS.format(ticket='ticket.id')}), '')
+        FROM ticket
+    """)
+    return result.rowcount
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _install_after_create(target, connection, **kw):
+    install(connection)
+
+
+def uninstall(connection):
+    """Drop the index and its triggers (SQLite only)"""
+    if connection.dialect.name != 'sqlite':
+        return
+    drop_triggers(connection)
+    connection.exec_driver_sql(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+    _enabled[connection.engine.url] = False
+
+
+@event.listens_for(db.metadata, 'before_drop')
+def _drop_before_drop(target, connection, **kw):
+    uninstall(connection)
+
+
+def is_enabled():
+    """True when the current database has the FTS5 index"""
+    engine = db.engine
+    if engine.url not in _enabled:
+        enabled = False
+        if engine.dialect.name == 'sqlite':
+            enabled = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': SEARCH_TABLE}
+            ).first() is not None
+        _enabled[engine.url] = enabled
+    return _enabled[engine.url]
+
+
+def match_expression(terms):
+    """Turn free text into an FTS5 query: every word must match, as a prefix"""
+    words = re.findall(r'\w+', terms)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def filter_tickets(query, terms):
+    """Restrict a Ticket query to full-text matches.
+
+    Returns ``(query, rank, snippet)`` where ``rank`` orders best matches first
+    when sorted ascending and ``snippet`` is a highlighted excerpt column.
+    """
+    match = match_expression(terms)
+    if not match:
+        # Nothing to search for (e.g. only punctuation) matches nothing
+        return query.filter(false()), None, None
+
+    index = literal_column(SEARCH_TABLE)
+    # Subject hits outrank description hits, which outrank comment hits
+    rank = func.bm25(index, 10.0, 5.0, 1.0)
+    snippet = func.snippet(index, -1, HIGHLIGHT_START, HIGHLIGHT_END, '…', 16)
+
+    query = query.join(search_index, search_index.c.rowid == Ticket.id).filter(
+        index.op('MATCH')(match)
+    )
+    return query, rank, snippet
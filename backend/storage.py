@@ -0,0 +1,212 @@
+"""Content-addressed, reference-counted attachment storage.
+
+Uploaded bytes are written straight from the multipart parser into a temp
+file in the upload folder. Each chunk is hashed and size-checked as it
+arrives, so an oversized upload is refused as soon as it crosses the limit
+and the body is never buffered twice. The finished file is moved to
+``<sha256[:2]>/<sha256>`` and recorded as a StoredFile. Identical uploads
+share one file, and the file is only deleted when the last Attachment
+referencing it goes away.
+"""
+import hashlib
+import os
+import tempfile
+from collections import Counter
+from urllib.parse import quote
+
+from flask import Request, current_app, request
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from models import db, StoredFile
+from thumbnails import remove_derived
+
+DEFAULT_MAX_ATTACHMENT_SIZE = 16 * 1024 * 1024
+
+
+def max_attachment_size():
+    config = current_app.config
+    return config.get('MAX_ATTACHMENT_SIZE') or config.get('MAX_CONTENT_LENGTH') or DEFAULT_MAX_ATTACHMENT_SIZE
+
+
+def blob_name(sha256):
+    """Path of a stored file relative to UPLOAD_FOLDER"""
+    return f'{sha256[:2]}/{sha256}'
+
+
+def blob_path(sha256):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], sha256[:2], sha256)
+
+
+class HashingUploadStream:
+    """Writable temp file that hashes and size-checks an upload while it is parsed"""
+
+    def __init__(self, directory, max_size):
+        os.makedirs(directory, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='upload-', delete=False)
+        self.path = self._file.name
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.discard()
+            raise RequestEntityTooLarge(f'File exceeds the {self.max_size // (1024 * 1024)} MB limit')
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def discard(self):
+        """Close and delete the temp file unless it has been moved into storage"""
+        self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+    def __getattr__(self, name):
+        # read/seek/tell/close etc. go to the underlying temp file
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """Request class that streams uploaded files through HashingUploadStream"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = HashingUploadStream(
+            os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp'),
+            max_attachment_size()
+        )
+        self.upload_streams = getattr(self, 'upload_streams', []) + [stream]
+        return stream
+
+
+def discard_uploads(exc=None):
+    """teardown_request hook: remove temp files of uploads that were rejected or never stored"""
+    for stream in getattr(request, 'upload_streams', []):
+        if stream.path:
+            stream.discard()
+
+
+def store(stream):
+    """Move a finished upload into content-addressed storage and take a reference.
+
+    Returns the StoredFile; the caller commits it with the Attachment. If that
+    commit fails, pass blob_path(sha256) to remove_files after rolling back.
+    """
+    sha256 = stream.sha256
+    stream.close()
+
+    # Take the reference before touching the file. The UPDATE locks the row until the
+    # caller commits, so a concurrent release() can't drop it to zero and delete the
+    # file meanwhile; if it already has, no row matches and the content is stored anew.
+    blob = None
+    if _add_reference(sha256):
+        blob = db.session.get(StoredFile, sha256)
+    else:
+        try:
+            with db.session.begin_nested():
+                blob = StoredFile(sha256=sha256, size=stream.size, ref_count=1)
+                db.session.add(blob)
+        except IntegrityError:
+            # A concurrent upload of the same new content inserted it first; share its row
+            _add_reference(sha256)
+            blob = db.session.get(StoredFile, sha256)
+
+    final_path = blob_path(sha256)
+    if not os.path.exists(final_path):
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(stream.path, final_path)
+        stream.path = None
+    else:
+        stream.discard()
+    return blob
+
+
+def _add_reference(sha256):
+    """Increment a StoredFile's ref_count; returns whether the row exists"""
+    return StoredFile.query.filter_by(sha256=sha256).update(
+        {StoredFile.ref_count: StoredFile.ref_count + 1}, synchronize_session=False
+    ) > 0
+
+
+def release(attachments):
+    """Drop the references held by attachments that are being deleted.
+
+    Returns the paths of files nobody references anymore; pass them to
+    remove_files once the surrounding transaction has committed.
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    references = Counter(a.content_hash for a in attachments if a.content_hash)
+    # Files from before content addressing are owned by exactly one attachment
+    orphaned = [os.path.join(upload_folder, a.filename) for a in attachments if not a.content_hash]
+
+    for sha256, count in references.items():
+        StoredFile.query.filter_by(sha256=sha256).update(
+            {StoredFile.ref_count: StoredFile.ref_count - count}, synchronize_session=False
+        )
+    if references:
+        unreferenced = StoredFile.query.filter(
+            StoredFile.sha256.in_(list(references)), StoredFile.ref_count <= 0
+        ).all()
+        for blob in unreferenced:
+            orphaned.append(blob_path(blob.sha256))
+            db.session.delete(blob)
+    return orphaned
+
+
+def remove_files(paths):
+    for path in paths:
+        sha256 = os.path.basename(path)
+        # A concurrent upload may have stored the same content again meanwhile
+        if db.session.get(StoredFile, sha256) is not None:
+            continue
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error deleting file {path}: {e}")
+        remove_derived(current_app.config['UPLOAD_FOLDER'], sha256)
+
+
+def download_etag(attachment, stat):
+    """Strong validator for an attachment's bytes.
+
+    Content-addressed files are identified by their hash; older files fall
+    back to modification time and size.
+    """
+    if attachment.content_hash:
+        return attachment.content_hash
+    return f'{int(stat.st_mtime)}-{stat.st_size}'
+
+
+def offload_response(attachment, etag):
+    """Hand the transfer of an attachment to the front proxy.
+
+    ATTACHMENT_OFFLOAD = 'x-accel' answers with X-Accel-Redirect (nginx) to
+    ATTACHMENT_ACCEL_PREFIX + filename; 'x-sendfile' answers with X-Sendfile
+    (Apache mod_xsendfile, lighttpd) and the absolute path. The proxy then
+    serves the body, including Range requests.
+    """
+    response = current_app.response_class(mimetype=attachment.mime_type or 'application/octet-stream')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    if request.if_none_match.contains_weak(etag):
+        response.status_code = 304
+        return response
+
+    response.headers.set('Content-Disposition', 'attachment', filename=attachment.original_filename)
+    mode = current_app.config.get('ATTACHMENT_OFFLOAD')
+    if mode == 'x-accel':
+        prefix = current_app.config.get('ATTACHMENT_ACCEL_PREFIX', '/protected-uploads/')
+        response.headers['X-Accel-Redirect'] = prefix + quote(attachment.filename)
+    elif mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = os.path.abspath(
+            os.path.join(current_app.config['UPLOAD_FOLDER'], attachment.filename))
+    else:
+        raise ValueError(f'Unknown ATTACHMENT_OFFLOAD mode: {mode}')
+    return response
@@ -1,10 +1,21 @@
 import unittest
+import unittest.mock
+import gzip
+import hashlib
+import time
+import io
 import json
 import tempfile
 import os
-from app import app
-from models import db, User, Category, Ticket
+from datetime import datetime, timedelta
+from app import app, mail, outbox, principal_cache, ticket_stats_cache, event_hub, metrics
+from models import db, User, Category, Ticket, Comment, Vote, OutgoingEmail, StoredFile, category_cache, load_categories
+from cache import SharedVersionCache
 from test_config import TestConfig
+from smtp_sink import SMTPSink
+from querycount import QueryCounter, query_budget
+from events import EventHub, EventBroker
+import datagen
 from werkzeug.security import generate_password_hash
 
 class QuickDeskTestCase(unittest.TestCase):
@@ -18,9 +29,12 @@ class QuickDeskTestCase(unittest.TestCase):
         
         # Create all tables
         db.create_all()
+        ticket_stats_cache.clear()
+        principal_cache.clear()
         
         # Create test data
         self.create_test_data()
+        category_cache.invalidate()
     
     def tearDown(self):
         """Tear down test fixtures after each test method."""
@@ -140,6 +154,1208 @@ class QuickDeskTestCase(unittest.TestCase):
         self.assertIn('tickets', data)
         self.assertEqual(len(data['tickets']), 1)
     
+    def test_get_tickets_batch_serialization(self):
+        """Test ticket list serializes relations and vote scores for every row."""
+        from models import Vote
+        
+        tickets = [Ticket(subject=f'Ticket {i}', description='Batch test',
+                          category_id=self.test_category.id, user_id=self.regular_user.id,
+                          assigned_to=self.agent_user.id)
+                   for i in range(3)]
+        db.session.add_all(tickets)
+        db.session.commit()
+        db.session.add_all([
+            Vote(ticket_id=tickets[0].id, user_id=self.admin_user.id, vote_type='up'),
+            Vote(ticket_id=tickets[0].id, user_id=self.agent_user.id, vote_type='up'),
+            Vote(ticket_id=tickets[1].id, user_id=self.admin_user.id, vote_type='down')
+        ])
+        db.session.commit()
+        Ticket.rebuild_vote_counters()
+        
+        token = self.get_auth_token('agent@test.com', 'agent123')
+        response = self.app.get('/api/tickets?per_page=50',
+                              headers={'Authorization': f'Bearer {token}'})
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        scores = {t['id']: t['vote_score'] for t in data['tickets']}
+        self.assertEqual(scores, {tickets[0].id: 2, tickets[1].id: -1, tickets[2].id: 0})
+        for ticket in data['tickets']:
+            self.assertEqual(ticket['creator']['username'], 'user')
+            self.assertEqual(ticket['assignee']['username'], 'agent')
+            self.assertEqual(ticket['category']['name'], 'Test Category')
+    
+    def test_vote_counters(self):
+        """Test vote counters follow vote create, flip and removal."""
+        ticket = Ticket(subject='Vote Ticket', description='Vote test',
+                        category_id=self.test_category.id, user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        token = self.get_auth_token('agent@test.com', 'agent123')
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        def vote(vote_type):
+            response = self.app.post(f'/api/tickets/{ticket.id}/vote',
+                                   data=json.dumps({'vote_type': vote_type}),
+                                   content_type='application/json',
+                                   headers=headers)
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.data)
+        
+        data = vote('up')
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (1, 0, 'up'))
+        data = vote('down')
+        self.assertEqual((data['upvotes'], data['downvotes'], data['vote_score']), (0, 1, -1))
+        data = vote('down')
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (0, 0, None))
+        
+        # Counters drifted out of band are repaired by reconciliation
+        vote('up')
+        db.session.execute(db.update(Ticket).values(upvotes=7, downvotes=3))
+        db.session.commit()
+        Ticket.rebuild_vote_counters()
+        response = self.app.get(f'/api/tickets/{ticket.id}/vote', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual((data['upvotes'], data['downvotes'], data['user_vote']), (1, 0, 'up'))
+    
+    def test_ticket_stats(self):
+        """Test ticket statistics are scoped by role and refreshed on writes."""
+        db.session.add_all([
+            Ticket(subject='Mine', description='Stats test', status='open',
+                   category_id=self.test_category.id, user_id=self.regular_user.id),
+            Ticket(subject='Other', description='Stats test', status='resolved', priority='high',
+                   category_id=self.test_category.id, user_id=self.agent_user.id,
+                   assigned_to=self.agent_user.id)
+        ])
+        db.session.commit()
+        user_token = self.get_auth_token('user@test.com', 'user123')
+        agent_token = self.get_auth_token('agent@test.com', 'agent123')
+        
+        response = self.app.get('/api/tickets/stats',
+                              headers={'Authorization': f'Bearer {agent_token}'})
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.data)['stats']
+        self.assertEqual(stats['total'], 2)
+        self.assertEqual(stats['by_status'], {'open': 1, 'resolved': 1})
+        self.assertEqual(stats['by_priority'], {'medium': 1, 'high': 1})
+        self.assertEqual(stats['by_assignee'], {str(self.agent_user.id): 1, 'unassigned': 1})
+        
+        response = self.app.get('/api/tickets/stats',
+                              headers={'Authorization': f'Bearer {user_token}'})
+        stats = json.loads(response.data)['stats']
+        self.assertEqual(stats['total'], 1)
+        self.assertEqual(stats['by_category'], {str(self.test_category.id): 1})
+        
+        # Creating a ticket invalidates the cached numbers
+        self.app.post('/api/tickets',
+                     data=json.dumps({
+                         'subject': 'New', 'description': 'Stats test',
+                         'category_id': self.test_category.id
+                     }),
+                     content_type='application/json',
+                     headers={'Authorization': f'Bearer {user_token}'})
+        response = self.app.get('/api/tickets/stats',
+                              headers={'Authorization': f'Bearer {user_token}'})
+        self.assertEqual(json.loads(response.data)['stats']['by_status'], {'open': 2})
+    
+    def test_search_tickets(self):
+        """Test full-text search covers comments, matches prefixes and ranks results."""
+        printer = Ticket(subject='Printer jammed', description='Paper stuck in tray',
+                         category_id=self.test_category.id, user_id=self.regular_user.id)
+        vpn = Ticket(subject='VPN drops', description='Connection resets, printer unaffected',
+                     category_id=self.test_category.id, user_id=self.regular_user.id)
+        other = Ticket(subject='Laptop slow', description='Takes ages to boot',
+                       category_id=self.test_category.id, user_id=self.regular_user.id)
+        db.session.add_all([printer, vpn, other])
+        db.session.commit()
+        db.session.add_all([
+            Comment(content='Firmware update scheduled', ticket_id=other.id, user_id=self.agent_user.id),
+            Comment(content='Escalated to hardware vendor', ticket_id=printer.id,
+                    user_id=self.agent_user.id, is_internal=True)
+        ])
+        db.session.commit()
+        token = self.get_auth_token('agent@test.com', 'agent123')
+        
+        def search(terms):
+            response = self.app.get(f'/api/tickets?search={terms}',
+                                  headers={'Authorization': f'Bearer {token}'})
+            self.assertEqual(response.status_code, 200)
+            return json.loads(response.data)
+        
+        # Subject matches rank above description matches
+        data = search('print')
+        self.assertEqual([t['id'] for t in data['tickets']], [printer.id, vpn.id])
+        self.assertEqual(data['total'], 2)
+        self.assertIn('<mark>Printer</mark>', data['tickets'][0]['search_snippet'])
+        
+        # Public comments are searchable, internal notes are not
+        self.assertEqual([t['id'] for t in search('firmware')['tickets']], [other.id])
+        self.assertEqual(search('vendor')['tickets'], [])
+        
+        # The index follows edits
+        other.subject = 'Laptop overheating'
+        db.session.commit()
+        self.assertEqual([t['id'] for t in search('overheat')['tickets']], [other.id])
+        
+        # A search with no words finds nothing rather than everything
+        self.assertEqual(search('!!!')['tickets'], [])
+    
+    def test_get_tickets_cursor_pagination(self):
+        """Test cursor pages match offset pages for every sort order, including ties."""
+        base = datetime(2025, 1, 1)
+        db.session.add_all([
+            Ticket(subject=f'Ticket {i}', description='Cursor test',
+                   priority=['low', 'medium', 'high', 'urgent'][i % 4],
+                   created_at=base + timedelta(hours=i // 2),
+                   updated_at=base + timedelta(hours=(7 - i) // 3),
+                   category_id=self.test_category.id, user_id=self.regular_user.id)
+            for i in range(8)
+        ])
+        db.session.commit()
+        token = self.get_auth_token('agent@test.com', 'agent123')
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        for sort_by in ('created_at_desc', 'created_at_asc', 'updated_at_desc', 'priority_desc'):
+            response = self.app.get(f'/api/tickets?sort_by={sort_by}&per_page=50', headers=headers)
+            expected = [t['id'] for t in json.loads(response.data)['tickets']]
+            
+            seen, cursor = [], ''
+            while cursor is not None:
+                response = self.app.get(f'/api/tickets?sort_by={sort_by}&per_page=3&cursor={cursor}',
+                                      headers=headers)
+                self.assertEqual(response.status_code, 200)
+                data = json.loads(response.data)
+                self.assertNotIn('total', data)
+                seen.extend(t['id'] for t in data['tickets'])
+                cursor = data['next_cursor']
+            self.assertEqual(seen, expected, sort_by)
+        
+        response = self.app.get('/api/tickets?cursor=&include_total=true', headers=headers)
+        self.assertEqual(json.loads(response.data)['total'], 8)
+        response = self.app.get('/api/tickets?cursor=bogus', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        
+        # Out-of-range page sizes are clamped rather than failing
+        for per_page, expected_size in (('0', 1), ('-5', 1), ('100000', 100)):
+            response = self.app.get(f'/api/tickets?cursor=&per_page={per_page}', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data)['per_page'], expected_size)
+        
+        # page= pagination takes any page size, as it always has
+        response = self.app.get('/api/tickets?page=1&per_page=150', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['per_page'], 150)
+    
+    def test_hot_queries_use_indexes(self):
+        """Test every hot query is planned against its index rather than a full scan."""
+        from query_plans import check_query_plans
+        
+        for name, index, steps, ok in check_query_plans():
+            self.assertTrue(ok, f'{name} should use {index}, plan was: {steps}')
+    
+    def test_email_outbox(self):
+        """Test notifications are queued by requests and delivered over one SMTP connection."""
+        token = self.get_auth_token('user@test.com', 'user123')
+        saved = {key: app.config.get(key) for key in
+                 ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_USERNAME', 'MAIL_PASSWORD', 'MAIL_SUPPRESS_SEND')}
+        with SMTPSink() as sink:
+            host, port = sink.address
+            app.config.update(MAIL_SERVER=host, MAIL_PORT=port, MAIL_USERNAME='desk@test.com',
+                              MAIL_PASSWORD='secret', MAIL_SUPPRESS_SEND=False)
+            mail.init_app(app)
+            try:
+                for i in range(3):
+                    response = self.app.post('/api/tickets',
+                                           data=json.dumps({
+                                               'subject': f'Outbox {i}',
+                                               'description': 'Queued notification',
+                                               'category_id': self.test_category.id
+                                           }),
+                                           content_type='application/json',
+                                           headers={'Authorization': f'Bearer {token}'})
+                    self.assertEqual(response.status_code, 201)
+                
+                # Nothing is sent inline; the request only queued the messages
+                self.assertEqual(sink.messages, [])
+                self.assertEqual(OutgoingEmail.query.filter_by(status='pending').count(), 3)
+                
+                self.assertEqual(outbox.drain(), 3)
+                self.assertEqual(sorted(m['subject'] for m in sink.messages),
+                                 [f'New Ticket Created: Outbox {i}' for i in range(3)])
+                self.assertEqual(sink.connections, 1)
+                self.assertEqual(OutgoingEmail.query.filter_by(status='sent').count(), 3)
+            finally:
+                app.config.update(saved)
+                mail.init_app(app)
+    
+    def test_email_outbox_retries(self):
+        """Test undeliverable messages back off and eventually fail."""
+        saved = {key: app.config.get(key) for key in ('MAIL_SERVER', 'MAIL_PORT', 'MAIL_SUPPRESS_SEND')}
+        app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=1, MAIL_SUPPRESS_SEND=False,
+                          MAIL_OUTBOX_MAX_ATTEMPTS=2)
+        mail.init_app(app)
+        try:
+            outbox.enqueue('user@test.com', 'Unreachable', 'Body')
+            db.session.commit()
+            self.assertEqual(outbox.drain(), 0)
+            message = OutgoingEmail.query.one()
+            self.assertEqual((message.status, message.attempts), ('pending', 1))
+            self.assertGreater(message.next_attempt_at, datetime.utcnow())
+            
+            # Make the retry due now; the second failure is final
+            message.next_attempt_at = datetime.utcnow()
+            db.session.commit()
+            outbox.drain()
+            message = OutgoingEmail.query.one()
+            self.assertEqual((message.status, message.attempts), ('failed', 2))
+            self.assertIsNotNone(message.last_error)
+        finally:
+            app.config.update(saved)
+            app.config.pop('MAIL_OUTBOX_MAX_ATTEMPTS')
+            mail.init_app(app)
+    
+    def test_email_outbox_shares_handler_transaction(self):
+        """Test notifications commit together with the change they report."""
+        user_token = self.get_auth_token('user@test.com', 'user123')
+        agent_token = self.get_auth_token('agent@test.com', 'agent123')
+        with unittest.mock.patch.dict(app.config, {'MAIL_USERNAME': 'desk@test.com'}):
+            with unittest.mock.patch.object(db.session, 'commit', side_effect=RuntimeError('database went away')):
+                response = self.app.post('/api/tickets',
+                                       data=json.dumps({
+                                           'subject': 'Never stored',
+                                           'description': 'Rolled back',
+                                           'category_id': self.test_category.id
+                                       }),
+                                       content_type='application/json',
+                                       headers={'Authorization': f'Bearer {user_token}'})
+            self.assertEqual(response.status_code, 500)
+            # Outside tests the request's session goes away with its app context
+            db.session.rollback()
+            self.assertEqual(Ticket.query.filter_by(subject='Never stored').count(), 0)
+            self.assertEqual(OutgoingEmail.query.count(), 0)
+            
+            ticket = Ticket(subject='Assigned', description='Status email', category_id=self.test_category.id,
+                            user_id=self.regular_user.id)
+            db.session.add(ticket)
+            db.session.commit()
+            response = self.app.put(f'/api/tickets/{ticket.id}',
+                                  data=json.dumps({'status': 'in_progress', 'assigned_to': self.agent_user.id}),
+                                  content_type='application/json',
+                                  headers={'Authorization': f'Bearer {agent_token}'})
+            self.assertEqual(response.status_code, 200)
+            message = OutgoingEmail.query.one()
+            self.assertEqual(message.recipient, 'user@test.com')
+            self.assertIn('Assigned to: agent', message.body)
+    
+    def test_principal_cache(self):
+        """Test authenticated users are cached and admin changes still apply immediately."""
+        admin_token = self.get_auth_token('admin@test.com', 'admin123')
+        user_token = self.get_auth_token('user@test.com', 'user123')
+        admin_headers = {'Authorization': f'Bearer {admin_token}'}
+        user_headers = {'Authorization': f'Bearer {user_token}'}
+        
+        before = principal_cache.stats()
+        for _ in range(3):
+            self.assertEqual(self.app.get('/api/auth/me', headers=user_headers).status_code, 200)
+        after = principal_cache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        
+        # Promotion is visible on the next request
+        self.app.put(f'/api/users/{self.regular_user.id}',
+                    data=json.dumps({'role': 'agent'}),
+                    content_type='application/json', headers=admin_headers)
+        response = self.app.get('/api/auth/me', headers=user_headers)
+        self.assertEqual(json.loads(response.data)['user']['role'], 'agent')
+        
+        # Deactivated users are locked out
+        self.app.put(f'/api/users/{self.regular_user.id}',
+                    data=json.dumps({'is_active': False}),
+                    content_type='application/json', headers=admin_headers)
+        self.assertEqual(self.app.get('/api/auth/me', headers=user_headers).status_code, 401)
+        
+        response = self.app.get('/api/admin/cache-stats', headers=admin_headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hits', json.loads(response.data)['caches']['principal'])
+        self.assertEqual(self.app.get('/api/admin/cache-stats', headers=user_headers).status_code, 401)
+    
+    def test_password_rehash_on_login(self):
+        """Test logins upgrade hashes to the configured method and cost."""
+        self.assertFalse(self.regular_user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        
+        self.assertIsNotNone(self.get_auth_token('user@test.com', 'user123'))
+        db.session.refresh(self.regular_user)
+        self.assertTrue(self.regular_user.password_hash.startswith('pbkdf2:sha256:1000$'))
+        
+        # The upgraded hash keeps working, and wrong passwords are still rejected
+        self.assertIsNotNone(self.get_auth_token('user@test.com', 'user123'))
+        self.assertIsNone(self.get_auth_token('user@test.com', 'wrong'))
+        
+        # Specs without a cost match the defaults werkzeug fills in, so they aren't rehashed every login
+        from app import password_hasher
+        with unittest.mock.patch.dict(app.config, {'PASSWORD_HASH_METHOD': 'pbkdf2:sha256'}):
+            self.assertFalse(password_hasher.needs_rehash(password_hasher.hash('user123')))
+            self.assertTrue(password_hasher.needs_rehash(self.regular_user.password_hash))
+        
+        # Every supported method fits the column (SQLite wouldn't notice if it didn't)
+        for method in ('pbkdf2:sha256', 'scrypt'):
+            self.assertLessEqual(len(generate_password_hash('user123', method)), User.password_hash.type.length)
+    
+    def test_password_hashing_pool(self):
+        """Test hashing on the process pool round-trips."""
+        from passwords import PasswordHasher
+        
+        app.config['PASSWORD_HASH_WORKERS'] = 1
+        hasher = PasswordHasher(app)
+        try:
+            pwhash = hasher.hash('pool123')
+            self.assertTrue(pwhash.startswith('pbkdf2:sha256:1000$'))
+            self.assertTrue(hasher.verify(pwhash, 'pool123'))
+            self.assertFalse(hasher.verify(pwhash, 'nope'))
+        finally:
+            hasher.shutdown()
+            app.config['PASSWORD_HASH_WORKERS'] = 0
+    
+    def upload(self, token, ticket_id, content, filename='log.txt'):
+        """Upload bytes as an attachment to a ticket."""
+        return self.app.post(f'/api/tickets/{ticket_id}/attachments',
+                           data={'file': (io.BytesIO(content), filename)},
+                           content_type='multipart/form-data',
+                           headers={'Authorization': f'Bearer {token}'})
+    
+    def test_attachment_deduplication(self):
+        """Test identical uploads share one stored file until the last reference is gone."""
+        tickets = [Ticket(subject=f'Attach {i}', description='Dedup test',
+                          category_id=self.test_category.id, user_id=self.regular_user.id)
+                   for i in range(2)]
+        db.session.add_all(tickets)
+        db.session.commit()
+        token = self.get_auth_token('agent@test.com', 'agent123')
+        content = b'same log output\n' * 100
+        
+        attachments = []
+        for ticket in tickets:
+            response = self.upload(token, ticket.id, content)
+            self.assertEqual(response.status_code, 201)
+            attachments.append(json.loads(response.data)['attachment'])
+        
+        self.assertEqual(attachments[0]['filename'], attachments[1]['filename'])
+        self.assertEqual(attachments[0]['file_size'], len(content))
+        stored = StoredFile.query.one()
+        self.assertEqual(stored.ref_count, 2)
+        path = os.path.join(app.config['UPLOAD_FOLDER'], attachments[0]['filename'])
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        
+        headers = {'Authorization': f'Bearer {token}'}
+        self.app.delete(f'/api/tickets/{tickets[0].id}', headers=headers)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(StoredFile.query.one().ref_count, 1)
+        
+        self.app.delete(f'/api/tickets/{tickets[1].id}', headers=headers)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(StoredFile.query.count(), 0)
+    
+    def test_attachment_concurrent_store(self):
+        """Test an upload that loses the race to store new content shares the winner's row."""
+        ticket = Ticket(subject='Race', description='Dedup test', category_id=self.test_category.id,
+                        user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        token = self.get_auth_token('agent@test.com', 'agent123')
+        content = b'uploaded twice at once\n' * 50
+        self.assertEqual(self.upload(token, ticket.id, content).status_code, 201)
+        
+        # The second request tries to take a reference before the first one's row is visible
+        import storage
+        real_add_reference, missed = storage._add_reference, []
+        def racing_add_reference(sha256):
+            if not missed:
+                missed.append(sha256)
+                return False
+            return real_add_reference(sha256)
+        with unittest.mock.patch.object(storage, '_add_reference', racing_add_reference):
+            response = self.upload(token, ticket.id, content)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(missed), 1)
+        db.session.expire_all()
+        self.assertEqual(StoredFile.query.one().ref_count, 2)
+    
+    def test_attachment_store_after_release_and_failed_commit(self):
+        """Test stored files survive a concurrent release and are removed when the upload fails."""
+        ticket = Ticket(subject='Release race', description='Dedup test', category_id=self.test_category.id,
+                        user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        token = self.get_auth_token('agent@test.com', 'agent123')
+        content = b'released while uploading\n' * 50
+        self.assertEqual(self.upload(token, ticket.id, content).status_code, 201)
+        blob = StoredFile.query.one()
+        path = os.path.join(app.config['UPLOAD_FOLDER'], blob.sha256[:2], blob.sha256)
+        stale = StoredFile(sha256=blob.sha256, size=blob.size, ref_count=1)
+        
+        # The last reference is released (row and file gone) just as the upload looks the content up
+        StoredFile.query.delete()
+        db.session.commit()
+        os.remove(path)
+        real_get = db.session.get
+        def stale_get(model, ident, **kwargs):
+            return stale if model is StoredFile and StoredFile.query.count() == 0 else real_get(model, ident, **kwargs)
+        with unittest.mock.patch.object(db.session, 'get', stale_get):
+            self.assertEqual(self.upload(token, ticket.id, content).status_code, 201)
+        db.session.expire_all()
+        self.assertEqual(StoredFile.query.one().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+        
+        # A failed commit leaves neither a row nor a file behind
+        new_content = b'never committed\n' * 50
+        with unittest.mock.patch.object(db.session, 'commit', side_effect=RuntimeError('database went away')):
+            self.assertEqual(self.upload(token, ticket.id, new_content).status_code, 500)
+        self.assertEqual(StoredFile.query.count(), 1)
+        new_hash = hashlib.sha256(new_content).hexdigest()
+        self.assertFalse(os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], new_hash[:2], new_hash)))
+    
+    def test_upload_temp_files_removed(self):
+        """Test spooled upload bodies are deleted when the request ends, whatever the endpoint did."""
+        from flask import request
+        
+        with app.test_request_context('/', method='POST', content_type='multipart/form-data',
+                                      data={'file': (io.BytesIO(b'never stored'), 'note.txt')}):
+            path = request.files['file'].stream.path
+            self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(path))
+    
+    def test_attachment_size_limit(self):
+        """Test oversized uploads are refused while streaming and leave nothing behind."""
+        ticket = Ticket(subject='Big file', description='Limit test',
+                        category_id=self.test_category.id, user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        token = self.get_auth_token('agent@test.com', 'agent123')
+        
+        app.config['MAX_ATTACHMENT_SIZE'] = 1024
+        try:
+            response = self.upload(token, ticket.id, b'x' * 4096)
+        finally:
+            app.config.pop('MAX_ATTACHMENT_SIZE')
+        
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(StoredFile.query.count(), 0)
+        tmp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'tmp')
+        self.assertEqual(os.listdir(tmp_dir), [])
+    
+    def test_attachment_download_ranges(self):
+        """Test downloads carry a strong ETag and honour If-None-Match, Range and offload mode."""
+        ticket = Ticket(subject='Log bundle', description='Download test',
+                        category_id=self.test_category.id, user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        token = self.get_auth_token('user@test.com', 'user123')
+        content = bytes(range(256)) * 8
+        response = self.upload(token, ticket.id, content)
+        attachment = json.loads(response.data)['attachment']
+        url = f'/api/attachments/{attachment["id"]}/download'
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        response = self.app.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, content)
+        etag = response.headers['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertIn(StoredFile.query.one().sha256, etag)
+        
+        response = self.app.get(url, headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        
+        response = self.app.get(url, headers={**headers, 'Range': 'bytes=100-199'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, content[100:200])
+        self.assertEqual(response.headers['Content-Range'], f'bytes 100-199/{len(content)}')
+        
+        # A stale If-Range validator gets the whole file instead of a partial one
+        response = self.app.get(url, headers={**headers, 'Range': 'bytes=100-199', 'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, content)
+        
+        app.config['ATTACHMENT_OFFLOAD'] = 'x-accel'
+        try:
+            response = self.app.get(url, headers=headers)
+            not_modified = self.app.get(url, headers={**headers, 'If-None-Match': etag})
+        finally:
+            app.config.pop('ATTACHMENT_OFFLOAD')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'')
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/protected-uploads/' + attachment['filename'])
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        self.assertEqual(not_modified.status_code, 304)
+        
+        other_token = self.get_auth_token('agent@test.com', 'agent123')
+        self.assertEqual(self.app.get(url, headers={'Authorization': f'Bearer {other_token}'}).status_code, 200)
+    
+    def test_attachment_thumbnails(self):
+        """Test image uploads get WebP derivatives served with a long cache lifetime."""
+        from PIL import Image
+        ticket = Ticket(subject='Screenshot', description='Thumbnail test',
+                        category_id=self.test_category.id, user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        token = self.get_auth_token('user@test.com', 'user123')
+        headers = {'Authorization': f'Bearer {token}'}
+        
+        png = io.BytesIO()
+        Image.new('RGB', (1600, 900), (30, 120, 200)).save(png, 'PNG')
+        response = self.upload(token, ticket.id, png.getvalue(), 'screenshot.png')
+        attachment = json.loads(response.data)['attachment']
+        self.assertTrue(attachment['has_preview'])
+        key = os.path.basename(attachment['filename'])
+        derived = os.path.join(app.config['UPLOAD_FOLDER'], 'derived', key[:2], key)
+        self.assertEqual(sorted(os.listdir(derived)), ['preview.webp', 'thumb.webp'])
+        
+        url = f'/api/attachments/{attachment["id"]}/thumbnail'
+        response = self.app.get(url, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/webp')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('private', response.headers['Cache-Control'])
+        thumb = Image.open(io.BytesIO(response.data))
+        self.assertEqual(thumb.size, (200, 113))
+        self.assertLess(len(response.data), len(png.getvalue()))
+        
+        # A missing derivative is rendered on demand
+        os.remove(os.path.join(derived, 'preview.webp'))
+        response = self.app.get(f'{url}?size=preview', headers=headers)
+        self.assertEqual(Image.open(io.BytesIO(response.data)).size, (1024, 576))
+        self.assertEqual(self.app.get(f'{url}?size=huge', headers=headers).status_code, 400)
+        
+        response = self.upload(token, ticket.id, b'plain text', 'notes.txt')
+        text_attachment = json.loads(response.data)['attachment']
+        self.assertFalse(text_attachment['has_preview'])
+        response = self.app.get(f'/api/attachments/{text_attachment["id"]}/thumbnail', headers=headers)
+        self.assertEqual(response.status_code, 404)
+        
+        self.app.delete(f'/api/tickets/{ticket.id}',
+                        headers={'Authorization': f'Bearer {self.get_auth_token("agent@test.com", "agent123")}'})
+        self.assertFalse(os.path.exists(derived))
+    
+    def test_bulk_ticket_operations(self):
+        """Test bulk update and delete apply the single-ticket role rules and group notifications."""
+        tickets = [Ticket(subject=f'Bulk {i}', description='Bulk test', category_id=self.test_category.id,
+                          user_id=self.regular_user.id if i < 3 else self.admin_user.id)
+                   for i in range(4)]
+        tickets.append(Ticket(subject='Already resolved', description='Bulk test', status='resolved',
+                              category_id=self.test_category.id, user_id=self.regular_user.id))
+        db.session.add_all(tickets)
+        db.session.commit()
+        ids = [ticket.id for ticket in tickets]
+        user_headers = {'Authorization': f'Bearer {self.get_auth_token("user@test.com", "user123")}'}
+        agent_headers = {'Authorization': f'Bearer {self.get_auth_token("agent@test.com", "agent123")}'}
+        
+        def bulk(method, headers, payload):
+            return method('/api/tickets/bulk', data=json.dumps(payload),
+                          content_type='application/json', headers=headers)
+        
+        payload = {'ticket_ids': ids + [9999], 'changes': {'status': 'resolved', 'assigned_to': self.agent_user.id}}
+        self.assertEqual(bulk(self.app.put, user_headers, payload).status_code, 403)
+        self.assertEqual(bulk(self.app.put, agent_headers, {'ticket_ids': ids, 'changes': {}}).status_code, 400)
+        
+        saved_username = app.config.get('MAIL_USERNAME')
+        app.config['MAIL_USERNAME'] = 'desk@test.com'
+        try:
+            response = bulk(self.app.put, agent_headers, payload)
+        finally:
+            app.config['MAIL_USERNAME'] = saved_username
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['updated'], 5)
+        self.assertEqual(data['not_found'], [9999])
+        db.session.expire_all()
+        self.assertEqual({(t.status, t.assigned_to) for t in Ticket.query.all()},
+                         {('resolved', self.agent_user.id)})
+        
+        # The already resolved ticket needs no email; the rest get one per creator
+        emails = {email.recipient: email for email in OutgoingEmail.query.all()}
+        self.assertEqual(len(emails), 2)
+        self.assertEqual(emails['user@test.com'].subject, '3 Tickets Updated to Resolved')
+        self.assertIn('Bulk 2: Open → Resolved', emails['user@test.com'].body)
+        self.assertNotIn('Already resolved', emails['user@test.com'].body)
+        self.assertEqual(emails['admin@test.com'].subject, 'Ticket Status Updated: Bulk 3')
+        
+        # Users may only delete their own open tickets, and nothing is deleted otherwise
+        Ticket.query.filter(Ticket.id.in_(ids[:3])).update({Ticket.status: 'open'})
+        db.session.commit()
+        self.assertEqual(bulk(self.app.delete, user_headers, {'ticket_ids': ids[:4]}).status_code, 403)
+        self.assertEqual(bulk(self.app.delete, user_headers, {'ticket_ids': ids[2:3] + ids[4:]}).status_code, 400)
+        self.assertEqual(Ticket.query.count(), 5)
+        
+        db.session.add(Comment(content='Bye', ticket_id=ids[0], user_id=self.regular_user.id))
+        db.session.commit()
+        response = bulk(self.app.delete, user_headers, {'ticket_ids': ids[:3]})
+        self.assertEqual(json.loads(response.data)['deleted'], 3)
+        response = bulk(self.app.delete, agent_headers, {'ticket_ids': ids})
+        self.assertEqual(json.loads(response.data)['not_found'], ids[:3])
+        self.assertEqual(Ticket.query.count(), 0)
+        self.assertEqual(Comment.query.count(), 0)
+        
+        app.config['BULK_MAX_TICKETS'] = 2
+        try:
+            self.assertEqual(bulk(self.app.delete, agent_headers, {'ticket_ids': [1, 2, 3]}).status_code, 400)
+        finally:
+            app.config.pop('BULK_MAX_TICKETS')
+    
+    def test_export_import(self):
+        """Test streamed exports round-trip through the batched import."""
+        tickets = [Ticket(subject=f'Export {i}', description='Transfer test', category_id=self.test_category.id,
+                          user_id=self.regular_user.id, priority='high' if i % 2 else 'low')
+                   for i in range(7)]
+        db.session.add_all(tickets)
+        db.session.commit()
+        db.session.add(Comment(content='Exported comment', ticket_id=tickets[0].id, user_id=self.agent_user.id))
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {self.get_auth_token("admin@test.com", "admin123")}'}
+        agent_headers = {'Authorization': f'Bearer {self.get_auth_token("agent@test.com", "agent123")}'}
+        
+        self.assertEqual(self.app.get('/api/export/tickets', headers=agent_headers).status_code, 403)
+        self.assertEqual(self.app.get('/api/export/users', headers=headers).status_code, 404)
+        
+        app.config['EXPORT_BATCH_SIZE'] = 3
+        try:
+            response = self.app.get('/api/export/tickets', headers=headers)
+            self.assertTrue(response.is_streamed)
+            exported = response.get_data()
+            comments = self.app.get('/api/export/comments', headers=headers).get_data()
+            csv_lines = self.app.get('/api/export/tickets?format=csv', headers=headers).get_data().splitlines()
+        finally:
+            app.config.pop('EXPORT_BATCH_SIZE')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [json.loads(line) for line in exported.splitlines()]
+        self.assertEqual([row['subject'] for row in rows], [f'Export {i}' for i in range(7)])
+        self.assertEqual(len(csv_lines), 8)
+        self.assertTrue(csv_lines[0].startswith(b'id,subject,description'))
+        
+        response = self.app.get('/api/export/tickets?since=2999-01-01T00:00:00', headers=headers)
+        self.assertEqual(response.get_data(), b'')
+        
+        Comment.query.delete()
+        Ticket.query.delete()
+        db.session.commit()
+        
+        # A bad record rolls back the whole import
+        bad = exported + b'{"subject": "broken", \n'
+        response = self.app.post('/api/import/tickets', data=bad, headers=headers,
+                                 content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Line 8', json.loads(response.data)['message'])
+        self.assertEqual(Ticket.query.count(), 0)
+        response = self.app.post('/api/import/tickets', headers=headers, content_type='application/x-ndjson',
+                                 data=b'{"subject": "numeric time", "created_at": 1700000000}\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('created_at', json.loads(response.data)['message'])
+        
+        app.config['IMPORT_BATCH_SIZE'] = 2
+        try:
+            response = self.app.post('/api/import/tickets', data=exported, headers=headers,
+                                     content_type='application/x-ndjson')
+            self.assertEqual(json.loads(response.data)['imported'], 7)
+            response = self.app.post('/api/import/comments', data=comments, headers=headers,
+                                     content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 201)
+        finally:
+            app.config.pop('IMPORT_BATCH_SIZE')
+        
+        restored = Ticket.query.order_by(Ticket.id).all()
+        self.assertEqual([t.to_dict()['subject'] for t in restored], [row['subject'] for row in rows])
+        self.assertEqual(restored[0].created_at.isoformat(), rows[0]['created_at'])
+        self.assertEqual(Comment.query.one().ticket_id, restored[0].id)
+        
+        # Rows without ids or timestamps get the column defaults
+        response = self.app.post('/api/import/categories', headers=headers, content_type='application/x-ndjson',
+                                 data=b'{"name": "Imported", "description": "From the old helpdesk"}\n')
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNotNone(Category.query.filter_by(name='Imported').one().created_at)
+        response = self.app.post('/api/import/categories', headers=headers, content_type='application/x-ndjson',
+                                 data=b'{"name": "Imported"}\n')
+        self.assertEqual(response.status_code, 400)
+    
+    def test_conditional_get(self):
+        """Test GET endpoints send ETags and answer unchanged re-fetches with 304."""
+        ticket = Ticket(subject='Cached', description='ETag test',
+                        category_id=self.test_category.id, user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {self.get_auth_token("user@test.com", "user123")}'}
+        
+        for url in ['/api/categories', '/api/tickets', '/api/tickets?cursor=',
+                    f'/api/tickets/{ticket.id}', f'/api/tickets/{ticket.id}/comments']:
+            response = self.app.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            self.assertIn('no-cache', response.headers['Cache-Control'])
+            response = self.app.get(url, headers={**headers, 'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.data, b'')
+        
+        # Any change to the payload, including a new comment, changes the validator
+        etag = self.app.get(f'/api/tickets/{ticket.id}', headers=headers).headers['ETag']
+        self.app.post(f'/api/tickets/{ticket.id}/comments', data=json.dumps({'content': 'New info'}),
+                      content_type='application/json', headers=headers)
+        response = self.app.get(f'/api/tickets/{ticket.id}', headers={**headers, 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.data)['ticket']['comments']), 1)
+    
+    def test_category_cache(self):
+        """Test categories are served from memory and reloaded after writes in any process."""
+        admin_headers = {'Authorization': f'Bearer {self.get_auth_token("admin@test.com", "admin123")}'}
+        ticket = Ticket(subject='Categorized', description='Cache test',
+                        category_id=self.test_category.id, user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        
+        self.app.get('/api/categories', headers=admin_headers)
+        misses = category_cache.stats()['misses']
+        self.app.get('/api/categories', headers=admin_headers)
+        self.app.get('/api/tickets', headers=admin_headers)
+        self.assertEqual(category_cache.stats()['misses'], misses)
+        
+        response = self.app.put(f'/api/categories/{self.test_category.id}', data=json.dumps({'name': 'Renamed'}),
+                                content_type='application/json', headers=admin_headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.app.get(f'/api/tickets/{ticket.id}', headers=admin_headers)
+        self.assertEqual(json.loads(response.data)['ticket']['category']['name'], 'Renamed')
+        
+        response = self.app.post('/api/categories', data=json.dumps({'name': 'Hardware'}),
+                                 content_type='application/json', headers=admin_headers)
+        response = self.app.get('/api/categories', headers=admin_headers)
+        self.assertEqual([c['name'] for c in json.loads(response.data)['categories']], ['Renamed', 'Hardware'])
+        
+        # Another worker writing directly to the database signals through the shared file
+        other_worker = SharedVersionCache(load_categories, category_cache.signal_file)
+        Category.query.filter_by(name='Hardware').update({Category.is_active: False})
+        db.session.commit()
+        other_worker.invalidate()
+        response = self.app.get('/api/categories', headers=admin_headers)
+        self.assertEqual([c['name'] for c in json.loads(response.data)['categories']], ['Renamed'])
+    
+    def test_ticket_summary_view(self):
+        """Test summary listings select only requested columns and side-load users and categories."""
+        tickets = [Ticket(subject=f'Summary {i}', description='x' * 500, category_id=self.test_category.id,
+                          user_id=self.regular_user.id, assigned_to=self.agent_user.id if i == 0 else None)
+                   for i in range(3)]
+        db.session.add_all(tickets)
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {self.get_auth_token("agent@test.com", "agent123")}'}
+        
+        response = self.app.get('/api/tickets?view=summary', headers=headers)
+        data = json.loads(response.data)
+        ticket = data['tickets'][0]
+        self.assertEqual(set(ticket), set(Ticket.SUMMARY_FIELDS))
+        self.assertEqual(len(ticket['description']), 150)
+        self.assertNotIn('creator', ticket)
+        self.assertEqual(set(data['users']), {str(self.regular_user.id), str(self.agent_user.id)})
+        self.assertEqual(data['users'][str(self.agent_user.id)], {'id': self.agent_user.id, 'username': 'agent'})
+        self.assertEqual(data['categories'][str(self.test_category.id)]['name'], self.test_category.name)
+        self.assertEqual(data['total'], 3)
+        
+        with QueryCounter() as queries:
+            response = self.app.get('/api/tickets?fields=subject,status&cursor=&per_page=2', headers=headers)
+        data = json.loads(response.data)
+        self.assertEqual([set(t) for t in data['tickets']], [{'id', 'subject', 'status'}] * 2)
+        self.assertEqual((data['users'], data['categories']), ({}, {}))
+        ticket_selects = [sql for sql in queries.statements if 'FROM ticket' in sql]
+        self.assertTrue(ticket_selects)
+        self.assertFalse(any('ticket.description' in sql or 'JOIN' in sql for sql in ticket_selects))
+        
+        response = self.app.get(f'/api/tickets?fields=subject&cursor={data["next_cursor"]}', headers=headers)
+        self.assertEqual(len(json.loads(response.data)['tickets']), 1)
+        self.assertEqual(self.app.get('/api/tickets?fields=password', headers=headers).status_code, 400)
+    
+    def test_response_compression(self):
+        """Test large text responses are gzip-compressed with a weak ETag and small ones are not."""
+        db.session.add_all([Ticket(subject=f'Compressed {i}', description='Repetitive text ' * 20,
+                                   category_id=self.test_category.id, user_id=self.regular_user.id)
+                            for i in range(10)])
+        db.session.commit()
+        headers = {'Authorization': f'Bearer {self.get_auth_token("admin@test.com", "admin123")}',
+                   'Accept-Encoding': 'gzip'}
+        
+        plain = self.app.get('/api/tickets', headers={'Authorization': headers['Authorization']})
+        self.assertNotIn('Content-Encoding', plain.headers)
+        response = self.app.get('/api/tickets', headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertLess(len(response.data), len(plain.data) / 3)
+        self.assertEqual(response.headers['ETag'], 'W/' + plain.headers['ETag'])
+        
+        # The weak validator still revalidates the compressed representation
+        response = self.app.get('/api/tickets', headers={**headers, 'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        
+        response = self.app.get('/api/auth/me', headers=headers)
+        self.assertNotIn('Content-Encoding', response.headers)
+        
+        # Streamed exports are compressed on the fly
+        response = self.app.get('/api/export/tickets', headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(response.get_data()).splitlines()), 10)
+    
+    def test_comment_pagination(self):
+        """Test comment threads are cursor paginated, hide internal notes in SQL and batch-load authors."""
+        user_headers = {'Authorization': f'Bearer {self.get_auth_token("user@test.com", "user123")}'}
+        agent_headers = {'Authorization': f'Bearer {self.get_auth_token("agent@test.com", "agent123")}'}
+        ticket = Ticket(subject='Incident', description='Long thread', category_id=self.test_category.id,
+                        user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.flush()
+        base = datetime(2024, 1, 1)
+        for i in range(7):
+            db.session.add(Comment(content=f'Comment {i}', ticket_id=ticket.id, is_internal=i % 3 == 1,
+                                   user_id=self.agent_user.id if i % 2 else self.regular_user.id,
+                                   created_at=base + timedelta(minutes=i // 2)))
+        db.session.commit()
+        
+        def read_thread(headers, per_page):
+            contents, cursor = [], ''
+            while cursor is not None:
+                response = self.app.get(f'/api/tickets/{ticket.id}/comments?per_page={per_page}&cursor={cursor}',
+                                        headers=headers)
+                self.assertEqual(response.status_code, 200)
+                data = json.loads(response.data)
+                self.assertLessEqual(len(data['comments']), per_page)
+                contents += [comment['content'] for comment in data['comments']]
+                cursor = data['next_cursor']
+            return contents
+        
+        everything = [f'Comment {i}' for i in range(7)]
+        self.assertEqual(read_thread(agent_headers, 2), everything)
+        self.assertEqual(read_thread(user_headers, 2), [c for i, c in enumerate(everything) if i % 3 != 1])
+        
+        # Ticket detail carries the first page, without internal notes for the creator
+        app.config['COMMENTS_PAGE_SIZE'] = 3
+        try:
+            with QueryCounter() as queries:
+                response = self.app.get(f'/api/tickets/{ticket.id}', headers=user_headers)
+        finally:
+            app.config.pop('COMMENTS_PAGE_SIZE')
+        data = json.loads(response.data)['ticket']
+        self.assertEqual([c['content'] for c in data['comments']], ['Comment 0', 'Comment 2', 'Comment 3'])
+        self.assertEqual(data['comments'][1]['author']['username'], 'user')
+        self.assertEqual(data['creator']['username'], 'user')
+        # Ticket with its people, then the comment page with its authors
+        self.assertEqual(len([sql for sql in queries.statements if 'FROM ticket' in sql or 'FROM comment' in sql]), 2)
+        
+        response = self.app.get(f'/api/tickets/{ticket.id}/comments?cursor={data["comments_next_cursor"]}',
+                                headers=user_headers)
+        self.assertEqual([c['content'] for c in json.loads(response.data)['comments']], ['Comment 5', 'Comment 6'])
+        response = self.app.get(f'/api/tickets/{ticket.id}/comments?cursor=bogus', headers=user_headers)
+        self.assertEqual(response.status_code, 400)
+    
+    def test_metrics(self):
+        """Test /metrics reports per-route requests, latency and SQL statements in Prometheus text."""
+        headers = {'Authorization': f'Bearer {self.get_auth_token("agent@test.com", "agent123")}'}
+        route = '/api/tickets/<int:ticket_id>'
+        ticket = Ticket(subject='Metrics', description='Metrics test', category_id=self.test_category.id,
+                        user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        # Warm the principal and category caches so only the handler's own statements are counted
+        self.app.get(f'/api/tickets/{ticket.id}', headers=headers)
+        before = metrics.snapshot()
+        self.app.get(f'/api/tickets/{ticket.id}', headers=headers)
+        self.app.get('/api/categories', headers=headers)
+        after = metrics.snapshot()
+        
+        key = ('GET', route, 200)
+        self.assertEqual(after['requests'].get(key, 0) - before['requests'].get(key, 0), 1)
+        count, statements = after['queries'][route]
+        previous_count, previous_statements = before['queries'].get(route, (0, 0))
+        self.assertEqual(count - previous_count, 1)
+        # The ticket with its people, then the first page of comments
+        self.assertEqual(statements - previous_statements, 2)
+        self.assertEqual(after['in_flight'], 0)
+        
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn('# TYPE quickdesk_http_request_duration_seconds histogram', text)
+        self.assertIn('quickdesk_http_requests_total{method="GET",route="/api/categories",status="200"}', text)
+        self.assertIn('quickdesk_db_queries_per_request_bucket{route="/api/tickets/<int:ticket_id>",le="+Inf"}', text)
+        self.assertIn('quickdesk_http_request_duration_seconds_count{method="GET",route="/api/categories"}', text)
+        self.assertIn('quickdesk_cache_hits_total{cache="categories"}', text)
+        self.assertIn('quickdesk_event_stream_subscribers 0', text)
+        
+        app.config['METRICS_TOKEN'] = 'scrape-secret'
+        try:
+            self.assertEqual(self.app.get('/metrics').status_code, 401)
+            response = self.app.get('/metrics', headers={'Authorization': 'Bearer scrape-secret'})
+            self.assertEqual(response.status_code, 200)
+        finally:
+            app.config.pop('METRICS_TOKEN')
+    
+    def test_metrics_failed_statement(self):
+        """Test a statement that raises is counted and leaves no start time on its connection."""
+        from flask import g
+        from sqlalchemy import text
+        from sqlalchemy.exc import OperationalError
+        with app.test_request_context('/api/tickets'):
+            metrics._start()
+            connection = db.session.connection()
+            with self.assertRaises(OperationalError):
+                db.session.execute(text('SELECT * FROM missing_table'))
+            self.assertEqual(connection.info.get('metrics_query_start'), [])
+            self.assertEqual(g._metrics['queries'], 1)
+            db.session.rollback()
+        self.assertEqual(metrics.snapshot()['in_flight'], 0)
+    
+    def seed_activity(self, tickets, comments_per_ticket, users):
+        """Add users, tickets spread over them, and comments and votes on every ticket.
+        
+        Returns the id of the newest ticket of the regular user, which has the most comments and votes.
+        """
+        regular_user = User.query.filter_by(email='user@test.com').one()
+        agent_user = User.query.filter_by(email='agent@test.com').one()
+        category_id = Category.query.first().id
+        offset = User.query.count()
+        people = [User(username=f'seed{offset + i}', email=f'seed{offset + i}@test.com',
+                       password_hash=regular_user.password_hash, role='user') for i in range(users)]
+        db.session.add_all(people)
+        db.session.flush()
+        people += [regular_user, agent_user]
+        for t in range(tickets):
+            creator = regular_user if t % 2 else people[t % len(people)]
+            ticket = Ticket(subject=f'Seeded {t}', description='Seeded ticket', category_id=category_id,
+                            user_id=creator.id, assigned_to=agent_user.id if t % 3 else None)
+            db.session.add(ticket)
+            db.session.flush()
+            for c in range(comments_per_ticket):
+                db.session.add(Comment(content=f'Seeded comment {c}', ticket_id=ticket.id, is_internal=c % 4 == 3,
+                                       user_id=people[(t + c) % len(people)].id))
+            for voter in people[:t % len(people)]:
+                db.session.add(Vote(ticket_id=ticket.id, user_id=voter.id, vote_type='up'))
+            ticket.upvotes = t % len(people)
+        db.session.commit()
+        return Ticket.query.filter_by(user_id=regular_user.id).order_by(Ticket.id.desc()).first().id
+    
+    def test_query_budgets(self):
+        """Test hot endpoints run a fixed number of queries however many rows they serialize."""
+        agent_headers = {'Authorization': f'Bearer {self.get_auth_token("agent@test.com", "agent123")}'}
+        admin_headers = {'Authorization': f'Bearer {self.get_auth_token("admin@test.com", "admin123")}'}
+        user_headers = {'Authorization': f'Bearer {self.get_auth_token("user@test.com", "user123")}'}
+        budgets = {
+            'get_tickets': 2,           # count, page with creators and assignees
+            'get_tickets_summary': 2,   # page, side-loaded users
+            'get_ticket': 2,            # ticket with its people, first comment page with authors
+            'get_ticket_comments': 2,   # ticket permission check, comment page with authors
+            'vote_ticket': 5,           # ticket, existing vote, vote write, counter update, counter reload
+            'get_users': 1,
+        }
+        
+        def measure(ticket, warm_up=False):
+            requests = {
+                'get_tickets': lambda: self.app.get('/api/tickets?per_page=50', headers=agent_headers),
+                'get_tickets_summary': lambda: self.app.get('/api/tickets?view=summary&cursor=&per_page=50',
+                                                            headers=agent_headers),
+                'get_ticket': lambda: self.app.get(f'/api/tickets/{ticket}', headers=user_headers),
+                'get_ticket_comments': lambda: self.app.get(f'/api/tickets/{ticket}/comments',
+                                                            headers=agent_headers),
+                'vote_ticket': lambda: self.app.post(f'/api/tickets/{ticket}/vote',
+                                                     data=json.dumps({'vote_type': 'down'}),
+                                                     content_type='application/json', headers=admin_headers),
+                'get_users': lambda: self.app.get('/api/users', headers=admin_headers),
+            }
+            counts = {}
+            for name, send in requests.items():
+                # Each request starts with an empty session, as it would in production
+                db.session.remove()
+                with QueryCounter() if warm_up else query_budget(budgets[name]) as queries:
+                    response = send()
+                self.assertEqual(response.status_code, 200, name)
+                counts[name] = queries.count
+            return counts
+        
+        # Authenticated principals and categories are cached after the first request
+        measure(self.seed_activity(tickets=2, comments_per_ticket=2, users=2), warm_up=True)
+        
+        counts = measure(self.seed_activity(tickets=2, comments_per_ticket=2, users=2))
+        # Many more tickets, comments (more than a page), authors and voters: same queries
+        self.assertEqual(measure(self.seed_activity(tickets=40, comments_per_ticket=60, users=15)), counts)
+    
+    def next_event(self, stream):
+        """Read the next server-sent event from a streamed response, skipping keep-alives."""
+        for _ in range(5):
+            chunk = next(stream).decode()
+            if chunk.startswith('event: '):
+                event_line, data_line = chunk.strip().split('\n')
+                return event_line[len('event: '):], json.loads(data_line[len('data: '):])
+        return None, None
+    
+    def get_stream_token(self, token):
+        """Exchange a session token for an /api/events stream token."""
+        response = self.app.post('/api/events/token', headers={'Authorization': f'Bearer {token}'})
+        return json.loads(response.data)['token']
+    
+    def test_event_stream(self):
+        """Test /api/events pushes changes filtered by role and ownership."""
+        user_token = self.get_auth_token('user@test.com', 'user123')
+        agent_token = self.get_auth_token('agent@test.com', 'agent123')
+        agent_headers = {'Authorization': f'Bearer {agent_token}'}
+        self.assertEqual(self.app.get('/api/events').status_code, 401)
+        
+        # Only short-lived stream tokens go in the URL, and they open nothing but the stream
+        self.assertEqual(self.app.get(f'/api/events?token={user_token}').status_code, 401)
+        user_stream_token = self.get_stream_token(user_token)
+        self.assertEqual(self.app.get('/api/tickets', headers={
+            'Authorization': f'Bearer {user_stream_token}'}).status_code, 401)
+        
+        app.config['EVENTS_KEEPALIVE'] = 0.1
+        user_response = self.app.get(f'/api/events?token={user_stream_token}', buffered=False)
+        agent_response = self.app.get(f'/api/events?token={self.get_stream_token(agent_token)}', buffered=False)
+        try:
+            self.assertEqual(user_response.mimetype, 'text/event-stream')
+            self.assertEqual(event_hub.subscriber_count, 2)
+            user_stream, agent_stream = iter(user_response.response), iter(agent_response.response)
+            
+            # Another user's ticket is only visible to staff
+            other = Ticket(subject='Not yours', description='Events test',
+                           category_id=self.test_category.id, user_id=self.admin_user.id)
+            db.session.add(other)
+            db.session.commit()
+            self.app.put(f'/api/tickets/{other.id}', data=json.dumps({'status': 'in_progress'}),
+                         content_type='application/json', headers=agent_headers)
+            
+            response = self.app.post('/api/tickets', data=json.dumps({
+                'subject': 'Live', 'description': 'Events test', 'category_id': self.test_category.id
+            }), content_type='application/json', headers={'Authorization': f'Bearer {user_token}'})
+            ticket_id = json.loads(response.data)['ticket']['id']
+            for content, internal in (('Internal note', True), ('Public reply', False)):
+                self.app.post(f'/api/tickets/{ticket_id}/comments',
+                              data=json.dumps({'content': content, 'is_internal': internal}),
+                              content_type='application/json', headers=agent_headers)
+            self.app.post(f'/api/tickets/{ticket_id}/vote', data=json.dumps({'vote_type': 'up'}),
+                          content_type='application/json', headers=agent_headers)
+            
+            self.assertEqual(self.next_event(agent_stream), ('ticket.updated', unittest.mock.ANY))
+            self.assertEqual(self.next_event(agent_stream)[0], 'ticket.created')
+            self.assertEqual(self.next_event(agent_stream)[1]['content'], 'Internal note')
+            
+            event_type, data = self.next_event(user_stream)
+            self.assertEqual((event_type, data['id'], data['subject']), ('ticket.created', ticket_id, 'Live'))
+            event_type, data = self.next_event(user_stream)
+            self.assertEqual((event_type, data['content']), ('comment.created', 'Public reply'))
+            event_type, data = self.next_event(user_stream)
+            self.assertEqual((event_type, data), ('ticket.voted', {'ticket_id': ticket_id, 'vote_score': 1,
+                                                                   'upvotes': 1, 'downvotes': 0}))
+            self.assertEqual(self.next_event(user_stream), (None, None))
+        finally:
+            user_response.close()
+            agent_response.close()
+            app.config.pop('EVENTS_KEEPALIVE')
+        self.assertEqual(event_hub.subscriber_count, 0)
+    
+    def test_event_stream_role_change(self):
+        """Test an open stream closes, without delivering staff events, once its user is demoted."""
+        agent_token = self.get_auth_token('agent@test.com', 'agent123')
+        admin_headers = {'Authorization': f'Bearer {self.get_auth_token("admin@test.com", "admin123")}'}
+        ticket = Ticket(subject='Demotion', description='Events test', category_id=self.test_category.id,
+                        user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        
+        app.config['EVENTS_KEEPALIVE'] = 0.1
+        response = self.app.get(f'/api/events?token={self.get_stream_token(agent_token)}', buffered=False)
+        try:
+            stream = iter(response.response)
+            self.assertEqual(next(stream).decode(), 'retry: 3000\n\n')
+            self.app.put(f'/api/users/{self.agent_user.id}', data=json.dumps({'role': 'user'}),
+                         content_type='application/json', headers=admin_headers)
+            self.app.post(f'/api/tickets/{ticket.id}/comments',
+                          data=json.dumps({'content': 'Staff only', 'is_internal': True}),
+                          content_type='application/json', headers=admin_headers)
+            self.assertEqual([chunk for chunk in stream if b'Staff only' in chunk], [])
+        finally:
+            response.close()
+            app.config.pop('EVENTS_KEEPALIVE')
+        self.assertEqual(event_hub.subscriber_count, 0)
+    
+    def test_event_broker_fanout(self):
+        """Test events published in one worker reach streams held by another through the broker."""
+        from flask import Flask
+        from models import Principal
+        broker = EventBroker().start()
+        try:
+            workers = []
+            for _ in range(2):
+                worker_app = Flask(__name__)
+                worker_app.config['EVENTS_BROKER'] = '%s:%d' % broker.address
+                workers.append(EventHub(worker_app))
+            agent = workers[1].subscribe(Principal(self.agent_user))
+            user = workers[1].subscribe(Principal(self.regular_user))
+            for _ in range(50):
+                if len(broker.clients) == 2:
+                    break
+                time.sleep(0.02)
+            
+            workers[0].publish('ticket.deleted', {'id': 7}, owner_id=self.admin_user.id)
+            workers[0].publish('ticket.deleted', {'id': 8}, owner_id=self.regular_user.id)
+            self.assertEqual(agent.get(timeout=2)['data'], {'id': 7})
+            self.assertEqual(agent.get(timeout=2)['data'], {'id': 8})
+            self.assertEqual(user.get(timeout=2)['data'], {'id': 8})
+            self.assertIsNone(user.get(timeout=0.2))
+        finally:
+            broker.stop()
+    
+    def test_generate_data(self):
+        """Test the bulk generator writes consistent, skewed and reproducible data."""
+        def generate():
+            counts = datagen.generate(200, users=30, agents=5, categories=3, comments_per_ticket=4,
+                                      votes_per_ticket=3, seed=7, batch_size=64)
+            rows = db.session.query(Ticket.subject, Ticket.status, Ticket.priority, Ticket.upvotes,
+                                    Ticket.downvotes, Ticket.category_id, Ticket.user_id).order_by(Ticket.id).all()
+            return counts, rows
+        
+        with self.assertRaises(ValueError):
+            datagen.generate(10, categories=0)
+        
+        counts, rows = generate()
+        self.assertEqual((counts['users'], counts['categories'], counts['tickets']), (35, 2, 200))
+        self.assertEqual(Ticket.query.count(), 200)
+        self.assertEqual(Comment.query.count(), counts['comments'])
+        self.assertEqual(Vote.query.count(), counts['votes'])
+        self.assertGreater(counts['comments'], 0)
+        self.assertGreater(counts['votes'], 0)
+        
+        # Denormalized counters agree with the vote rows, so reconcile-votes has nothing to fix
+        before = {t.id: (t.upvotes, t.downvotes) for t in Ticket.query}
+        Ticket.rebuild_vote_counters()
+        db.session.expire_all()
+        self.assertEqual({t.id: (t.upvotes, t.downvotes) for t in Ticket.query}, before)
+        
+        late = db.session.query(Comment).join(Ticket).filter(Comment.created_at < Ticket.created_at).count()
+        self.assertEqual(late, 0)
+        
+        # A few categories carry most of the load
+        per_category = sorted(count for count, in db.session.query(db.func.count(Ticket.id)).group_by(Ticket.category_id))
+        self.assertGreater(per_category[-1], 2 * per_category[0])
+        
+        # The search index was rebuilt and the triggers restored
+        headers = {'Authorization': f'Bearer {self.get_auth_token("agent@test.com", "agent123")}'}
+        found = json.loads(self.app.get('/api/tickets?search=printer', headers=headers).data)
+        self.assertGreater(len(found['tickets']), 0)
+        ticket = Ticket(subject='Zanzibar keyboard', description='Trigger check', category_id=self.test_category.id,
+                        user_id=self.regular_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        found = json.loads(self.app.get('/api/tickets?search=zanzibar', headers=headers).data)
+        self.assertEqual([t['id'] for t in found['tickets']], [ticket.id])
+        
+        # Same seed, same data
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        self.create_test_data()
+        self.assertEqual(generate()[1], rows)
+    
     def test_admin_access(self):
         """Test admin-only endpoints."""
         admin_token = self.get_auth_token('admin@test.com', 'admin123')
@@ -12,6 +12,13 @@ class TestConfig:
     UPLOAD_FOLDER = tempfile.mkdtemp()
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
     
+    # Hash inline with a cheap cost so tests stay fast
+    PASSWORD_HASH_WORKERS = 0
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    
+    # Render thumbnails inline so tests can check them right after upload
+    THUMBNAIL_WORKERS = 0
+    
     # Disable email for tests
     MAIL_SUPPRESS_SEND = True
     MAIL_DEFAULT_SENDER = 'test@quickdesk.com'
@@ -0,0 +1,182 @@
+import unittest
+import unittest.mock
+import gzip
+import http.client
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import start_frontend
+
+
+class FrontendServerTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        """Serve a temporary frontend directory on an ephemeral port."""
+        self.root = Path(tempfile.mkdtemp())
+        patches = [
+            unittest.mock.patch.object(start_frontend, 'frontend_dir', self.root),
+            unittest.mock.patch.object(start_frontend, 'file_cache', start_frontend.FileCache()),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        
+        self.server = start_frontend.FrontendServer(('127.0.0.1', 0), start_frontend.MyHTTPRequestHandler)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=5)
+    
+    def tearDown(self):
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+    
+    def write(self, name, data, mtime=1700000000):
+        path = self.root / name
+        path.write_bytes(data)
+        os.utime(path, (mtime, mtime))
+        return path
+    
+    def request(self, path, method='GET', **headers):
+        """Send a request on the shared keep-alive connection; returns (response, body)"""
+        self.connection.request(method, path, headers=headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+    
+    def test_if_modified_since(self):
+        """Test Last-Modified is sent and an unchanged file answers If-Modified-Since with 304."""
+        self.write('app.js', b'console.log("hello");')
+        
+        response, body = self.request('/app.js')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, b'console.log("hello");')
+        self.assertEqual(response.getheader('Cache-Control'), start_frontend.ASSET_CACHE_CONTROL)
+        last_modified = response.getheader('Last-Modified')
+        self.assertIsNotNone(last_modified)
+        
+        response, body = self.request('/app.js', **{'If-Modified-Since': last_modified})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(response.getheader('Last-Modified'), last_modified)
+        
+        # A newer file is sent again, and If-None-Match takes precedence over the date
+        self.write('app.js', b'console.log("changed");', mtime=1700000100)
+        response, body = self.request('/app.js', **{'If-Modified-Since': last_modified})
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, b'console.log("changed");')
+        response, _ = self.request('/app.js', **{'If-Modified-Since': response.getheader('Last-Modified'),
+                                                 'If-None-Match': '"anything"'})
+        self.assertEqual(response.status, 200)
+        
+        # HTML is always revalidated
+        self.write('index.html', b'<html></html>')
+        response, _ = self.request('/')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Cache-Control'), start_frontend.HTML_CACHE_CONTROL)
+    
+    def test_precompressed_siblings(self):
+        """Test .br/.gz siblings are sent with Content-Encoding and Vary to clients that accept them."""
+        source = b'body { color: red; }\n' * 100
+        self.write('style.css', source)
+        self.write('style.css.gz', gzip.compress(source), mtime=1700000010)
+        self.write('style.css.br', b'brotli bytes', mtime=1700000010)
+        
+        response, body = self.request('/style.css', **{'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'br')
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        self.assertEqual(response.getheader('Content-Type'), 'text/css')
+        self.assertEqual(body, b'brotli bytes')
+        
+        response, body = self.request('/style.css', **{'Accept-Encoding': 'gzip, br;q=0'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(int(response.getheader('Content-Length')), len(body))
+        self.assertEqual(gzip.decompress(body), source)
+        
+        response, body = self.request('/style.css')
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertEqual(response.getheader('Vary'), 'Accept-Encoding')
+        self.assertEqual(body, source)
+        
+        # A sibling older than its source is stale and ignored
+        self.write('style.css', source + b'p { margin: 0; }\n', mtime=1700000020)
+        response, body = self.request('/style.css', **{'Accept-Encoding': 'gzip, br'})
+        self.assertIsNone(response.getheader('Content-Encoding'))
+        self.assertEqual(body, source + b'p { margin: 0; }\n')
+    
+    def test_file_cache_notices_changes(self):
+        """Test a cached file is served fresh once its mtime or size changes."""
+        self.write('data.json', b'{"version": 1}')
+        self.assertEqual(self.request('/data.json')[1], b'{"version": 1}')
+        self.assertEqual(self.request('/data.json')[1], b'{"version": 1}')
+        
+        # Same size, new mtime
+        self.write('data.json', b'{"version": 2}', mtime=1700000001)
+        self.assertEqual(self.request('/data.json')[1], b'{"version": 2}')
+        
+        # Same mtime, new size
+        self.write('data.json', b'{"version": 300}', mtime=1700000001)
+        self.assertEqual(self.request('/data.json')[1], b'{"version": 300}')
+        
+        # Files over the size limit are streamed rather than cached
+        with unittest.mock.patch.object(start_frontend.file_cache, 'max_file_size', 4):
+            self.assertEqual(self.request('/data.json')[1], b'{"version": 300}')
+    
+    def test_options_keeps_connection_alive(self):
+        """Test OPTIONS answers 204 with an empty body and the connection serves the next request."""
+        self.write('app.js', b'console.log("hello");')
+        response, body = self.request('/app.js', method='OPTIONS')
+        self.assertEqual(response.status, 204)
+        self.assertEqual(response.getheader('Content-Length'), '0')
+        self.assertEqual(response.getheader('Access-Control-Allow-Methods'), 'GET, POST, OPTIONS')
+        self.assertEqual(body, b'')
+        self.assertFalse(response.will_close)
+        
+        response, body = self.request('/app.js')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, b'console.log("hello");')
+    
+    def test_precompress(self):
+        """Test --precompress writes siblings for large text assets only and skips up-to-date ones."""
+        source = b'function f() { return 1; }\n' * 100
+        self.write('app.js', source)
+        self.write('small.css', b'p { margin: 0; }')
+        self.write('logo.png', b'\x89PNG' * 500)
+        self.root.joinpath('nested').mkdir()
+        self.write('nested/page.html', b'<p>hello</p>\n' * 200)
+        
+        with unittest.mock.patch.object(sys, 'argv', ['start_frontend.py', '--precompress']), \
+                unittest.mock.patch('builtins.print') as printed:
+            start_frontend.main()
+        encodings = 2 if start_frontend.brotli is not None else 1
+        printed.assert_called_once()
+        self.assertTrue(printed.call_args[0][0].startswith(f'Precompressed {2 * encodings} files'))
+        self.assertEqual(gzip.decompress(self.root.joinpath('app.js.gz').read_bytes()), source)
+        self.assertTrue(self.root.joinpath('nested', 'page.html.gz').is_file())
+        self.assertEqual(self.root.joinpath('app.js.br').is_file(), start_frontend.brotli is not None)
+        self.assertFalse(self.root.joinpath('small.css.gz').exists())
+        self.assertFalse(self.root.joinpath('logo.png.gz').exists())
+        
+        # Only assets changed since the last run are compressed again
+        self.assertEqual(start_frontend.precompress(self.root), 0)
+        for sibling in self.root.glob('app.js.*'):
+            os.utime(sibling, (1600000000, 1600000000))
+        self.assertEqual(start_frontend.precompress(self.root), encodings)
+        
+        # The server picks up the fresh sibling
+        response, body = self.request('/app.js', **{'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.decompress(body), source)
+    
+    def test_missing_file(self):
+        """Test unknown paths still get a 404."""
+        response, _ = self.request('/missing.js')
+        self.assertEqual(response.status, 404)
+
+if __name__ == '__main__':
+    unittest.main()
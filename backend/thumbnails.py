@@ -0,0 +1,138 @@
+"""Thumbnails and downscaled previews for image attachments.
+
+After an image is uploaded, a small thread pool renders WebP derivatives at
+every configured size into ``UPLOAD_FOLDER/derived/<key[:2]>/<key>/<size>.webp``,
+where the key is the stored file's name (its content hash for
+content-addressed uploads). Derivatives depend only on the bytes, so they
+are shared between identical uploads and served with a long cache lifetime.
+A request for a derivative that is not ready yet waits for the running job
+or renders it on the spot.
+
+Pillow does most of its decoding and resampling without holding the GIL, so
+threads are enough to keep the work off the request path.
+"""
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+from models import PREVIEW_TYPES as SUPPORTED_TYPES
+
+DEFAULT_SIZES = {'thumb': 200, 'preview': 1024}
+
+
+def derived_dir(upload_folder, key):
+    return os.path.join(upload_folder, 'derived', key[:2], key)
+
+
+def remove_derived(upload_folder, key):
+    shutil.rmtree(derived_dir(upload_folder, key), ignore_errors=True)
+
+
+def render(source_path, target_path, max_side, quality=80):
+    """Downscale an image to fit max_side x max_side and write it as WebP"""
+    with Image.open(source_path) as image:
+        # Lets the JPEG decoder skip detail that would be thrown away anyway
+        image.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        directory = os.path.dirname(target_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.webp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'WEBP', quality=quality, method=4)
+            os.replace(tmp_path, target_path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+class ThumbnailGenerator:
+    def __init__(self, app=None):
+        self.app = app
+        self._pool = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def config(self, key, default):
+        return self.app.config.get(key, default)
+
+    @property
+    def sizes(self):
+        return self.config('THUMBNAIL_SIZES', DEFAULT_SIZES)
+
+    def supports(self, mime_type):
+        return mime_type in SUPPORTED_TYPES
+
+    def path(self, key, size):
+        return os.path.join(derived_dir(self.config('UPLOAD_FOLDER', None), key), f'{size}.webp')
+
+    def _render_all(self, source_path, key):
+        for size, max_side in self.sizes.items():
+            target = self.path(key, size)
+            if not os.path.exists(target):
+                render(source_path, target, max_side, self.config('THUMBNAIL_QUALITY', 80))
+
+    def _job(self, source_path, key):
+        try:
+            self._render_all(source_path, key)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def submit(self, source_path, key):
+        """Queue derivative generation for a freshly stored image"""
+        workers = self.config('THUMBNAIL_WORKERS', 2)
+        if workers <= 0:
+            try:
+                self._render_all(source_path, key)
+            except Exception as e:
+                print(f"Thumbnail generation failed for {key}: {e}")
+            return
+
+        with self._lock:
+            if key in self._pending:
+                return
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnail')
+            future = self._pool.submit(self._job, source_path, key)
+            self._pending[key] = future
+        future.add_done_callback(self._log_failure(key))
+
+    @staticmethod
+    def _log_failure(key):
+        def callback(future):
+            if future.exception() is not None:
+                print(f"Thumbnail generation failed for {key}: {future.exception()}")
+        return callback
+
+    def ensure(self, source_path, key, size):
+        """Return the path of a derivative, generating it if it is missing"""
+        target = self.path(key, size)
+        if os.path.exists(target):
+            return target
+
+        with self._lock:
+            future = self._pending.get(key)
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass
+            if os.path.exists(target):
+                return target
+
+        render(source_path, target, self.sizes[size], self.config('THUMBNAIL_QUALITY', 80))
+        return target
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,132 @@
+"""Streaming export and batched import of tickets, comments and categories.
+
+Exports are flat table rows, one per line as NDJSON or CSV, ordered by id.
+Rows are read through a streaming cursor (a server-side cursor on
+PostgreSQL) in chunks of EXPORT_BATCH_SIZE and written out chunk by chunk,
+so memory stays flat whatever the table size.
+
+Imports take the same NDJSON format and insert IMPORT_BATCH_SIZE rows per
+executemany in a single transaction; a bad line rolls the whole import back.
+Ids are kept when given, so related rows can be imported in order:
+categories, then tickets, then comments. On PostgreSQL the id sequence is
+moved past the imported ids afterwards, so later inserts don't collide.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select, text
+
+from models import db, Category, Ticket, Comment
+
+ENTITIES = {
+    # name: (table, column used for incremental exports)
+    'categories': (Category.__table__, Category.__table__.c.created_at),
+    'tickets': (Ticket.__table__, Ticket.__table__.c.updated_at),
+    'comments': (Comment.__table__, Comment.__table__.c.created_at),
+}
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _format_chunk(rows, keys, fmt):
+    if fmt == 'ndjson':
+        return ''.join(json.dumps({key: _json_value(value) for key, value in zip(keys, row)}) + '\n'
+                       for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_json_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+def export_lines(entity, fmt='ndjson', since=None, batch_size=5000):
+    """Yield the rows of an entity as text chunks of about batch_size rows"""
+    table, since_column = ENTITIES[entity]
+    query = select(table).order_by(table.c.id)
+    if since is not None:
+        query = query.where(since_column >= since)
+
+    keys = [column.key for column in table.columns]
+    if fmt == 'csv':
+        yield _format_chunk([keys], keys, 'csv')
+
+    with db.engine.connect() as connection:
+        result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(query)
+        for rows in result.partitions():
+            yield _format_chunk(rows, keys, fmt)
+
+
+def _convert(table, record):
+    """Keep the known columns of a record and parse its timestamps"""
+    row = {}
+    for key, value in record.items():
+        column = table.c.get(key)
+        if column is None:
+            continue
+        if value is not None and isinstance(column.type, db.DateTime):
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'{key}: expected an ISO 8601 timestamp, got {value!r}') from None
+        row[key] = value
+    return row
+
+
+def reset_id_sequence(connection, table):
+    """Move a PostgreSQL id sequence past rows that were inserted with explicit ids"""
+    if connection.dialect.name != 'postgresql':
+        return
+    name = connection.dialect.identifier_preparer.quote(table.name)
+    connection.execute(text(
+        f"SELECT setval(pg_get_serial_sequence(:name, 'id'), coalesce(max(id), 0) + 1, false) FROM {name}"
+    ), {'name': name})
+
+
+def _insert_batch(table, rows):
+    # executemany needs the same keys in every row; missing columns get their defaults
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    for group in groups.values():
+        db.session.execute(table.insert(), group)
+
+
+def import_lines(entity, lines, batch_size=1000):
+    """Insert NDJSON records for an entity; returns the number of rows imported.
+
+    Raises ValueError naming the offending line if a record cannot be parsed.
+    """
+    table, _ = ENTITIES[entity]
+    count = 0
+    batch = []
+    try:
+        for number, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError('expected a JSON object')
+                batch.append(_convert(table, record))
+            except ValueError as e:
+                raise ValueError(f'Line {number}: {e}') from e
+
+            if len(batch) >= batch_size:
+                _insert_batch(table, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            _insert_batch(table, batch)
+            count += len(batch)
+        reset_id_sequence(db.session.connection(), table)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return count
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+QuickDesk API benchmark
+Seeds a throwaway SQLite database, serves the backend in-process on a
+threaded server and drives a mixed workload from concurrent clients.
+
+    python benchmark.py                                   # defaults, report on stdout
+    python benchmark.py --clients 16 --duration 60 --output results.json
+    python benchmark.py --save-baseline benchmark-baseline.json
+    python benchmark.py --baseline benchmark-baseline.json --threshold 0.25
+
+Every client logs in (agents and regular users alternate) and then loops
+over list/filter/search, open ticket, comment, vote and upload requests
+picked at random with WORKLOAD weights. The report gives throughput and
+p50/p95/p99 latency per operation as JSON on stdout (everything else goes
+to stderr). With --baseline, an operation with more errors or a higher
+error rate, or whose p95 grew or throughput dropped by more than
+--threshold, counts as a regression and the exit status is 1.
+
+Runs are reproducible for a given --seed: the dataset and each client's
+sequence of operations are derived from it. No external services are used.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from pathlib import Path
+
+backend_dir = Path(__file__).parent / "backend"
+
+# Relative weight of each operation in the mix
+WORKLOAD = {
+    'list_tickets': 30,
+    'filter_tickets': 15,
+    'search_tickets': 10,
+    'get_ticket': 25,
+    'create_comment': 8,
+    'vote_ticket': 8,
+    'upload_attachment': 4,
+}
+
+STATUSES = ['open', 'in_progress', 'resolved', 'closed']
+WORDS = ['printer', 'login', 'password', 'network', 'email', 'invoice', 'laptop', 'vpn', 'outage',
+         'billing', 'refund', 'crash', 'slow', 'error', 'update', 'license', 'access', 'backup']
+PASSWORD = 'benchmark123'
+
+# Operations with fewer samples than this are too noisy to compare against a baseline
+MIN_SAMPLES = 20
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def seed_database(db, password_hash, users, tickets, comments_per_ticket, seed, batch_size=1000):
+    """Load a skewed synthetic dataset with backend/datagen.py, a fifth of the users agents.
+
+    Returns {'agents': [emails], 'users': {email: [ticket ids]}, 'tickets': [ids], 'categories': [ids]}.
+    """
+    import datagen
+    from models import User, Category, Ticket
+
+    agent_count = max(1, users // 5)
+    datagen.generate(tickets, users=max(0, users - agent_count), agents=agent_count, categories=5,
+                     comments_per_ticket=comments_per_ticket, votes_per_ticket=2, days=90, seed=seed,
+                     batch_size=batch_size, password_hash=password_hash)
+
+    people = db.session.query(User.id, User.email, User.role).all()
+    emails = {p.id: p.email for p in people}
+    ticket_owners = db.session.query(Ticket.id, Ticket.user_id).all()
+    owned = {}
+    for ticket in ticket_owners:
+        owned.setdefault(emails[ticket.user_id], []).append(ticket.id)
+    return {
+        'agents': [p.email for p in people if p.role == 'agent'],
+        'users': owned,
+        'tickets': [ticket.id for ticket in ticket_owners],
+        'categories': [row.id for row in db.session.query(Category.id)],
+    }
+
+
+class Client(threading.Thread):
+    """One simulated user: logs in, then issues weighted random requests until the deadline"""
+
+    def __init__(self, base_url, email, ticket_ids, categories, seed, deadline, max_requests):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.email = email
+        self.ticket_ids = ticket_ids
+        self.categories = categories
+        self.rng = random.Random(seed)
+        self.deadline = deadline
+        self.max_requests = max_requests
+        self.token = None
+        self.samples = {}   # operation -> [seconds]
+        self.errors = {}    # operation -> count
+
+    def call(self, operation, method, path, body=None, content_type='application/json'):
+        headers = {'Accept-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        if body is not None:
+            headers['Content-Type'] = content_type
+        request = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                data = response.read()
+            ok = True
+        except (urllib.error.URLError, OSError):
+            data, ok = None, False
+        elapsed = time.perf_counter() - start
+
+        self.samples.setdefault(operation, []).append(elapsed)
+        if not ok:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+        return data
+
+    def json_call(self, operation, method, path, payload):
+        return self.call(operation, method, path, json.dumps(payload).encode())
+
+    def ticket(self):
+        return self.rng.choice(self.ticket_ids)
+
+    def list_tickets(self):
+        self.call('list_tickets', 'GET', f'/api/tickets?per_page=20&page={self.rng.randint(1, 5)}')
+
+    def filter_tickets(self):
+        self.call('filter_tickets', 'GET', f'/api/tickets?view=summary&cursor=&per_page=20'
+                                           f'&status={self.rng.choice(STATUSES)}'
+                                           f'&category_id={self.rng.choice(self.categories)}')
+
+    def search_tickets(self):
+        self.call('search_tickets', 'GET', f'/api/tickets?search={self.rng.choice(WORDS)}&per_page=20')
+
+    def get_ticket(self):
+        self.call('get_ticket', 'GET', f'/api/tickets/{self.ticket()}')
+
+    def create_comment(self):
+        self.json_call('create_comment', 'POST', f'/api/tickets/{self.ticket()}/comments',
+                       {'content': ' '.join(self.rng.choice(WORDS) for _ in range(12))})
+
+    def vote_ticket(self):
+        self.json_call('vote_ticket', 'POST', f'/api/tickets/{self.ticket()}/vote',
+                       {'vote_type': self.rng.choice(['up', 'down'])})
+
+    def upload_attachment(self):
+        boundary = uuid.uuid4().hex
+        content = ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(200, 2000))).encode()
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="notes.txt"\r\n'
+                f'Content-Type: text/plain\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+        self.call('upload_attachment', 'POST', f'/api/tickets/{self.ticket()}/attachments', body,
+                  f'multipart/form-data; boundary={boundary}')
+
+    def run(self):
+        data = self.json_call('login', 'POST', '/api/auth/login', {'email': self.email, 'password': PASSWORD})
+        if data is None:
+            return
+        self.token = json.loads(data)['token']
+        if not self.ticket_ids:
+            return
+
+        operations = list(WORKLOAD)
+        weights = [WORKLOAD[name] for name in operations]
+        issued = 0
+        while time.monotonic() < self.deadline and (not self.max_requests or issued < self.max_requests):
+            getattr(self, self.rng.choices(operations, weights)[0])()
+            issued += 1
+
+
+def summarize(clients, elapsed):
+    samples, errors = {}, {}
+    for client in clients:
+        for operation, values in client.samples.items():
+            samples.setdefault(operation, []).extend(values)
+        for operation, count in client.errors.items():
+            errors[operation] = errors.get(operation, 0) + count
+
+    endpoints = {}
+    for operation in sorted(samples):
+        values = sorted(samples[operation])
+        endpoints[operation] = {
+            'count': len(values),
+            'errors': errors.get(operation, 0),
+            'error_rate': round(errors.get(operation, 0) / len(values), 4),
+            'throughput_rps': round(len(values) / elapsed, 2),
+            'mean_ms': round(1000 * sum(values) / len(values), 2),
+            'p50_ms': round(1000 * percentile(values, 0.50), 2),
+            'p95_ms': round(1000 * percentile(values, 0.95), 2),
+            'p99_ms': round(1000 * percentile(values, 0.99), 2),
+            'max_ms': round(1000 * values[-1], 2),
+        }
+    total = sum(endpoint['count'] for endpoint in endpoints.values())
+    return {
+        'duration_s': round(elapsed, 2),
+        'total_requests': total,
+        'total_errors': sum(errors.values()),
+        'throughput_rps': round(total / elapsed, 2),
+        'endpoints': endpoints,
+    }
+
+
+def compare(report, baseline, threshold):
+    """List of regressions: more errors, or p95 or throughput worse than the baseline by more than threshold"""
+    regressions = []
+    for operation, current in report['endpoints'].items():
+        previous = baseline.get('endpoints', {}).get(operation)
+        # Errors count however few samples there are; any increase is a regression
+        previous_errors = previous['errors'] if previous else 0
+        previous_rate = previous.get('error_rate', previous_errors / max(previous['count'], 1)) if previous else 0
+        current_rate = current.get('error_rate', current['errors'] / max(current['count'], 1))
+        if current['errors'] > previous_errors or current_rate > previous_rate:
+            regressions.append(f"{operation}: errors {previous_errors} ({previous_rate:.2%}) -> "
+                               f"{current['errors']} ({current_rate:.2%})")
+        if not previous or min(current['count'], previous['count']) < MIN_SAMPLES:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f"{operation}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if operation != 'login' and current['throughput_rps'] < previous['throughput_rps'] * (1 - threshold):
+            regressions.append(f"{operation}: throughput {previous['throughput_rps']} -> "
+                               f"{current['throughput_rps']} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=50, help='seeded users, a fifth of them agents')
+    parser.add_argument('--tickets', type=int, default=2000)
+    parser.add_argument('--comments-per-ticket', type=float, default=5, help='average comments per ticket')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds to run the workload')
+    parser.add_argument('--requests', type=int, default=0, help='stop each client after this many requests')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed regression, 0.2 = 20%%')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the report as the new baseline')
+    args = parser.parse_args()
+
+    # stdout carries only the JSON report; the app's own prints (e.g. unconfigured email
+    # notifications from the server threads) go to stderr with the progress messages
+    report_stream, sys.stdout = sys.stdout, sys.stderr
+
+    workdir = tempfile.mkdtemp(prefix='quickdesk-bench-')
+    # The app reads its database URL when it is imported
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    sys.path.insert(0, str(backend_dir))
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import app, db, password_hasher
+
+    app.config.update(
+        UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+        MAIL_SUPPRESS_SEND=True,
+        MAIL_DEFAULT_SENDER='benchmark@quickdesk.local',
+    )
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    print(f"Seeding {args.tickets} tickets, {args.users} users in {workdir}", file=sys.stderr)
+    with app.app_context():
+        db.create_all()
+        dataset = seed_database(db, password_hasher.hash(PASSWORD), args.users, args.tickets,
+                                args.comments_per_ticket, args.seed)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    deadline = time.monotonic() + args.duration
+    accounts = []
+    users = sorted(dataset['users'])
+    for i in range(args.clients):
+        # Alternate agents (who see every ticket) and regular users (who see their own)
+        if i % 2 == 0 or not users:
+            email = dataset['agents'][(i // 2) % len(dataset['agents'])]
+            accounts.append((email, dataset['tickets']))
+        else:
+            email = users[(i // 2) % len(users)]
+            accounts.append((email, dataset['users'][email]))
+    clients = [Client(base_url, email, tickets, dataset['categories'], args.seed * 1000 + i, deadline, args.requests)
+               for i, (email, tickets) in enumerate(accounts)]
+
+    print(f"Running {args.clients} clients against {base_url}", file=sys.stderr)
+    start = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    report = summarize(clients, elapsed)
+    report['config'] = {key: value for key, value in vars(args).items()
+                        if key not in ('output', 'baseline', 'save_baseline')}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n')
+    else:
+        print(text, file=report_stream)
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(text + '\n')
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
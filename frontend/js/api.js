@@ -4,6 +4,11 @@ const API_BASE_URL = 'http://localhost:5000/api';
 class API {
     constructor() {
         this.baseURL = API_BASE_URL;
+        // Last response body and ETag per GET URL, revalidated with If-None-Match
+        this.etagCache = new Map();
+        this.etagCacheSize = 100;
+        this.eventSource = null;
+        this.eventHandler = null;
     }
 
     // Get auth token from localStorage
@@ -19,6 +24,65 @@ class API {
     // Remove auth token from localStorage
     removeToken() {
         localStorage.removeItem('token');
+        this.etagCache.clear();
+        this.closeEvents();
+    }
+
+    // Open the live update stream; handler(type, data) is called for every event.
+    // EventSource can't send headers, so the stream is opened with a short-lived
+    // stream token in the query string instead of the session token.
+    subscribeEvents(handler) {
+        this.closeEvents();
+        if (!this.getToken() || typeof EventSource === 'undefined') {
+            return;
+        }
+        this.eventHandler = handler;
+        this.openEventSource(handler, false);
+    }
+
+    async openEventSource(handler, reconnecting) {
+        let token;
+        try {
+            token = (await this.request('/events/token', { method: 'POST' })).token;
+        } catch (error) {
+            return;
+        }
+        // Closed or resubscribed while the token was being fetched
+        if (this.eventHandler !== handler) {
+            return;
+        }
+
+        const source = new EventSource(`${this.baseURL}/events?token=${encodeURIComponent(token)}`);
+        this.eventSource = source;
+        const types = ['ticket.created', 'ticket.updated', 'ticket.deleted',
+                       'comment.created', 'ticket.voted', 'resync'];
+        types.forEach(type => {
+            source.addEventListener(type, (e) => handler(type, JSON.parse(e.data)));
+        });
+        // Stream tokens expire quickly, so once the browser stops retrying with the
+        // old one (or the server ends the stream after a role change), get a new one
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED && this.eventSource === source) {
+                this.eventSource = null;
+                setTimeout(() => {
+                    if (this.eventHandler === handler) {
+                        this.openEventSource(handler, true);
+                    }
+                }, 3000);
+            }
+        };
+        // Anything published while disconnected was missed
+        if (reconnecting) {
+            handler('resync', {});
+        }
+    }
+
+    closeEvents() {
+        this.eventHandler = null;
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
     }
 
     // Get auth headers
@@ -43,15 +107,36 @@ class API {
             ...options
         };
 
+        const isGet = !config.method || config.method === 'GET';
+        const cached = isGet ? this.etagCache.get(url) : null;
+        if (cached) {
+            config.headers = { ...config.headers, 'If-None-Match': cached.etag };
+        }
+
         try {
             showLoading(true);
             const response = await fetch(url, config);
+
+            // Unchanged since the last fetch: reuse the body we already have
+            if (response.status === 304 && cached) {
+                return structuredClone(cached.data);
+            }
+
             const data = await response.json();
 
             if (!response.ok) {
                 throw new Error(data.message || 'API request failed');
             }
 
+            const etag = response.headers.get('ETag');
+            if (isGet && etag) {
+                this.etagCache.delete(url);
+                this.etagCache.set(url, { etag, data: structuredClone(data) });
+                if (this.etagCache.size > this.etagCacheSize) {
+                    this.etagCache.delete(this.etagCache.keys().next().value);
+                }
+            }
+
             return data;
         } catch (error) {
             console.error('API Error:', error);
@@ -105,6 +190,25 @@ class API {
         return this.request(endpoint);
     }
 
+    // Compact list rows (truncated descriptions, users and categories sent once per page),
+    // with creator/category/assignee filled back in from the lookup tables
+    async getTicketSummaries(params = {}) {
+        const response = await this.getTickets({ ...params, view: 'summary' });
+        const users = response.users || {};
+        const categories = response.categories || {};
+        response.tickets = (response.tickets || []).map(ticket => ({
+            ...ticket,
+            creator: users[ticket.user_id] || null,
+            category: categories[ticket.category_id] || null,
+            assignee: ticket.assigned_to ? users[ticket.assigned_to] || null : null
+        }));
+        return response;
+    }
+
+    async getTicketStats() {
+        return this.request('/tickets/stats');
+    }
+
     async getTicket(id) {
         return this.request(`/tickets/${id}`);
     }
@@ -135,9 +239,26 @@ class API {
         });
     }
 
+    // changes may set status, priority and assigned_to (agents and admins only)
+    async bulkUpdateTickets(ticketIds, changes) {
+        return this.request('/tickets/bulk', {
+            method: 'PUT',
+            body: JSON.stringify({ ticket_ids: ticketIds, changes: changes })
+        });
+    }
+
+    async bulkDeleteTickets(ticketIds) {
+        return this.request('/tickets/bulk', {
+            method: 'DELETE',
+            body: JSON.stringify({ ticket_ids: ticketIds })
+        });
+    }
+
     // Comment methods
-    async getComments(ticketId) {
-        return this.request(`/tickets/${ticketId}/comments`);
+    // Comments come in pages, oldest first; pass the previous page's next_cursor for the next one
+    async getComments(ticketId, cursor = '') {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        return this.request(`/tickets/${ticketId}/comments${query}`);
     }
 
     async createComment(ticketId, commentData) {
@@ -258,6 +379,26 @@ class API {
             throw error;
         }
     }
+
+    // Small WebP rendition of an image attachment ('thumb' or 'preview');
+    // the browser caches these, so repeat views cost no transfer
+    async getAttachmentThumbnail(attachmentId, size = 'thumb') {
+        const token = this.getToken();
+        const headers = {};
+        if (token) {
+            headers['Authorization'] = `Bearer ${token}`;
+        }
+
+        const response = await fetch(`${this.baseURL}/attachments/${attachmentId}/thumbnail?size=${size}`, {
+            headers: headers
+        });
+
+        if (!response.ok) {
+            throw new Error('Preview failed');
+        }
+
+        return response.blob();
+    }
 }
 
 // Create global API instance
@@ -307,6 +448,17 @@ function formatDate(dateString) {
     return date.toLocaleDateString() + ' ' + date.toLocaleTimeString();
 }
 
+// Render a search snippet as HTML, keeping only the server's highlight marks
+function formatSearchSnippet(snippet) {
+    const escaped = snippet
+        .replace(/&/g, '&amp;')
+        .replace(/</g, '&lt;')
+        .replace(/>/g, '&gt;');
+    return escaped
+        .replace(/&lt;mark&gt;/g, '<mark>')
+        .replace(/&lt;\/mark&gt;/g, '</mark>');
+}
+
 // Format relative time utility
 function formatRelativeTime(dateString) {
     const date = new Date(dateString);
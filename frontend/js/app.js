@@ -5,6 +5,9 @@ class QuickDeskApp {
         this.categories = [];
         this.navigationHistory = [];
         this.historyIndex = -1;
+        this.currentTicketId = null;
+        this.commentsCursor = null;
+        this.liveRefreshTimer = null;
         this.init();
     }
 
@@ -76,6 +79,10 @@ class QuickDeskApp {
             this.currentPage = pageName;
             clearAlerts();
 
+            if (authManager.isLoggedIn() && !api.eventHandler) {
+                api.subscribeEvents((type, data) => this.handleLiveEvent(type, data));
+            }
+
             // Wait for DOM to be ready
             if (document.readyState === 'loading') {
                 console.log('DOM not ready, waiting...');
@@ -629,21 +636,19 @@ class QuickDeskApp {
 
     async loadDashboardData() {
         try {
-            // Load actual ticket data from the API
-            const response = await api.getTickets();
+            // Counts come from the server-side aggregate, the list only needs the latest few
+            const [statsResponse, response] = await Promise.all([
+                api.getTicketStats(),
+                api.getTicketSummaries({ per_page: 5 })
+            ]);
+            const stats = statsResponse.stats;
             const tickets = response.tickets || [];
 
-            // Calculate statistics
-            const totalTickets = tickets.length;
-            const openTickets = tickets.filter(t => t.status === 'open').length;
-            const inProgressTickets = tickets.filter(t => t.status === 'in_progress').length;
-            const resolvedTickets = tickets.filter(t => t.status === 'resolved').length;
-
             // Update dashboard stats
-            document.getElementById('total-tickets').textContent = totalTickets;
-            document.getElementById('open-tickets').textContent = openTickets;
-            document.getElementById('in-progress-tickets').textContent = inProgressTickets;
-            document.getElementById('resolved-tickets').textContent = resolvedTickets;
+            document.getElementById('total-tickets').textContent = stats.total;
+            document.getElementById('open-tickets').textContent = stats.by_status.open || 0;
+            document.getElementById('in-progress-tickets').textContent = stats.by_status.in_progress || 0;
+            document.getElementById('resolved-tickets').textContent = stats.by_status.resolved || 0;
 
             // Display recent tickets
             const recentTicketsContainer = document.getElementById('recent-tickets');
@@ -658,7 +663,7 @@ class QuickDeskApp {
             } else {
                 const recentTickets = tickets.slice(0, 5); // Show last 5 tickets
                 recentTicketsContainer.innerHTML = recentTickets.map(ticket => `
-                    <div class="card mb-2 ticket-card" onclick="showTicketDetail(${ticket.id})">
+                    <div class="card mb-2 ticket-card" data-ticket-id="${ticket.id}" onclick="showTicketDetail(${ticket.id})">
                         <div class="card-body">
                             <div class="d-flex justify-content-between align-items-start">
                                 <div>
@@ -669,7 +674,7 @@ class QuickDeskApp {
                                         <i class="fas fa-clock"></i> ${formatRelativeTime(ticket.created_at)}
                                     </small>
                                 </div>
-                                <div class="text-end">
+                                <div class="text-end ticket-badges" data-status="${ticket.status}" data-priority="${ticket.priority}">
                                     ${getStatusBadge(ticket.status)}
                                     ${getPriorityBadge(ticket.priority)}
                                 </div>
@@ -717,6 +722,7 @@ class QuickDeskApp {
                 <div class="col-md-3">
                     <select class="form-select" id="sort-tickets">
                         <option value="created_at_desc">Newest First</option>
+                        <option value="relevance">Best Match</option>
                         <option value="created_at_asc">Oldest First</option>
                         <option value="updated_at_desc">Recently Updated</option>
                     </select>
@@ -748,7 +754,7 @@ class QuickDeskApp {
     async loadMyTickets() {
         try {
             const filters = this.getTicketFilters();
-            const response = await api.getTickets(filters);
+            const response = await api.getTicketSummaries(filters);
             const tickets = response.tickets || [];
 
             const container = document.getElementById('tickets-container');
@@ -768,19 +774,19 @@ class QuickDeskApp {
             }
 
             container.innerHTML = tickets.map(ticket => `
-                <div class="card mb-3 ticket-card">
+                <div class="card mb-3 ticket-card" data-ticket-id="${ticket.id}">
                     <div class="card-body">
                         <div class="row">
                             <div class="col-md-8" onclick="showTicketDetail(${ticket.id})" style="cursor: pointer;">
                                 <h5 class="card-title">${ticket.subject}</h5>
-                                <p class="card-text text-muted">${ticket.description.substring(0, 150)}...</p>
+                                <p class="card-text text-muted">${ticket.search_snippet ? formatSearchSnippet(ticket.search_snippet) : ticket.description.substring(0, 150) + '...'}</p>
                                 <small class="text-muted">
                                     <i class="fas fa-tag"></i> ${ticket.category?.name || 'No Category'} •
                                     <i class="fas fa-clock"></i> ${formatRelativeTime(ticket.created_at)}
                                 </small>
                             </div>
                             <div class="col-md-4 text-end">
-                                <div class="mb-2">
+                                <div class="mb-2 ticket-badges" data-status="${ticket.status}" data-priority="${ticket.priority}">
                                     ${getStatusBadge(ticket.status)}
                                     ${getPriorityBadge(ticket.priority)}
                                 </div>
@@ -819,6 +825,8 @@ class QuickDeskApp {
         try {
             const response = await api.getTicket(ticketId);
             const ticket = response.ticket;
+            this.currentTicketId = ticket.id;
+            this.commentsCursor = ticket.comments_next_cursor;
 
             const container = document.getElementById('ticket-detail-container');
             container.innerHTML = `
@@ -835,7 +843,7 @@ class QuickDeskApp {
                                         </small>
                                     </div>
                                     <div class="d-flex align-items-center gap-2">
-                                        <div class="me-2">
+                                        <div class="me-2 ticket-badges" data-status="${ticket.status}" data-priority="${ticket.priority}">
                                             ${getStatusBadge(ticket.status)}
                                             ${getPriorityBadge(ticket.priority)}
                                         </div>
@@ -873,18 +881,15 @@ class QuickDeskApp {
                                 <h6>Comments</h6>
                                 <div id="comments-container">
                                     ${ticket.comments && ticket.comments.length > 0 ?
-                                        ticket.comments.map(comment => `
-                                            <div class="comment-item">
-                                                <div class="d-flex justify-content-between">
-                                                    <strong>${comment.author?.username || 'Unknown'}</strong>
-                                                    <small class="text-muted">${formatRelativeTime(comment.created_at)}</small>
-                                                </div>
-                                                <p class="mt-2">${comment.content}</p>
-                                            </div>
-                                        `).join('') :
+                                        ticket.comments.map(comment => this.renderComment(comment)).join('') :
                                         '<p class="text-muted">No comments yet.</p>'
                                     }
                                 </div>
+                                <button id="load-more-comments" class="btn btn-sm btn-outline-secondary mt-2"
+                                        style="display: ${ticket.comments_next_cursor ? 'inline-block' : 'none'};"
+                                        onclick="app.loadMoreComments(${ticket.id})">
+                                    Load more comments
+                                </button>
 
                                 <form id="comment-form" class="mt-3">
                                     <div class="mb-3">
@@ -946,6 +951,105 @@ class QuickDeskApp {
         }
     }
 
+    renderComment(comment) {
+        return `
+            <div class="comment-item" data-comment-id="${comment.id}">
+                <div class="d-flex justify-content-between">
+                    <strong>${comment.author?.username || 'Unknown'}</strong>
+                    <small class="text-muted">${formatRelativeTime(comment.created_at)}</small>
+                </div>
+                <p class="mt-2">${comment.content}</p>
+            </div>
+        `;
+    }
+
+    async loadMoreComments(ticketId) {
+        try {
+            const response = await api.getComments(ticketId, this.commentsCursor);
+            const container = document.getElementById('comments-container');
+            response.comments
+                .filter(comment => !container.querySelector(`[data-comment-id="${comment.id}"]`))
+                .forEach(comment => container.insertAdjacentHTML('beforeend', this.renderComment(comment)));
+            this.commentsCursor = response.next_cursor;
+            document.getElementById('load-more-comments').style.display = this.commentsCursor ? 'inline-block' : 'none';
+        } catch (error) {
+            showAlert(error.message, 'danger');
+        }
+    }
+
+    // Apply a server-sent event to whatever is on screen instead of reloading the page
+    handleLiveEvent(type, data) {
+        const ticketId = type === 'comment.created' || type === 'ticket.voted' ? data.ticket_id : data.id;
+        const cards = document.querySelectorAll(`.ticket-card[data-ticket-id="${ticketId}"]`);
+        const onDetail = this.currentPage === 'ticket-detail' && this.currentTicketId === ticketId;
+
+        switch (type) {
+        case 'ticket.updated':
+            if (data.status || data.priority) {
+                const badges = onDetail ? document.querySelectorAll('#ticket-detail-container .ticket-badges') : [];
+                [...cards].map(card => card.querySelector('.ticket-badges')).concat([...badges])
+                    .filter(el => el)
+                    .forEach(el => {
+                        el.dataset.status = data.status || el.dataset.status;
+                        el.dataset.priority = data.priority || el.dataset.priority;
+                        el.innerHTML = `${getStatusBadge(el.dataset.status)} ${getPriorityBadge(el.dataset.priority)}`;
+                    });
+            }
+            if (cards.length === 0) {
+                this.scheduleLiveRefresh();
+            }
+            break;
+        case 'ticket.deleted':
+            cards.forEach(card => card.remove());
+            if (onDetail) {
+                showAlert('This ticket has been deleted', 'warning');
+                showPage('dashboard');
+            }
+            break;
+        case 'ticket.voted':
+            cards.forEach(card => {
+                const score = card.querySelector('.vote-score');
+                if (score) score.textContent = data.vote_score;
+            });
+            if (onDetail) {
+                document.getElementById('vote-score').textContent = data.vote_score;
+                document.getElementById('vote-details').textContent =
+                    `${data.upvotes} upvotes, ${data.downvotes} downvotes`;
+            }
+            break;
+        case 'comment.created': {
+            const container = document.getElementById('comments-container');
+            // While older pages are still unloaded, the new comment arrives with the last page
+            if (onDetail && container && !this.commentsCursor &&
+                !container.querySelector(`[data-comment-id="${data.id}"]`)) {
+                if (!container.querySelector('.comment-item')) {
+                    container.innerHTML = '';
+                }
+                container.insertAdjacentHTML('beforeend', this.renderComment(data));
+            }
+            break;
+        }
+        case 'ticket.created':
+        case 'resync':
+            this.scheduleLiveRefresh();
+            break;
+        }
+    }
+
+    // Reload the current ticket list once a burst of events has settled
+    scheduleLiveRefresh() {
+        clearTimeout(this.liveRefreshTimer);
+        this.liveRefreshTimer = setTimeout(() => {
+            if (this.currentPage === 'dashboard') {
+                this.loadDashboardData();
+            } else if (this.currentPage === 'my-tickets') {
+                this.loadMyTickets();
+            } else if (this.currentPage === 'all-tickets') {
+                this.loadAllTickets();
+            }
+        }, 1000);
+    }
+
     setupCommentForm(ticketId) {
         const form = document.getElementById('comment-form');
         form.addEventListener('submit', async (e) => {
@@ -958,10 +1062,11 @@ class QuickDeskApp {
             }
 
             try {
-                await api.createComment(ticketId, { content });
+                const response = await api.createComment(ticketId, { content });
                 showAlert('Comment added successfully', 'success');
-                // Reload ticket detail to show new comment
-                await this.loadTicketDetail(ticketId);
+                document.getElementById('comment-content').value = '';
+                // Add it below the thread, unless the live update stream already did
+                this.handleLiveEvent('comment.created', response.comment);
             } catch (error) {
                 showAlert(error.message, 'danger');
             }
@@ -1046,6 +1151,7 @@ class QuickDeskApp {
                 <div class="col-md-2">
                     <select class="form-select" id="sort-all-tickets">
                         <option value="created_at_desc">Newest First</option>
+                        <option value="relevance">Best Match</option>
                         <option value="created_at_asc">Oldest First</option>
                         <option value="updated_at_desc">Recently Updated</option>
                         <option value="priority_desc">Priority</option>
@@ -1066,7 +1172,7 @@ class QuickDeskApp {
     async loadAllTickets() {
         try {
             const filters = this.getAllTicketFilters();
-            const response = await api.getTickets(filters);
+            const response = await api.getTicketSummaries(filters);
             const tickets = response.tickets || [];
 
             const container = document.getElementById('all-tickets-container');
@@ -1083,12 +1189,12 @@ class QuickDeskApp {
             }
 
             container.innerHTML = tickets.map(ticket => `
-                <div class="card mb-3 ticket-card" onclick="showTicketDetail(${ticket.id})">
+                <div class="card mb-3 ticket-card" data-ticket-id="${ticket.id}" onclick="showTicketDetail(${ticket.id})">
                     <div class="card-body">
                         <div class="row">
                             <div class="col-md-6">
                                 <h5 class="card-title">${ticket.subject}</h5>
-                                <p class="card-text text-muted">${ticket.description.substring(0, 120)}...</p>
+                                <p class="card-text text-muted">${ticket.search_snippet ? formatSearchSnippet(ticket.search_snippet) : ticket.description.substring(0, 120) + '...'}</p>
                                 <small class="text-muted">
                                     <i class="fas fa-user"></i> ${ticket.creator?.username || 'Unknown'} •
                                     <i class="fas fa-tag"></i> ${ticket.category?.name || 'No Category'} •
@@ -1096,7 +1202,7 @@ class QuickDeskApp {
                                 </small>
                             </div>
                             <div class="col-md-3">
-                                <div class="mb-2">
+                                <div class="mb-2 ticket-badges" data-status="${ticket.status}" data-priority="${ticket.priority}">
                                     ${getStatusBadge(ticket.status)}
                                     ${getPriorityBadge(ticket.priority)}
                                 </div>
@@ -1458,8 +1564,12 @@ class QuickDeskApp {
 
             container.innerHTML = attachments.map(attachment => `
                 <div class="d-flex justify-content-between align-items-center border-bottom py-2">
-                    <div>
-                        <i class="fas fa-file me-2"></i>
+                    <div class="d-flex align-items-center">
+                        ${attachment.has_preview
+                            ? `<img class="attachment-thumbnail me-2 rounded" data-attachment-id="${attachment.id}"
+                                    alt="" width="48" height="48" style="object-fit: cover; cursor: pointer;"
+                                    onclick="previewAttachment(${attachment.id})">`
+                            : '<i class="fas fa-file me-2"></i>'}
                         <strong>${attachment.original_filename}</strong>
                         <small class="text-muted ms-2">(${this.formatFileSize(attachment.file_size)})</small>
                     </div>
@@ -1469,6 +1579,16 @@ class QuickDeskApp {
                 </div>
             `).join('');
 
+            // Thumbnails need the auth header, so they are fetched as blobs
+            container.querySelectorAll('img.attachment-thumbnail').forEach(async img => {
+                try {
+                    const blob = await api.getAttachmentThumbnail(img.dataset.attachmentId, 'thumb');
+                    img.src = window.URL.createObjectURL(blob);
+                } catch (error) {
+                    img.replaceWith(Object.assign(document.createElement('i'), {className: 'fas fa-file me-2'}));
+                }
+            });
+
         } catch (error) {
             console.error('Failed to load attachments:', error);
             document.getElementById('attachments-container').innerHTML =
@@ -1766,6 +1886,16 @@ async function downloadAttachment(attachmentId) {
     }
 }
 
+// Open the downscaled preview of an image attachment
+async function previewAttachment(attachmentId) {
+    try {
+        const blob = await api.getAttachmentThumbnail(attachmentId, 'preview');
+        window.open(window.URL.createObjectURL(blob), '_blank');
+    } catch (error) {
+        showAlert('Preview failed: ' + error.message, 'danger');
+    }
+}
+
 // Global vote function
 async function voteTicket(ticketId, voteType) {
     try {
@@ -2,21 +2,140 @@
 """
 Simple HTTP server to serve the frontend files
 Run this to serve the frontend on http://localhost:8000
+
+    python start_frontend.py --precompress   # write .gz/.br siblings of text assets, then exit
+
+When a precompressed sibling is present and newer than its source, it is
+served instead of the source to clients that accept that encoding.
+
+Connections are handled on their own threads with HTTP/1.1 keep-alive, so
+a slow client only ties up its own thread. Small files are kept in memory
+until their mtime or size changes; larger ones are sent with sendfile.
+Last-Modified is set on every file and If-Modified-Since gets a 304.
 """
 
+import argparse
+import gzip
 import http.server
-import socketserver
+import io
+import mimetypes
 import os
+import threading
 import webbrowser
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
 
-# Change to frontend directory
+try:
+    import brotli
+except ImportError:  # optional; .gz siblings are always built
+    brotli = None
+
+# Directory being served
 frontend_dir = Path(__file__).parent / "frontend"
-os.chdir(frontend_dir)
 
 PORT = 8000
 
+# Text assets worth compressing, and the smallest size worth it
+COMPRESSIBLE_SUFFIXES = {'.html', '.js', '.css', '.svg', '.json', '.txt'}
+PRECOMPRESS_MIN_SIZE = 1024
+
+# HTML is always revalidated so new deployments are picked up; other assets may be reused for a day
+HTML_CACHE_CONTROL = 'no-cache'
+ASSET_CACHE_CONTROL = 'public, max-age=86400'
+
+# In-memory file cache limits
+CACHE_MAX_FILE_SIZE = 1024 * 1024
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+
+class FileCache:
+    """Contents of small files, reused until the file's mtime or size changes"""
+
+    def __init__(self, max_file_size=CACHE_MAX_FILE_SIZE, max_bytes=CACHE_MAX_BYTES):
+        self.max_file_size = max_file_size
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, stat):
+        """Return the file's bytes, or None if it is too large to cache"""
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(path)
+                return entry[1]
+        if stat.st_size > self.max_file_size:
+            return None
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        if len(data) != stat.st_size:
+            # Changed while being read; serve it but don't cache a torn copy
+            return data
+
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self.size -= len(previous[1])
+            self._entries[path] = (version, data)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+        return data
+
+
+file_cache = FileCache()
+
+
+def precompress(root):
+    """Write .gz (and .br when brotli is installed) next to every compressible asset"""
+    written = 0
+    for path in Path(root).rglob('*'):
+        if path.suffix not in COMPRESSIBLE_SUFFIXES or not path.is_file():
+            continue
+        if path.stat().st_size < PRECOMPRESS_MIN_SIZE:
+            continue
+        data = path.read_bytes()
+        encoders = {'.gz': lambda d: gzip.compress(d, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            encoders['.br'] = lambda d: brotli.compress(d, quality=11)
+        for suffix, encode in encoders.items():
+            target = path.with_name(path.name + suffix)
+            if target.exists() and target.stat().st_mtime >= path.stat().st_mtime:
+                continue
+            target.write_bytes(encode(data))
+            written += 1
+    return written
+
+
+def accepted_encodings(header):
+    """Encodings an Accept-Encoding header allows (q > 0)"""
+    accepted = set()
+    for item in (header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name and quality > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
 class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+    # Keep-alive; idle connections are closed after `timeout` seconds
+    protocol_version = 'HTTP/1.1'
+    timeout = 30
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=str(frontend_dir), **kwargs)
+
     def end_headers(self):
         # Add CORS headers
         self.send_header('Access-Control-Allow-Origin', '*')
@@ -25,19 +144,120 @@ class MyHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
         super().end_headers()
 
     def do_OPTIONS(self):
-        self.send_response(200)
+        # Keep-alive connections need an explicit empty body
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
-if __name__ == "__main__":
-    with socketserver.TCPServer(("", PORT), MyHTTPRequestHandler) as httpd:
-        print(f"Frontend server running at http://localhost:{PORT}")
+    def resolve_file(self):
+        """Filesystem path of the requested file, following directory index pages"""
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.split('?', 1)[0].endswith('/'):
+            path = os.path.join(path, 'index.html')
+        return path if os.path.isfile(path) else None
+
+    def precompressed(self, path):
+        """(encoding, sibling path) of the best up-to-date precompressed file, if any"""
+        accepted = accepted_encodings(self.headers.get('Accept-Encoding'))
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            sibling = path + suffix
+            if encoding in accepted and os.path.isfile(sibling) \
+                    and os.path.getmtime(sibling) >= os.path.getmtime(path):
+                return encoding, sibling
+        return None, None
+
+    def not_modified(self, last_modified):
+        header = self.headers.get('If-Modified-Since')
+        if not header or self.headers.get('If-None-Match'):
+            return False
+        try:
+            since = parsedate_to_datetime(header)
+        except (TypeError, ValueError):
+            return False
+        return since is not None and int(last_modified) <= since.timestamp()
+
+    def send_head(self):
+        path = self.resolve_file()
+        if path is None:
+            # Directory listings, redirects and 404s
+            return super().send_head()
+
+        suffix = os.path.splitext(path)[1]
+        encoding, sibling = self.precompressed(path) if suffix in COMPRESSIBLE_SUFFIXES else (None, None)
+        served = sibling or path
+        try:
+            stat = os.stat(served)
+            last_modified = os.path.getmtime(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        status = 304 if self.not_modified(last_modified) else 200
+        body = f = None
+        if status == 200:
+            body = file_cache.get(served, stat)
+            if body is None:
+                try:
+                    f = open(served, 'rb')
+                except OSError:
+                    self.send_error(404, "File not found")
+                    return None
+
+        self.send_response(status)
+        self.send_header('Last-Modified', formatdate(last_modified, usegmt=True))
+        self.send_header('Cache-Control', HTML_CACHE_CONTROL if suffix == '.html' else ASSET_CACHE_CONTROL)
+        if suffix in COMPRESSIBLE_SUFFIXES:
+            self.send_header('Vary', 'Accept-Encoding')
+        if status == 304:
+            self.end_headers()
+            return None
+
+        self.send_header('Content-Type', mimetypes.guess_type(path)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(len(body) if body is not None else os.fstat(f.fileno()).st_size))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        return io.BytesIO(body) if body is not None else f
+
+    def copyfile(self, source, outputfile):
+        if isinstance(source, io.BytesIO):
+            return super().copyfile(source, outputfile)
+        # Large files go straight from the page cache to the socket
+        self.request.sendfile(source)
+
+
+class FrontendServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--precompress', action='store_true',
+                        help='write .gz/.br siblings of text assets and exit')
+    parser.add_argument('--no-browser', action='store_true')
+    args = parser.parse_args()
+
+    if args.precompress:
+        count = precompress(frontend_dir)
+        print(f"Precompressed {count} files{'' if brotli else ' (install brotli for .br files)'}")
+        return
+
+    with FrontendServer(("", args.port), MyHTTPRequestHandler) as httpd:
+        print(f"Frontend server running at http://localhost:{args.port}")
         print("Press Ctrl+C to stop the server")
-        
+
         # Automatically open browser
-        webbrowser.open(f'http://localhost:{PORT}')
-        
+        if not args.no_browser:
+            webbrowser.open(f'http://localhost:{args.port}')
+
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\nServer stopped.")
             httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()